@@ -0,0 +1,119 @@
+# benchmarks/codec.py - Martin Bukowski - 2023-08-26
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+from bird.core.api import OAIApi, DEFAULT_STOP
+from bird.core.codec import CODECS
+from bird.core.generator import PhraseWizard
+from bird.core.prompter import Prompter
+from bird.core.rookery import Rookery
+from .run import BIRD_DATA_PATH, PROMPT_DATA_PATH, BIRD_NAME, STYLES, MAX_TOKENS
+
+DEFAULT_NUMBER = 20000
+DEFAULT_REPEAT = 5
+DEFAULT_CHOICES = 1
+
+def build_prompt() -> str:
+    """Build a real prompt for the benchmark bird from the bundled data."""
+    rookery = Rookery.from_config(bird_data_path=BIRD_DATA_PATH)
+    prompter = Prompter.from_config(prompt_data_path=PROMPT_DATA_PATH)
+    wizard = PhraseWizard.factory(api=None, rookery=rookery)
+    bird = rookery.get_bird(BIRD_NAME)
+    prompts, styles = wizard.compose(bird=bird, styles=list(STYLES), prompter=prompter)
+    return wizard.build_prompt(bird=bird, prompts=prompts, styles=styles)
+
+def build_response(choices: int) -> bytes:
+    """A completion response body like the fake server's, with `choices` choices."""
+    return json.dumps({
+        "id": "cmpl-benchmark",
+        "object": "text_completion",
+        "created": 0,
+        "model": "fake",
+        "choices": [{"text": f"Thou art a knave of the {i}th degree, a fool in motley!", "index": i,
+                     "logprobs": None, "finish_reason": "stop"} for i in range(choices)],
+        "usage": {"prompt_tokens": 300, "completion_tokens": 16 * choices, "total_tokens": 300 + 16 * choices},
+    }).encode("utf-8")
+
+def baseline_payload(prompt: str) -> bytes:
+    """How payloads were built before the codec layer: a dict serialized by `json.dumps`, then encoded."""
+    return json.dumps({"prompt": prompt, "stop": DEFAULT_STOP, "max_tokens": MAX_TOKENS}).encode("utf-8")
+
+def baseline_parse(body: bytes) -> List[str]:
+    """How responses were parsed before the codec layer: decoded to a str, then parsed by `json.loads`."""
+    choices = json.loads(body.decode("utf-8"))["choices"]
+    choices = sorted(enumerate(choices), key=lambda item: item[1].get("index", item[0]))
+    return [choice["text"] for _, choice in choices]
+
+def time_op(op: Callable[[], Any], number: int, repeat: int) -> float:
+    """The best microseconds per call of `op` over `repeat` rounds of `number` calls."""
+    return min(timeit.repeat(op, number=number, repeat=repeat)) / number * 1e6
+
+def available_codecs() -> List[str]:
+    """The names of the codecs whose libraries are installed."""
+    names = []
+    for name in CODECS:
+        try:
+            CODECS[name]()
+            names.append(name)
+        except ImportError:
+            continue
+    return names
+
+def run(number: int = DEFAULT_NUMBER, repeat: int = DEFAULT_REPEAT, choices: int = DEFAULT_CHOICES) -> List[Dict[str, Any]]:
+    """Time building a payload and parsing a response, before the codec layer and with each installed codec.
+
+    Returns:
+        List[Dict[str, Any]]: The microseconds per build, per parse and per round trip of each path, with the
+            speedup of the round trip over the baseline.
+    """
+    prompt = build_prompt()
+    body = build_response(choices)
+    results = [{"codec": "baseline", "build_us": time_op(lambda: baseline_payload(prompt), number, repeat),
+                "parse_us": time_op(lambda: baseline_parse(body), number, repeat)}]
+    for name in available_codecs():
+        api = OAIApi(api_key="benchmark", endpoint="http://127.0.0.1:9/", max_tokens=MAX_TOKENS, json_codec=name)
+        if json.loads(api.build_payload(prompt)) != json.loads(baseline_payload(prompt)):
+            raise RuntimeError(f"The {name} codec builds a different payload")
+        results.append({"codec": name, "build_us": time_op(lambda: api.build_payload(prompt), number, repeat),
+                        "parse_us": time_op(lambda: api.parse_choices(200, body), number, repeat)})
+        api.close()
+    for result in results:
+        result["total_us"] = result["build_us"] + result["parse_us"]
+        result["speedup"] = results[0]["total_us"] / result["total_us"]
+    return results
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the codec micro-benchmark, returning the process exit code."""
+    parser = argparse.ArgumentParser(description="Benchmark payload building and response parsing.")
+    parser.add_argument("-n", "--number", type=int, default=DEFAULT_NUMBER, help="Calls per timing round.")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT, help="Timing rounds; the best is kept.")
+    parser.add_argument("-c", "--choices", type=int, default=DEFAULT_CHOICES, help="Choices in the parsed response.")
+    parser.add_argument("-o", "--output", default="-", help="File to write JSON results to, or - for stdout.")
+    args = parser.parse_args(argv)
+
+    results = run(number=args.number, repeat=args.repeat, choices=args.choices)
+    for result in results:
+        print(f"{result['codec']}: build {result['build_us']:.2f}us, parse {result['parse_us']:.2f}us, "
+              f"{result['speedup']:.2f}x", file=sys.stderr)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "choices": args.choices,
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
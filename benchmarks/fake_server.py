@@ -0,0 +1,176 @@
+# benchmarks/fake_server.py - Martin Bukowski - 2023-08-26
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+DEFAULT_LATENCY = 0.05
+DEFAULT_TOKENS = 16
+WORDS = ["squawk", "feather", "worm", "nest", "sky", "branch", "song", "wing", "beak", "dawn", "seed", "breeze"]
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    """A threaded HTTP server with an accept backlog deep enough for bursts of new connections."""
+
+    request_queue_size = 1024
+    daemon_threads = True
+
+class FakeCompletionServer:
+    """A local OpenAI-compatible completion server with a configurable cost per request.
+
+    Each completion is `tokens` words long. The server waits `latency` seconds before answering, then spends
+    `tokens / token_rate` seconds producing the text, spread between the events of a streaming response. A
+    fraction `error_rate` of requests fail with a 503.
+    """
+
+    def __init__(self, latency: float = DEFAULT_LATENCY, token_rate: Optional[float] = None,
+                 tokens: int = DEFAULT_TOKENS, error_rate: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 seed: Optional[int] = None):
+        """Initialize a new FakeCompletionServer.
+
+        Args:
+            latency (float): Seconds before the first token.
+            token_rate (Optional[float]): Tokens generated per second, or None to generate instantly.
+            tokens (int): Tokens per completion choice.
+            error_rate (float): The fraction of requests that fail with a 503.
+            host (str): The address to listen on.
+            port (int): The port to listen on; 0 picks a free port.
+            seed (Optional[int]): Seed for the error sampling and the generated words.
+        """
+        self.latency = latency
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.httpd = FakeHTTPServer((host, port), self.create_handler())
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> 'FakeCompletionServer':
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-completion-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and release the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self) -> 'FakeCompletionServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def make_words(self, count: Optional[int] = None) -> List[str]:
+        with self.lock:
+            return [self.random.choice(WORDS) for _ in range(self.tokens if count is None else count)]
+
+    def create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.should_fail():
+                    self.send_body(503, b'{"error": "overloaded"}')
+                elif payload.get("stream"):
+                    self.stream()
+                else:
+                    self.complete(payload)
+
+            def complete(self, payload):
+                prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+                count = len(prompts) * payload.get("n", 1)
+                if server.token_rate:
+                    # Choices are generated in parallel, as by a batching model server
+                    time.sleep(server.tokens / server.token_rate)
+                # Completions longer than max_tokens are cut off, as a real server does
+                limit = payload.get("max_tokens") or server.tokens
+                finish_reason = "length" if server.tokens >= limit else "stop"
+                choices = [{"index": i, "text": " ".join(server.make_words(min(server.tokens, limit))),
+                            "finish_reason": finish_reason} for i in range(count)]
+                self.send_body(200, json.dumps({"choices": choices}).encode("utf-8"))
+
+            def stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self.wfile.flush()
+                delay = 1.0 / server.token_rate if server.token_rate else 0.0
+                for i, word in enumerate(server.make_words()):
+                    if delay:
+                        time.sleep(delay)
+                    self.write_event(json.dumps({"choices": [{"index": 0, "text": (" " if i else "") + word}]}))
+                self.write_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def write_event(self, data: str):
+                event = f"data: {data}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+
+            def send_body(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    """Run the fake server in the foreground."""
+    parser = argparse.ArgumentParser(description="Serve fake completions for benchmarking.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("-p", "--port", type=int, default=8081, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds before the first token.")
+    parser.add_argument("--token-rate", type=float, default=None, help="Tokens generated per second.")
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS, help="Tokens per completion.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail with a 503.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+    args = parser.parse_args()
+
+    server = FakeCompletionServer(latency=args.latency, token_rate=args.token_rate, tokens=args.tokens,
+                                  error_rate=args.error_rate, host=args.host, port=args.port, seed=args.seed)
+    print(f"Serving fake completions on {server.endpoint}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
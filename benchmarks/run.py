@@ -0,0 +1,326 @@
+# benchmarks/run.py - Martin Bukowski - 2023-08-26
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from bird.core.api import OAIApi, AsyncOAIApi, OAIApiException, DEFAULT_MAX_RETRIES, DEFAULT_BACKOFF_FACTOR
+from bird.core.generator import PhraseWizard
+from bird.core.prompter import Prompter
+from bird.core.rookery import Rookery
+from .fake_server import FakeCompletionServer, DEFAULT_LATENCY, DEFAULT_TOKENS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIRD_DATA_PATH = os.path.join(ROOT, "data", "birds.json")
+PROMPT_DATA_PATH = os.path.join(ROOT, "data", "prompts.json")
+BIRD_NAME = "Reginald"
+STYLES = ["Insult"]
+MAX_TOKENS = 100
+PERCENTILES = (50, 95, 99)
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linearly interpolated percentile of a list of values, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """Summarize latencies in seconds."""
+    summary = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = max(values) if values else None
+    return summary
+
+def max_rss_kb(children: bool = False) -> Optional[int]:
+    """Peak resident set size in KiB of this process, or of its largest waited-for child."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def run_threaded(task: Callable[[int], Any], concurrency: int, requests: int) -> Tuple[List[float], int, float]:
+    """Run `task(i)` for each request on a pool of `concurrency` threads.
+
+    Returns:
+        Tuple[List[float], int, float]: The latencies of successful requests, the error count and the
+            wall-clock time.
+    """
+    def timed(i: int) -> Optional[float]:
+        start = time.perf_counter()
+        try:
+            task(i)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency in results if latency is not None]
+    return latencies, len(results) - len(latencies), elapsed
+
+class Benchmark:
+    """Drives PyBirds against a fake completion server and collects latency, throughput and memory."""
+
+    def __init__(self, endpoint: str, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_factor: float = DEFAULT_BACKOFF_FACTOR, trace_memory: bool = False):
+        """Initialize a new Benchmark.
+
+        Args:
+            endpoint (str): The completion endpoint to benchmark against.
+            max_retries (int): Client retries on errors.
+            backoff_factor (float): Client backoff factor between retries.
+            trace_memory (bool): Whether to measure peak Python allocations per run, at some cost in speed.
+        """
+        self.endpoint = endpoint
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.trace_memory = trace_memory
+        self.rookery = Rookery.from_config(bird_data_path=BIRD_DATA_PATH)
+        self.prompter = Prompter.from_config(prompt_data_path=PROMPT_DATA_PATH)
+        self.scenarios: Dict[str, Callable[[int, int], Dict[str, Any]]] = {
+            "api": self.bench_api,
+            "async_api": self.bench_async_api,
+            "stream": self.bench_stream,
+            "wizard": self.bench_wizard,
+            "cli": self.bench_cli,
+        }
+
+    def make_api(self, concurrency: int) -> OAIApi:
+        return OAIApi(api_key="benchmark", endpoint=self.endpoint, max_tokens=MAX_TOKENS, pool_size=concurrency,
+                      max_retries=self.max_retries, backoff_factor=self.backoff_factor)
+
+    def run(self, scenario: str, concurrency: int, requests: int) -> Dict[str, Any]:
+        """Run one scenario at one level of concurrency.
+
+        Args:
+            scenario (str): The scenario name.
+            concurrency (int): Requests in flight at once.
+            requests (int): Total requests to make.
+
+        Returns:
+            Dict[str, Any]: The scenario results.
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+        try:
+            result = self.scenarios[scenario](concurrency, requests)
+            if self.trace_memory:
+                result["memory"]["traced_peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            if self.trace_memory:
+                tracemalloc.stop()
+        return {"scenario": scenario, "concurrency": concurrency, **result}
+
+    @staticmethod
+    def report(latencies: List[float], errors: int, elapsed: float, **extra: Any) -> Dict[str, Any]:
+        completed = len(latencies)
+        return {
+            "requests": completed + errors,
+            "errors": errors,
+            "elapsed": elapsed,
+            "rps": completed / elapsed if elapsed > 0 else None,
+            "latency": summarize(latencies),
+            "memory": {"max_rss_kb": max_rss_kb()},
+            **extra,
+        }
+
+    def bench_api(self, concurrency: int, requests: int) -> Dict[str, Any]:
+        """Blocking completions through a shared `OAIApi`."""
+        with self.make_api(concurrency) as api:
+            return self.report(*run_threaded(lambda i: api.make_request(f"Benchmark prompt {i}"),
+                                             concurrency, requests))
+
+    def bench_async_api(self, concurrency: int, requests: int) -> Dict[str, Any]:
+        """Completions through `AsyncOAIApi` on a single event loop."""
+        async def main() -> Tuple[List[float], int, float]:
+            async with AsyncOAIApi(api_key="benchmark", endpoint=self.endpoint, max_tokens=MAX_TOKENS,
+                                   max_concurrency=concurrency, max_retries=self.max_retries,
+                                   backoff_factor=self.backoff_factor) as api:
+                latencies: List[float] = []
+                errors = 0
+                pending = iter(range(requests))
+
+                async def worker() -> None:
+                    nonlocal errors
+                    for i in pending:
+                        start = time.perf_counter()
+                        try:
+                            await api.make_request(f"Benchmark prompt {i}")
+                        except OAIApiException:
+                            errors += 1
+                        else:
+                            latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                await asyncio.gather(*[worker() for _ in range(concurrency)])
+                elapsed = time.perf_counter() - start
+            return latencies, errors, elapsed
+
+        return self.report(*asyncio.run(main()))
+
+    def bench_stream(self, concurrency: int, requests: int) -> Dict[str, Any]:
+        """Streamed completions, adding time to first token and tokens per second."""
+        first_tokens: List[float] = []
+        rates: List[float] = []
+
+        with self.make_api(concurrency) as api:
+            def task(i: int) -> None:
+                stream = api.stream_request(f"Benchmark prompt {i}")
+                for _ in stream:
+                    pass
+                if stream.time_to_first_token is not None:
+                    first_tokens.append(stream.time_to_first_token)
+                    rates.append(stream.tokens_per_second)
+
+            result = self.report(*run_threaded(task, concurrency, requests))
+        result["time_to_first_token"] = summarize(first_tokens)
+        result["tokens_per_second"] = sum(rates) / len(rates) if rates else None
+        return result
+
+    def bench_wizard(self, concurrency: int, requests: int) -> Dict[str, Any]:
+        """End-to-end phrase generation through `PhraseWizard`, including prompt composition."""
+        bird = self.rookery.get_bird(bird_name=BIRD_NAME)
+        with self.make_api(concurrency) as api:
+            wizard = PhraseWizard.factory(api=api, rookery=self.rookery)
+
+            def task(i: int) -> None:
+                prompts, styles = wizard.compose(bird=bird, styles=STYLES, prompter=self.prompter)
+                wizard.generate_phrase(bird=bird, prompts=prompts, styles=styles)
+
+            return self.report(*run_threaded(task, concurrency, requests))
+
+    def bench_cli(self, concurrency: int, requests: int) -> Dict[str, Any]:
+        """`python -m bird generate` in a fresh process per request, including interpreter startup."""
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(os.path.join(workdir, "config"))
+            config = {"endpoint": self.endpoint, "api_key": "benchmark", "max_tokens": MAX_TOKENS,
+                      "max_retries": self.max_retries, "backoff_factor": self.backoff_factor,
+                      "bird_data_path": BIRD_DATA_PATH, "prompt_data_path": PROMPT_DATA_PATH}
+            with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+                json.dump(config, f)
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+            command = [sys.executable, "-m", "bird", "generate", "-n", BIRD_NAME] + \
+                      [arg for style in STYLES for arg in ("-s", style)]
+
+            def task(i: int) -> None:
+                completed = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                                           stderr=subprocess.DEVNULL)
+                if completed.returncode != 0:
+                    raise RuntimeError(f"CLI exited with status {completed.returncode}")
+
+            result = self.report(*run_threaded(task, concurrency, requests))
+        result["memory"]["child_max_rss_kb"] = max_rss_kb(children=True)
+        return result
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Find runs whose p95 latency or requests/sec regressed against a baseline by more than `tolerance`.
+
+    Returns:
+        List[str]: A description of each regression.
+    """
+    previous = {(run["scenario"], run["concurrency"]): run for run in baseline}
+    regressions = []
+    for run in results:
+        before = previous.get((run["scenario"], run["concurrency"]))
+        if before is None:
+            continue
+        name = f"{run['scenario']} x{run['concurrency']}"
+        p95, old_p95 = run["latency"]["p95"], before["latency"]["p95"]
+        if p95 is not None and old_p95 and p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency {old_p95 * 1000:.1f}ms -> {p95 * 1000:.1f}ms")
+        rps, old_rps = run["rps"], before["rps"]
+        if rps is not None and old_rps and rps < old_rps * (1 - tolerance):
+            regressions.append(f"{name}: {old_rps:.1f} -> {rps:.1f} requests/sec")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmark suite and write the results as JSON."""
+    parser = argparse.ArgumentParser(description="Benchmark PyBirds against a local fake completion server.")
+    parser.add_argument("-s", "--scenario", action="append", choices=["api", "async_api", "stream", "wizard", "cli"],
+                        help="Scenario to run. Can specify multiple; defaults to all but cli.")
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrency levels.")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="Requests per run.")
+    parser.add_argument("--cli-requests", type=int, default=20, help="Requests per run of the cli scenario.")
+    parser.add_argument("--endpoint", default=None, help="Benchmark an existing server instead of the fake one.")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Fake server seconds to first token.")
+    parser.add_argument("--token-rate", type=float, default=None, help="Fake server tokens per second.")
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS, help="Fake server tokens per completion.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake server fraction of 503 responses.")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES, help="Client retries on errors.")
+    parser.add_argument("--backoff-factor", type=float, default=DEFAULT_BACKOFF_FACTOR, help="Client backoff factor.")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak Python allocations per run.")
+    parser.add_argument("--seed", type=int, default=0, help="Fake server random seed.")
+    parser.add_argument("-o", "--output", default="-", help="File to write JSON results to, or - for stdout.")
+    parser.add_argument("--baseline", default=None, help="Earlier results to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed regression against the baseline.")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenario or ["api", "async_api", "stream", "wizard"]
+    server = None
+    if args.endpoint is None:
+        server = FakeCompletionServer(latency=args.latency, token_rate=args.token_rate, tokens=args.tokens,
+                                      error_rate=args.error_rate, seed=args.seed).start()
+    endpoint = args.endpoint or server.endpoint
+    benchmark = Benchmark(endpoint=endpoint, max_retries=args.max_retries, backoff_factor=args.backoff_factor,
+                          trace_memory=args.trace_memory)
+    results = []
+    try:
+        for scenario in scenarios:
+            requests = args.cli_requests if scenario == "cli" else args.requests
+            for concurrency in args.concurrency:
+                run = benchmark.run(scenario, concurrency, requests)
+                p95 = run["latency"]["p95"]
+                print(f"{scenario} x{concurrency}: {run['rps'] or 0.0:.1f} requests/sec, "
+                      f"p95 {(p95 or 0.0) * 1000:.1f}ms, {run['errors']} errors", file=sys.stderr)
+                results.append(run)
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server": {"endpoint": args.endpoint} if args.endpoint else {
+            "latency": args.latency, "token_rate": args.token_rate, "tokens": args.tokens,
+            "error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# benchmarks/startup.py - Martin Bukowski - 2023-08-26
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+from .run import ROOT, BIRD_DATA_PATH, PROMPT_DATA_PATH, summarize
+
+# Commands that never touch the network, and so must start quickly
+COMMANDS = {
+    "list_birds": ["list_birds"],
+    "list_styles": ["list_styles"],
+    "help": ["--help"],
+}
+# Modules that only commands talking to a model server should import
+HEAVY_MODULES = ("requests", "urllib3", "asyncio", "bird.core.api")
+DEFAULT_RUNS = 10
+# Milliseconds the median run may take beyond a bare `python -c pass`
+DEFAULT_BUDGET_MS = 50.0
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Read `python -X importtime` output into the cumulative microseconds spent importing each module."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            _, cumulative, module = line[len("import time:"):].split("|", 2)
+            imports[module.strip()] = int(cumulative)
+        except ValueError:
+            # The header line
+            continue
+    return imports
+
+class StartupBenchmark:
+    """Times CLI commands in fresh processes, and records what each one imports."""
+
+    def __init__(self, workdir: str, runs: int = DEFAULT_RUNS):
+        """Initialize a new StartupBenchmark.
+
+        Args:
+            workdir (str): The directory to run commands in, holding `config/config.json`.
+            runs (int): The number of timed runs per command.
+        """
+        self.workdir = workdir
+        self.runs = runs
+        self.env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+
+    def time_runs(self, args: List[str]) -> List[float]:
+        """Run `python <args>` repeatedly, returning the wall-clock seconds of each run."""
+        times = []
+        for _ in range(self.runs):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, *args], cwd=self.workdir, env=self.env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                raise RuntimeError(f"{' '.join(args)} exited with status {completed.returncode}")
+        return times
+
+    def imports(self, args: List[str]) -> Dict[str, int]:
+        """Run `python -X importtime <args>` once and parse what it imported."""
+        completed = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=self.workdir, env=self.env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        return parse_importtime(completed.stderr)
+
+    def run(self, command: str) -> Dict[str, Any]:
+        """Time one command of `python -m bird`.
+
+        Args:
+            command (str): A key of `COMMANDS`.
+
+        Returns:
+            Dict[str, Any]: The wall-clock latency summary, the median overhead over a bare interpreter in
+                seconds, the heavy modules imported, and the slowest `bird` imports in microseconds.
+        """
+        args = ["-m", "bird", *COMMANDS[command]]
+        baseline = summarize(self.time_runs(["-c", "pass"]))["p50"]
+        latency = summarize(self.time_runs(args))
+        imports = self.imports(args)
+        slowest = sorted(((module, us) for module, us in imports.items() if module.startswith("bird")),
+                         key=lambda item: item[1], reverse=True)[:5]
+        return {
+            "command": command,
+            "runs": self.runs,
+            "latency": latency,
+            "overhead": latency["p50"] - baseline,
+            "heavy_imports": [module for module in HEAVY_MODULES if module in imports],
+            "slowest_imports": dict(slowest),
+        }
+
+def check(results: List[Dict[str, Any]], budget_ms: float) -> List[str]:
+    """Find commands over the time budget or importing the HTTP stack.
+
+    Returns:
+        List[str]: A description of each problem.
+    """
+    problems = []
+    for result in results:
+        overhead_ms = result["overhead"] * 1000
+        if overhead_ms > budget_ms:
+            problems.append(f"{result['command']}: {overhead_ms:.1f}ms over interpreter startup, budget {budget_ms:.0f}ms")
+        if result["heavy_imports"]:
+            problems.append(f"{result['command']}: imports {', '.join(result['heavy_imports'])}")
+    return problems
+
+def write_config(workdir: str) -> None:
+    """Write a configuration using the bundled data, with an endpoint that is never contacted."""
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    config = {"endpoint": "http://127.0.0.1:9/", "api_key": "benchmark", "max_tokens": 100,
+              "bird_data_path": BIRD_DATA_PATH, "prompt_data_path": PROMPT_DATA_PATH}
+    with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+        json.dump(config, f)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the startup benchmark, returning the process exit code."""
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time and imports.")
+    parser.add_argument("-s", "--command", action="append", choices=sorted(COMMANDS),
+                        help="Command to time. Can specify multiple; defaults to all.")
+    parser.add_argument("-n", "--runs", type=int, default=DEFAULT_RUNS, help="Timed runs per command.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Milliseconds a command may take beyond a bare interpreter.")
+    parser.add_argument("-o", "--output", default="-", help="File to write JSON results to, or - for stdout.")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write_config(workdir)
+        benchmark = StartupBenchmark(workdir, runs=args.runs)
+        for command in args.command or sorted(COMMANDS):
+            result = benchmark.run(command)
+            print(f"{command}: p50 {result['latency']['p50'] * 1000:.1f}ms, "
+                  f"{result['overhead'] * 1000:.1f}ms over interpreter startup", file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "budget_ms": args.budget_ms,
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    problems = check(results, args.budget_ms)
+    for problem in problems:
+        print(f"Regression: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
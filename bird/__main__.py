@@ -1,53 +1,274 @@
 # __main__.py - Martin Bukowski - 2023-08-26
 import argparse
+import json
 import logging
+import sys
+import time
 from .core.util import load_config
-from .core.api import OAIApi
-from .core.rookery import Rookery
-from .core.prompter import Prompter
-from .core.generator import PhraseWizard
+from .core.metrics import metrics
+
+# Results stored in the phrase store per transaction
+STORE_BATCH_SIZE = 256
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-def load_resources():
-    """Load resources from configuration."""
+# Each command imports the modules it needs when it runs, so that listing birds or styles never loads the HTTP
+# stack. `python -m benchmarks.startup` checks that this stays fast.
+
+def load_settings():
+    """Load the configuration, and enable metrics if it asks for them."""
+    start = time.perf_counter()
     config = load_config()
+    metrics.configure(**config)
+    metrics.observe("config_load", time.perf_counter() - start)
+    return config
+
+def load_rookery(config):
+    """Load the birds."""
+    from .core.rookery import Rookery
+    with metrics.timer("rookery_load"):
+        return Rookery.from_config(**config)
+
+def load_prompter(config):
+    """Load the styles."""
+    from .core.prompter import Prompter
+    with metrics.timer("prompter_load"):
+        return Prompter.from_config(**config)
+
+def load_resources(config):
+    """Load the API client, birds and styles."""
+    from .core.api import OAIApi
     api = OAIApi.from_config(**config)
-    rook = Rookery.from_config(**config)
-    prompter = Prompter.from_config(**config)
-    return api, rook, prompter
+    return api, load_rookery(config), load_prompter(config)
+
+def create_wizard(api, rook, prompter, config):
+    """Create a wizard with the rookery's templates and the configured examples, token budgets and phrase filter.
+
+    With a phrase store, batch results carry each phrase's prompts, latency and backend.
+    """
+    from .core.budget import TokenBudget
+    from .core.dedup import PhraseFilter
+    from .core.examples import ExampleStore
+    from .core.generator import PhraseWizard
+    examples = ExampleStore.from_config(**config)
+    budget = TokenBudget.from_config(prompter=prompter, **config)
+    return PhraseWizard.factory(api=api, rookery=rook, examples=examples, budget=budget,
+                                phrase_filter=PhraseFilter.from_config(**config),
+                                provenance=config.get("phrase_store_path") is not None)
 
 def generate(args):
     """Generate a phrase for a specified bird and styles."""
-    api, rook, prompter = load_resources()
-    wizard = PhraseWizard.factory(api=api)
+    from .core.generator import DEFAULT_STYLES
+    from .core.pool import PhrasePool
+    from .core.sampler import Sampler
+    config = load_settings()
+    api, rook, prompter = load_resources(config)
+    wizard = create_wizard(api, rook, prompter, config)
 
     bird = rook.get_bird(bird_name=args.name)
     if bird is None:
         logger.error(f"Could not find bird with name {args.name}")
         return
+    unknown = prompter.unknown_styles(bird, args.style)
+    if unknown:
+        logger.error(f"Unknown styles for {args.name}: {', '.join(unknown)}")
+        return
     
-    # Collect prompts
-    prompts = [prompter.get_prompt(style) or bird.get_custom_style(style) for style in args.style]
-    prompts.append(bird.get_prompt())
+    if args.pooled:
+        pool = PhrasePool.from_config(wizard=wizard, rookery=rook, prompter=prompter, **config)
+        styles = prompter.canonical_styles(bird, args.style)
+        phrase = pool.get_or_generate(name=bird.name, styles=styles)
+        if phrase is None:
+            return
+        print(f"{bird.name} [{', '.join(styles + DEFAULT_STYLES)}]: {phrase}")
+        # Top the pool back up for the next run before saving it
+        pool.start().stop()
+        return
+
+    # Collect prompts, and add the default styles
+    sampler = Sampler(seed=args.seed, cycle=prompter.sampler.cycle) if args.seed is not None else None
+    prompts, styles_with_witty = wizard.compose(bird=bird, styles=args.style, prompter=prompter, sampler=sampler)
+
+    if args.stream:
+        stream = wizard.stream_phrase(bird=bird, prompts=prompts, styles=styles_with_witty)
+        print(f"{args.name} [{', '.join(styles_with_witty)}]: ", end="", flush=True)
+        for text in stream:
+            print(text, end="", flush=True)
+        print()
+        logger.info(f"Streamed {stream.tokens} tokens: {stream.time_to_first_token or 0.0:.3f}s to first token, "
+                    f"{stream.tokens_per_second:.1f} tokens/sec")
+        return
+
+    if args.count == 1:
+        phrases = [wizard.generate_phrase(bird=bird, prompts=prompts, styles=styles_with_witty)]
+    else:
+        phrases = wizard.generate_phrases(bird=bird, prompts=prompts, styles=styles_with_witty, n=args.count)
+    for phrase in phrases:
+        print(f"{args.name} [{', '.join(styles_with_witty)}]: {phrase}")
+
+def read_jobs(stream):
+    """Read batch jobs from a JSONL stream, skipping blank and invalid lines."""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"Skipping invalid job on line {line_number}: {e}")
+            continue
+        if not isinstance(job, dict):
+            logger.error(f"Skipping invalid job on line {line_number}: expected an object")
+            continue
+        yield job
+
+def batch(args):
+    """Generate phrases for a JSONL stream of {name, styles, n} jobs, storing them if a phrase store is set."""
+    from .core.generator import DEFAULT_WORKERS, DEFAULT_CHOICES
+    config = load_settings()
+    workers = args.workers if args.workers is not None else DEFAULT_WORKERS
+    choices = args.choices if args.choices is not None else DEFAULT_CHOICES
+
+    if args.store is not None:
+        config = {**config, "phrase_store_path": args.store}
+    store = None
+    if config.get("phrase_store_path") is not None:
+        from .core.store import PhraseStore
+        store = PhraseStore.from_config(**config)
+
+    source = sys.stdin if args.input == '-' else open(args.input, 'r')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w')
+    count, errors, stored = 0, 0, 0
+    pending = []
+    start = time.perf_counter()
+    try:
+        if args.processes is not None:
+            from .core.engine import ProcessEngine
+            if args.seed is not None:
+                config = {**config, "sample_seed": args.seed}
+            with ProcessEngine(config, processes=args.processes or None, workers=workers, choices=choices) as engine:
+                logger.info(f"Generating over {engine.processes} processes")
+                for lines, results, failed in engine.run_chunks(read_jobs(source), ordered=args.ordered):
+                    count += results
+                    errors += failed
+                    sink.write(lines)
+                    sink.flush()
+                    if store is not None:
+                        stored += store.add_many(json.loads(line) for line in lines.splitlines())
+                if engine.filter_stats() is not None:
+                    logger.info(f"Phrase filter: {json.dumps(engine.filter_stats())}")
+        else:
+            from .core.sampler import Sampler
+            api, rook, prompter = load_resources(config)
+            wizard = create_wizard(api, rook, prompter, config)
+            if args.seed is not None:
+                prompter.sampler = Sampler(seed=args.seed, cycle=prompter.sampler.cycle)
+            results = wizard.generate_many(jobs=read_jobs(source), rookery=rook, prompter=prompter,
+                                           workers=workers, ordered=args.ordered, choices=choices)
+            for result in results:
+                count += 1
+                errors += 'error' in result
+                sink.write(json.dumps(result) + '\n')
+                sink.flush()
+                if store is not None:
+                    pending.append(result)
+                    if len(pending) >= STORE_BATCH_SIZE:
+                        stored += store.add_many(pending)
+                        pending = []
+            if wizard.phrase_filter is not None:
+                logger.info(f"Phrase filter: {json.dumps(wizard.phrase_filter.stats())}")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+        if store is not None:
+            # Keep what was generated even if the batch failed part way
+            stored += store.add_many(pending)
+            store.close()
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Generated {count - errors} phrases ({errors} errors) in {elapsed:.2f}s: {rate:.2f} phrases/sec")
+    if store is not None:
+        logger.info(f"Stored {stored} phrases in {store.path}")
+    if metrics.enabled:
+        logger.info(f"Metrics: {json.dumps(metrics.snapshot())}")
+
+def serve(args):
+    """Serve phrases over HTTP until interrupted."""
+    from .core.pool import PhrasePool
+    from .core.reload import Reloader
+    from .core.server import BirdServer, DEFAULT_HOST, DEFAULT_PORT
+    config = load_settings()
+    api, rook, prompter = load_resources(config)
+    wizard = create_wizard(api, rook, prompter, config)
+    pool = None
+    if args.pooled:
+        pool = PhrasePool.from_config(wizard=wizard, rookery=rook, prompter=prompter, **config)
+    reloader = Reloader.from_config(api=api, rookery=rook, prompter=prompter, **config)
+    server = BirdServer(api=api, rookery=rook, prompter=prompter, pool=pool,
+                        host=args.host if args.host is not None else DEFAULT_HOST,
+                        port=args.port if args.port is not None else DEFAULT_PORT, wizard=wizard, reloader=reloader)
+    server.serve_forever()
+
+def open_store(args, config):
+    """Open the phrase store named on the command line or in the configuration, or the default one."""
+    from .core.store import PhraseStore, DEFAULT_STORE_PATH
+    return PhraseStore(path=args.store or config.get("phrase_store_path") or DEFAULT_STORE_PATH)
 
-    # Add 'Witty' to styles
-    styles_with_witty = args.style + ['Witty']
+def with_default_styles(styles):
+    """Add the default styles to styles given on the command line, as generating does, or None for any styles."""
+    from .core.generator import DEFAULT_STYLES
+    return styles + DEFAULT_STYLES if styles else None
 
-    phrase = wizard.generate_phrase(bird=bird, prompts=prompts, styles=styles_with_witty)
-    print(f"{args.name} [{', '.join(styles_with_witty)}]: {phrase}")
+def phrases(args):
+    """Print stored phrases for a bird and styles, or a random one."""
+    config = load_settings()
+    styles = with_default_styles(args.style)
+    with open_store(args, config) as store:
+        if args.random:
+            if args.name is None or styles is None:
+                logger.error("--random needs a bird name and at least one style")
+                return
+            phrase = store.random_phrase(name=args.name, styles=styles)
+            found = [phrase] if phrase is not None else []
+        else:
+            found = store.query(name=args.name, styles=styles, limit=args.limit)
+    if not found:
+        logger.error("No stored phrases found")
+    for phrase in found:
+        if args.json:
+            print(json.dumps(phrase))
+        else:
+            print(f"{phrase['name']} [{', '.join(phrase['styles'])}]: {phrase['phrase']}")
+
+def export(args):
+    """Export stored phrases to JSONL or CSV."""
+    config = load_settings()
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        with open_store(args, config) as store:
+            count = store.export(sink, format=args.format, name=args.name, styles=with_default_styles(args.style))
+    finally:
+        if sink is not sys.stdout:
+            sink.close()
+    logger.info(f"Exported {count} phrases")
 
 def list_birds(args):
-    """List all available birds."""
-    _, rook, _ = load_resources()
+    """List all available birds, optionally filtered by species, persona keyword or custom style."""
+    rook = load_rookery(load_settings())
     print("Available Birds:")
-    for bird_name, bird in rook.birds.items():
-        print(f"- {bird_name} (Species: {bird.species}, Persona: {bird.persona})")
+    if args.species or args.persona or args.style:
+        birds = rook.find_birds(species=args.species, persona=args.persona, custom_style=args.style)
+    else:
+        birds = rook.iter_birds()
+    for bird in birds:
+        print(f"- {bird.name} (Species: {bird.species}, Persona: {bird.persona})")
 
 def list_styles(args):
     """List all available styles."""
-    _, _, prompter = load_resources()
+    prompter = load_prompter(load_settings())
     print("Available Styles:")
     for style in prompter.prompts.keys():
         print(f"- {style}")
@@ -62,10 +283,55 @@ def main():
     generate_parser = subparsers.add_parser("generate", help="Generate a phrase for a bird.")
     generate_parser.add_argument("-n", "--name", required=True, help="Name of the bird.")
     generate_parser.add_argument("-s", "--style", action='append', required=True, help="Style of the phrase. Can specify multiple styles.")
+    generate_parser.add_argument("-c", "--count", type=int, default=1, help="Number of phrases to generate in one request.")
+    generate_parser.add_argument("--pooled", action="store_true", help="Serve the phrase from the persisted phrase pool.")
+    generate_parser.add_argument("--stream", action="store_true", help="Print the phrase as it is generated.")
+    generate_parser.add_argument("--seed", help="Random seed for drawing the prompts.")
     generate_parser.set_defaults(func=generate)
 
+    # Batch command
+    batch_parser = subparsers.add_parser("batch", help="Generate phrases for a JSONL stream of jobs.")
+    batch_parser.add_argument("-i", "--input", default="-", help="JSONL file of {name, styles, n} jobs, or - for stdin.")
+    batch_parser.add_argument("-o", "--output", default="-", help="File to write JSONL results to, or - for stdout.")
+    batch_parser.add_argument("-w", "--workers", type=int, default=None, help="Number of concurrent requests, per process with --processes (default 8).")
+    batch_parser.add_argument("-p", "--processes", type=int, default=None, help="Generate over this many worker processes, or 0 for one per core.")
+    batch_parser.add_argument("-c", "--choices", type=int, default=None, help="Maximum phrases to request per API call (default 16).")
+    batch_parser.add_argument("--ordered", action="store_true", help="Write results in input order instead of completion order.")
+    batch_parser.add_argument("--seed", help="Random seed for drawing the prompts, to make the run reproducible.")
+    batch_parser.add_argument("--store", help="Also store the phrases in this database (default phrase_store_path).")
+    batch_parser.set_defaults(func=batch)
+
+    # Serve command
+    serve_parser = subparsers.add_parser("serve", help="Serve phrases over HTTP.")
+    serve_parser.add_argument("--host", default=None, help="Address to listen on (default 127.0.0.1).")
+    serve_parser.add_argument("-p", "--port", type=int, default=None, help="Port to listen on (default 8080).")
+    serve_parser.add_argument("--pooled", action="store_true", help="Serve phrases from the phrase pool.")
+    serve_parser.set_defaults(func=serve)
+
+    # Phrases command
+    phrases_parser = subparsers.add_parser("phrases", help="Query the phrase store.")
+    phrases_parser.add_argument("-n", "--name", help="Only phrases for this bird.")
+    phrases_parser.add_argument("-s", "--style", action='append', help="Only phrases with these styles. Can specify multiple styles.")
+    phrases_parser.add_argument("-l", "--limit", type=int, default=None, help="Most phrases to print.")
+    phrases_parser.add_argument("-r", "--random", action="store_true", help="Print one random phrase for the bird and styles.")
+    phrases_parser.add_argument("--json", action="store_true", help="Print each phrase with its details as JSON.")
+    phrases_parser.add_argument("--store", help="Phrase database (default phrase_store_path, or data/phrases.sqlite).")
+    phrases_parser.set_defaults(func=phrases)
+
+    # Export command
+    export_parser = subparsers.add_parser("export", help="Export the phrase store to JSONL or CSV.")
+    export_parser.add_argument("-o", "--output", default="-", help="File to write to, or - for stdout.")
+    export_parser.add_argument("-f", "--format", choices=["jsonl", "csv"], default="jsonl", help="Output format.")
+    export_parser.add_argument("-n", "--name", help="Only phrases for this bird.")
+    export_parser.add_argument("-s", "--style", action='append', help="Only phrases with these styles. Can specify multiple styles.")
+    export_parser.add_argument("--store", help="Phrase database (default phrase_store_path, or data/phrases.sqlite).")
+    export_parser.set_defaults(func=export)
+
     # List birds command
     list_birds_parser = subparsers.add_parser("list_birds", help="List available birds.")
+    list_birds_parser.add_argument("--species", help="Only birds of this species.")
+    list_birds_parser.add_argument("--persona", help="Only birds with this keyword in their persona.")
+    list_birds_parser.add_argument("-s", "--style", help="Only birds with this custom style.")
     list_birds_parser.set_defaults(func=list_birds)
 
     # List styles command
@@ -1,57 +1,534 @@
 # core/api.py - Martin Bukowski - 2023-08-26
-import json
+import asyncio
+import math
 import requests
 import logging
-from typing import Optional, Dict
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import AsyncIterator, Optional, Dict, Iterator, List, Tuple, Union
+from urllib.parse import urlsplit
+from .balancer import LoadBalancer, Lease, EndpointSpec, DEFAULT_STRATEGY, DEFAULT_MAX_FAILURES, DEFAULT_EJECT_SECONDS
+from .cache import CompletionCache
+from .codec import Codec, get_codec
+from .flight import AsyncSingleFlight, SingleFlight
+from .limiter import LIMIT_KEYS
+from .metrics import metrics
+from .transport import AsyncConnectionPool, AsyncStreamingResponse, TransportException
 
 HTTP_OK = 200
 BEARER_TOKEN_PREFIX = "Bearer"
 JSON_CONTENT_TYPE = "application/json"
+COMPLETIONS_PATH = "/v1/completions"
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_KEEP_ALIVE = True
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# The longest wait between retries, whatever the backoff or a Retry-After header asks for
+DEFAULT_MAX_BACKOFF = 60.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_CONCURRENCY = 64
+# Phrases are one line, and end at a closing quote
+DEFAULT_STOP = ["\n", '"']
+# Rough characters per token, for charging prompts against a tokens-per-minute limit
+CHARS_PER_TOKEN = 4
+
+SSE_DATA_PREFIX = b"data:"
+SSE_DONE = b"[DONE]"
+# Serialized payload tails kept per client, one per combination of limits in use
+MAX_PAYLOAD_FRAGMENTS = 256
+# Returned by parse_event at the end of a stream
+STREAM_DONE = object()
+# The finish_reason of a completion cut off by max_tokens
+FINISH_LENGTH = "length"
+
+logger = logging.getLogger(__name__)
+
+class Completion(str):
+    """The text of a completion choice, carrying the reason generation stopped.
+
+    It is a str everywhere else, so completions pass through prompt handling, caches and JSON unchanged.
+    Completions served from a cache have a `finish_reason` of None.
+    """
+
+    finish_reason: Optional[str] = None
+
+    def __new__(cls, text: str, finish_reason: Optional[str] = None) -> 'Completion':
+        completion = super().__new__(cls, text)
+        completion.finish_reason = finish_reason
+        return completion
 
 class OAIApiException(Exception):
     """Custom exception class for handling OAIApi specific exceptions."""
     pass
 
-class OAIApi:
-    """Client class for making requests to the OAI API."""
+class StreamStats:
+    """Timing statistics for a streamed completion."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.tokens = 0
+        self.text = ""
+
+    def record(self, text: str) -> None:
+        """Record the arrival of a streamed token."""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+        self.text += text
+
+    def finish(self) -> None:
+        """Mark the stream as finished and log its statistics."""
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+            logger.debug("Streamed %d tokens, time to first token %.3fs, %.1f tokens/sec",
+                        self.tokens, self.time_to_first_token or 0.0, self.tokens_per_second)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """Seconds from sending the request to receiving the first token."""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from sending the request to the end of the stream (or now, if still streaming)."""
+        return (self.finished_at or time.perf_counter()) - self.started
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Tokens received per second over the whole request."""
+        elapsed = self.elapsed
+        return self.tokens / elapsed if elapsed > 0 else 0.0
+
+class CompletionStream(StreamStats):
+    """Iterates over the text of a streamed completion as it arrives, recording timing statistics."""
 
-    def __init__(self, api_key: str, endpoint: str, max_tokens: int):
+    def __init__(self, chunks: Iterator[str]):
+        """Initialize a new CompletionStream.
+
+        Args:
+            chunks (Iterator[str]): The incremental text of the completion.
         """
-        Initialize the OAIApi client.
+        super().__init__()
+        self.chunks = chunks
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for text in self.chunks:
+                self.record(text)
+                yield text
+        finally:
+            self.finish()
+
+class AsyncCompletionStream(StreamStats):
+    """Asynchronously iterates over the text of a streamed completion, recording timing statistics."""
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        """Initialize a new AsyncCompletionStream.
+
+        Args:
+            chunks (AsyncIterator[str]): The incremental text of the completion.
+        """
+        super().__init__()
+        self.chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            async for text in self.chunks:
+                self.record(text)
+                yield text
+        finally:
+            self.finish()
+
+class BaseOAIApi:
+    """Shared configuration and payload handling for the OAI API clients."""
+
+    # Optional configuration keys that from_config passes through to the constructor
+    CONFIG_KEYS = ("pool_size", "keep_alive", "connect_timeout", "read_timeout", "max_retries", "backoff_factor",
+                   "balance_strategy", "max_failures", "eject_seconds", "cache_prompt", "share_requests", "stop", "json_codec",
+                   "max_backoff") + LIMIT_KEYS
+
+    def __init__(self, api_key: str, endpoint: Union[str, List[EndpointSpec]], max_tokens: int,
+                 pool_size: int = DEFAULT_POOL_SIZE, keep_alive: bool = DEFAULT_KEEP_ALIVE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+                 cache: Optional[CompletionCache] = None, balance_strategy: str = DEFAULT_STRATEGY,
+                 max_failures: int = DEFAULT_MAX_FAILURES, eject_seconds: float = DEFAULT_EJECT_SECONDS,
+                 cache_prompt: bool = False, share_requests: bool = False,
+                 requests_per_second: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 concurrency_limit: Optional[int] = None, adaptive_concurrency: bool = False,
+                 target_latency: Optional[float] = None, stop: Optional[List[str]] = None,
+                 json_codec: Optional[str] = None, max_backoff: float = DEFAULT_MAX_BACKOFF):
+        """
+        Initialize the client.
 
         Args:
             api_key (str): API key for authentication.
-            endpoint (str): API endpoint URL.
+            endpoint (Union[str, List[EndpointSpec]]): API endpoint URL, or a list of endpoint URLs (or dicts
+                with a `url` and a `weight`) to balance requests across.
             max_tokens (int): Maximum number of tokens for the generated text.
+            pool_size (int): Maximum number of pooled connections to keep per host.
+            keep_alive (bool): Whether to reuse connections between requests.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the server to send a response.
+            max_retries (int): Number of retries on connection errors and 429/5xx responses.
+            backoff_factor (float): Exponential backoff factor between retries, in seconds.
+            cache (Optional[CompletionCache]): A cache consulted before making non-streaming requests.
+            balance_strategy (str): `least_outstanding` or `weighted_round_robin` across several endpoints.
+            max_failures (int): Consecutive failures before an endpoint is taken out of rotation.
+            eject_seconds (float): Seconds an ejected endpoint stays out of rotation before being probed.
+            cache_prompt (bool): Ask the server to reuse its evaluation of the longest prefix shared with the
+                previous prompt (llama.cpp `cache_prompt`).
+            share_requests (bool): Let concurrent requests with identical payloads share one completion,
+                instead of each making its own. Callers can override this per request.
+            requests_per_second (Optional[float]): The most requests started per second on each endpoint.
+            tokens_per_minute (Optional[float]): The most prompt and completion tokens per minute on each endpoint.
+            concurrency_limit (Optional[int]): The most requests in flight on each endpoint.
+            adaptive_concurrency (bool): Adapt each endpoint's concurrency limit to its latency and 429/503s.
+            target_latency (Optional[float]): Seconds above which the adaptive limit backs off.
+            stop (Optional[List[str]]): The default stop sequences, or None for `DEFAULT_STOP`.
+            json_codec (Optional[str]): The JSON library for payloads and responses, `json`, `orjson` or
+                `msgspec`, or None for the fastest one installed.
+            max_backoff (float): The most seconds to wait between retries, capping the backoff and Retry-After.
+
+            The limits apply to every client of an endpoint in the process, and can be overridden on endpoint
+            objects in the `endpoint` list.
         """
         self.api_key = api_key
         self.endpoint = endpoint
         self.max_tokens = max_tokens
+        self.stop = stop if stop is not None else DEFAULT_STOP
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self.cache_prompt = cache_prompt
+        self.share_requests = share_requests
+        self.balance_strategy = balance_strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.limits = {"requests_per_second": requests_per_second, "tokens_per_minute": tokens_per_minute,
+                       "concurrency_limit": concurrency_limit, "adaptive_concurrency": adaptive_concurrency,
+                       "target_latency": target_latency}
+        self.uris: Dict[str, str] = {}
+        self.set_endpoints(endpoint)
+        self.headers = self.make_headers(api_key)
+        self.codec: Codec = get_codec(json_codec)
+        # Everything after the prompt in a payload, by the settings that produced it
+        self.fragments: Dict[Tuple, bytes] = {}
         self.logger = logging.getLogger(__name__)
 
+    @staticmethod
+    def make_headers(api_key: str) -> Dict[str, str]:
+        return {
+            "Authorization": f"{BEARER_TOKEN_PREFIX} {api_key}",
+            "Content-Type": JSON_CONTENT_TYPE,
+        }
+
+    def set_endpoints(self, endpoint: Union[str, List[EndpointSpec]]) -> None:
+        """Balance requests across a new set of endpoints.
+
+        The balancer is replaced in a single assignment, so requests never see a half-built one. The URIs of
+        earlier endpoints are kept, so that requests still in flight against them can finish.
+
+        Args:
+            endpoint (Union[str, List[EndpointSpec]]): An endpoint URL, or a list of URLs or {"url", "weight"} objects.
+        """
+        endpoints = [endpoint] if isinstance(endpoint, str) else endpoint
+        balancer = LoadBalancer(endpoints, strategy=self.balance_strategy, max_failures=self.max_failures,
+                                eject_seconds=self.eject_seconds, limits=self.limits)
+        uris = {backend.endpoint: f"{backend.endpoint.rstrip('/')}{COMPLETIONS_PATH}"
+                for backend in balancer.backends}
+        self.add_uris(uris)
+        self.uri = uris[balancer.backends[0].endpoint]
+        self.endpoint = endpoint
+        self.balancer = balancer
+
+    def add_uris(self, uris: Dict[str, str]) -> None:
+        """Register the completion URIs of endpoints before the balancer can hand them out."""
+        self.uris = {**self.uris, **uris}
+
+    def reconfigure(self, endpoint: Union[str, List[EndpointSpec]], api_key: str, max_tokens: int,
+                    cache_prompt: bool = False, balance_strategy: str = DEFAULT_STRATEGY,
+                    max_failures: int = DEFAULT_MAX_FAILURES, eject_seconds: float = DEFAULT_EJECT_SECONDS,
+                    share_requests: bool = False, stop: Optional[List[str]] = None, **config) -> None:
+        """Apply a reloaded configuration without dropping pooled connections.
+
+        The endpoints, API key, token limit, stop sequences, prompt caching, request sharing and rate limits take
+        effect for the next request. The balancer is only rebuilt, losing its statistics, when the endpoints, balancing options
+        or limits change; the limiters themselves are shared and keep their state. Transport options such as
+        the pool size and timeouts need a restart.
+
+        Args:
+            endpoint (Union[str, List[EndpointSpec]]): An endpoint URL, or a list of URLs or {"url", "weight"} objects.
+            api_key (str): API key for authentication.
+            max_tokens (int): Maximum number of tokens for the generated text.
+            cache_prompt (bool): Ask the server to reuse its evaluation of the shared prompt prefix.
+            balance_strategy (str): `least_outstanding` or `weighted_round_robin`.
+            max_failures (int): Consecutive failures before an endpoint is taken out of rotation.
+            eject_seconds (float): Seconds an ejected endpoint stays out of rotation before being probed.
+            share_requests (bool): Let concurrent identical requests share one completion.
+            stop (Optional[List[str]]): The default stop sequences, or None for `DEFAULT_STOP`.
+            **config: Other configuration settings. The limits in `LIMIT_KEYS` are applied, and the rest are
+                ignored.
+        """
+        self.max_tokens = max_tokens
+        self.stop = stop if stop is not None else DEFAULT_STOP
+        self.cache_prompt = cache_prompt
+        self.share_requests = share_requests
+        if api_key != self.api_key:
+            self.api_key = api_key
+            self.headers = self.make_headers(api_key)
+        balancing = (balance_strategy, max_failures, eject_seconds)
+        limits = {key: config.get(key) for key in LIMIT_KEYS}
+        limits["adaptive_concurrency"] = bool(limits["adaptive_concurrency"])
+        if (endpoint != self.endpoint or limits != self.limits
+                or balancing != (self.balance_strategy, self.max_failures, self.eject_seconds)):
+            self.balance_strategy, self.max_failures, self.eject_seconds = balancing
+            self.limits = limits
+            self.set_endpoints(endpoint)
+            self.logger.info(f"Balancing across {len(self.balancer.backends)} endpoints")
+
     @classmethod
-    def from_config(cls, endpoint: str, api_key: str, max_tokens: int, **config: Dict[str, Optional[str]]):
+    def from_config(cls, endpoint: Union[str, List[EndpointSpec]], api_key: str, max_tokens: int,
+                    **config: Dict[str, Optional[str]]):
         """
-        Create an OAIApi instance from a configuration dictionary.
+        Create a client instance from a configuration dictionary.
 
         Args:
-            endpoint (str): API endpoint URL.
+            endpoint (Union[str, List[EndpointSpec]]): API endpoint URL, or a list of endpoints.
             api_key (str): API key for authentication.
             max_tokens (int): Maximum number of tokens for the generated text.
-            **config (Dict[str, Optional[str]]): Additional optional configuration parameters.
+            **config (Dict[str, Optional[str]]): Additional optional configuration parameters. Any of the
+                keys listed in `CONFIG_KEYS` are passed on to the constructor, and the `cache_*` keys
+                configure the completion cache.
 
         Returns:
-            OAIApi: An instance of the OAIApi class.
+            An instance of the client class.
+        """
+        options = {key: config[key] for key in cls.CONFIG_KEYS if key in config}
+        cache = CompletionCache.from_config(**config)
+        return cls(endpoint=endpoint, api_key=api_key, max_tokens=max_tokens, cache=cache, **options)
+
+    def build_payload(self, prompt: Union[str, List[str]], max_tokens: Optional[int] = None, n: int = 1,
+                      stream: bool = False, stop: Optional[List[str]] = None) -> bytes:
         """
-        return cls(endpoint=endpoint, api_key=api_key, max_tokens=max_tokens)
+        Build the JSON request body for a completion.
 
-    def make_request(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        Only the prompt is serialized per request. The rest of the payload is serialized once per combination
+        of settings and reused.
+
+        Args:
+            prompt (Union[str, List[str]]): The text prompt to guide the text generation, or a list of prompts
+                to complete in a single request.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            n (int): Number of choices to generate for each prompt. Defaults to 1.
+            stream (bool): Ask the server to stream tokens as server-sent events. Defaults to False.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+
+        Returns:
+            bytes: The serialized payload.
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        if stop is None:
+            stop = self.stop
+
+        self.logger.debug("Sending Prompt: %s", prompt)
+        key = (max_tokens, n, stream, self.cache_prompt, tuple(stop))
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = self.build_fragment(max_tokens=max_tokens, n=n, stream=stream, stop=stop)
+            if len(self.fragments) >= MAX_PAYLOAD_FRAGMENTS:
+                self.fragments = {}
+            self.fragments[key] = fragment
+        return b'{"prompt":' + self.codec.dumps(prompt) + fragment
+
+    def build_fragment(self, max_tokens: int, n: int, stream: bool, stop: List[str]) -> bytes:
+        """Serialize the fields of a payload that follow the prompt, up to its closing brace."""
+        fields = {"stop": stop, "max_tokens": max_tokens}
+        if n != 1:
+            fields["n"] = n
+        if stream:
+            fields["stream"] = True
+        if self.cache_prompt:
+            fields["cache_prompt"] = True
+        # Splice the fields in after the prompt, in place of the object's opening brace
+        return b"," + self.codec.dumps(fields)[1:]
+
+    @staticmethod
+    def estimate_tokens(prompt: Union[str, List[str]], n: int, max_tokens: int) -> int:
+        """Estimate the most tokens a request can use, counting every prompt and `n` full completions of each."""
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+        return sum(len(text) for text in prompts) // CHARS_PER_TOKEN + len(prompts) * n * max_tokens
+
+    @staticmethod
+    def record_status(status_code: int) -> None:
+        """Count a failed response by its status code."""
+        if status_code != HTTP_OK:
+            metrics.increment("completion_errors", status=status_code)
+
+    @staticmethod
+    def is_healthy(status_code: int) -> bool:
+        """Whether a response status shows the backend to be healthy; 429 and 5xx count against it."""
+        return status_code not in RETRY_STATUS_CODES
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Compute how long to wait before the next retry, honouring a numeric Retry-After header.
+
+        The delay is kept between 0 and `max_backoff`, and a Retry-After that is not a finite number is ignored.
+        """
+        delay = self.backoff_factor * (2 ** attempt)
+        if retry_after is not None:
+            try:
+                value = float(retry_after)
+            except ValueError:
+                value = math.nan
+            if math.isfinite(value):
+                delay = value
+        return min(max(delay, 0.0), self.max_backoff)
+
+    def parse_event(self, line: bytes) -> Optional[str]:
+        """
+        Extract the generated text from one line of a server-sent event stream.
+
+        Args:
+            line (bytes): A line of the response body.
+
+        Returns:
+            Optional[str]: The text carried by the event, `STREAM_DONE` at the end of the stream, or None for
+                lines that carry no text.
+        """
+        if not line.startswith(SSE_DATA_PREFIX):
+            return None
+        data = line[len(SSE_DATA_PREFIX):].strip()
+        if data == SSE_DONE:
+            return STREAM_DONE
+        choices = self.codec.loads(data).get('choices')
+        return choices[0].get('text') or None if choices else None
+
+    def parse_choices(self, status_code: int, body: Union[bytes, str]) -> List[str]:
+        """
+        Extract the generated texts of all choices from a completion response.
+
+        Args:
+            status_code (int): The HTTP status code of the response.
+            body (Union[bytes, str]): The response body, parsed without decoding it first.
+
+        Returns:
+            List[str]: The generated texts as `Completion`s, ordered by choice index. For a list of prompts with
+                `n` choices each, the choices for prompt `i` are at positions `i * n` to `i * n + n - 1`.
+
+        Raises:
+            OAIApiException: If the response indicates a failure, or is not a valid completion response.
+        """
+        if status_code == HTTP_OK:
+            try:
+                choices = self.codec.loads(body)['choices']
+                if len(choices) == 1:
+                    return [Completion(choices[0]['text'], choices[0].get('finish_reason'))]
+                choices = sorted(enumerate(choices), key=lambda item: item[1].get('index', item[0]))
+                return [Completion(choice['text'], choice.get('finish_reason')) for _, choice in choices]
+            except (self.codec.decode_error, ValueError, KeyError, TypeError) as e:
+                raise OAIApiException(f"API returned an invalid completion response: {e!r}") from e
+        else:
+            if isinstance(body, bytes):
+                body = body.decode("utf-8", errors="replace")
+            raise OAIApiException(f"API request failed with status code {status_code}: {body}")
+
+    def parse_response(self, status_code: int, body: Union[bytes, str]) -> str:
+        """
+        Extract the generated text from a completion response.
+
+        Args:
+            status_code (int): The HTTP status code of the response.
+            body (Union[bytes, str]): The response body.
+
+        Returns:
+            str: The generated text.
+
+        Raises:
+            OAIApiException: If the response indicates a failure.
+        """
+        return self.parse_choices(status_code, body)[0]
+
+class OAIApi(BaseOAIApi):
+    """Client class for making requests to the OAI API."""
+
+    def __init__(self, api_key: str, endpoint: str, max_tokens: int, **options):
+        """
+        Initialize the OAIApi client.
+
+        Args:
+            api_key (str): API key for authentication.
+            endpoint (str): API endpoint URL.
+            max_tokens (int): Maximum number of tokens for the generated text.
+            **options: Transport options, see `BaseOAIApi`.
+        """
+        super().__init__(api_key=api_key, endpoint=endpoint, max_tokens=max_tokens, **options)
+        self.session = self.create_session()
+        self.flight = SingleFlight()
+        # The backend that served each thread's last completion
+        self.local = threading.local()
+
+    def create_session(self) -> requests.Session:
+        """
+        Build the pooled HTTP session used for all requests made by this client.
+
+        Retries are made by `post` rather than the session, so that each attempt goes through the load
+        balancer and the backend's limits.
+
+        Returns:
+            requests.Session: A session with a sized connection pool mounted.
+        """
+        adapter = HTTPAdapter(pool_connections=max(self.pool_size, len(self.uris)), pool_maxsize=self.pool_size,
+                              max_retries=Retry(total=0, raise_on_status=False))
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def close(self) -> None:
+        """Close the underlying session and release pooled connections."""
+        self.session.close()
+
+    def __enter__(self) -> 'OAIApi':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def last_endpoint(self) -> Optional[str]:
+        """The endpoint that served the calling thread's last completion, or None if it came from the cache or
+        was shared with another request."""
+        return getattr(self.local, "endpoint", None)
+
+    def make_request(self, prompt: str, max_tokens: Optional[int] = None, share: Optional[bool] = None,
+                     stop: Optional[List[str]] = None, cache: bool = True) -> str:
         """
         Make an API request to generate text based on the given prompt.
 
         Args:
             prompt (str): The text prompt to guide the text generation.
             max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use `share_requests`.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+            cache (bool): Whether to serve the completion from the cache, and store it there, if one is set.
 
         Returns:
             str: The generated text.
@@ -59,23 +536,404 @@ class OAIApi:
         Raises:
             OAIApiException: If the API request fails.
         """
-        if max_tokens is None:
-            max_tokens = self.max_tokens
+        return self.make_completions(prompt=prompt, max_tokens=max_tokens, share=share, stop=stop, cache=cache)[0]
 
-        headers = {
-            "Authorization": f"{BEARER_TOKEN_PREFIX} {self.api_key}",
-            "Content-Type": JSON_CONTENT_TYPE
-        }
-        self.logger.info("Sending Prompt: %s", prompt)
-        payload = json.dumps({
-            "prompt": prompt,
-            "stop": ["\n", '"'],
-            "max_tokens": max_tokens
-        })
-        uri = f"{self.endpoint}/v1/completions"
-        response = requests.post(uri, headers=headers, data=payload)
-
-        if response.status_code == HTTP_OK:
-            return json.loads(response.text)['choices'][0]['text']
-        else:
-            raise OAIApiException(f"API request failed with status code {response.status_code}: {response.text}")
+    def make_completions(self, prompt: Union[str, List[str]], n: int = 1, max_tokens: Optional[int] = None,
+                         share: Optional[bool] = None, stop: Optional[List[str]] = None,
+                         cache: bool = True) -> List[str]:
+        """
+        Make a single API request for `n` choices per prompt.
+
+        When sharing, a request whose payload matches one already in flight waits for that request and
+        returns a copy of its completion, instead of calling the API again.
+
+        Args:
+            prompt (Union[str, List[str]]): The text prompt, or a list of prompts to batch into one request.
+            n (int): Number of choices to generate for each prompt. Defaults to 1.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use `share_requests`.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+            cache (bool): Whether to serve the completions from the cache, and store them there, if one is set.
+                Callers that need fresh completions for a repeated prompt, such as to replace rejected ones, pass
+                False.
+
+        Returns:
+            List[str]: The generated texts, grouped by prompt as described in `parse_choices`.
+
+        Raises:
+            OAIApiException: If the API request fails.
+        """
+        self.local.endpoint = None
+        payload = self.build_payload(prompt=prompt, max_tokens=max_tokens, n=n, stop=stop)
+        if cache and self.cache is not None:
+            cached = self.cache.lookup(payload)
+            if cached is not None:
+                metrics.increment("cache_hits")
+                return cached
+
+        tokens = self.estimate_tokens(prompt, n, max_tokens or self.max_tokens)
+        if not (self.share_requests if share is None else share):
+            return self.complete(payload, tokens, cache)
+        texts, shared = self.flight.do(payload, lambda: self.complete(payload, tokens, cache))
+        if shared:
+            metrics.increment("shared_requests")
+            return list(texts)
+        return texts
+
+    def complete(self, payload: bytes, tokens: int = 0, cache: bool = True) -> List[str]:
+        """Post a built payload and parse its choices, storing them in the cache if one is set.
+
+        Args:
+            payload (bytes): The serialized request payload.
+            tokens (int): The tokens the request may use, charged against the endpoint's token limit.
+            cache (bool): Whether to store the choices in the cache.
+
+        Returns:
+            List[str]: The generated texts.
+        """
+        start = time.perf_counter()
+        lease, response = self.post(payload, tokens)
+        lease.release(ok=self.is_healthy(response.status_code), status=response.status_code)
+
+        with metrics.timer("json_decode"):
+            texts = self.parse_choices(response.status_code, response.content)
+        metrics.observe("completion", time.perf_counter() - start)
+        if cache and self.cache is not None:
+            self.cache.store(payload, texts)
+        return texts
+
+    def post(self, payload: bytes, tokens: int = 0, stream: bool = False) -> Tuple[Lease, requests.Response]:
+        """
+        Post a payload to the completions endpoint, retrying with backoff on connection errors and 429/5xx.
+
+        Each attempt goes to the backend picked by the load balancer, once its limits allow, and is released
+        with its own outcome, so failed attempts count against their backend and the adaptive limits. A retry
+        avoids the backend that just failed whenever another is available.
+
+        Args:
+            payload (bytes): The serialized request body.
+            tokens (int): The tokens the request may use, charged against the backend's token limit.
+            stream (bool): Leave the response body unread, to be streamed.
+
+        Returns:
+            Tuple[Lease, requests.Response]: The lease on the backend that answered, to be released once the
+                body has been read, and the final response.
+
+        Raises:
+            OAIApiException: If the server cannot be reached after all retries.
+        """
+        failed = None
+        for attempt in range(self.max_retries + 1):
+            lease = self.balancer.acquire(exclude=failed)
+            failed = lease.endpoint
+            self.local.endpoint = lease.endpoint
+            try:
+                lease.throttle(tokens)
+                response = self.session.post(self.uris[lease.endpoint], data=payload, timeout=self.timeout,
+                                             stream=stream)
+                # Includes connecting, when the pool had no idle connection
+                metrics.observe("ttfb", response.elapsed.total_seconds())
+                self.record_status(response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return lease, response
+                response.close()
+                lease.release(ok=False, status=response.status_code)
+                delay = self.retry_delay(attempt, response.headers.get("retry-after"))
+            except requests.RequestException as e:
+                lease.release(ok=False)
+                metrics.increment("completion_errors", status="connection")
+                if attempt == self.max_retries:
+                    raise OAIApiException(f"API request failed: {e}") from e
+                delay = self.retry_delay(attempt)
+            except BaseException:
+                lease.release(ok=False)
+                raise
+            self.logger.warning("Retrying request in %.2fs (attempt %d of %d)", delay, attempt + 1, self.max_retries)
+            time.sleep(delay)
+
+    def stream_request(self, prompt: str, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> CompletionStream:
+        """
+        Make a streaming API request, returning the generated text as it arrives.
+
+        Args:
+            prompt (str): The text prompt to guide the text generation.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+
+        Returns:
+            CompletionStream: An iterator over the generated text, with time-to-first-token and tokens/sec.
+
+        Raises:
+            OAIApiException: If the API request fails. Iterating raises it if the stream fails or ends before [DONE].
+        """
+        payload = self.build_payload(prompt=prompt, max_tokens=max_tokens, stream=True, stop=stop)
+        lease, response = self.post(payload, self.estimate_tokens(prompt, 1, max_tokens or self.max_tokens), stream=True)
+        if response.status_code != HTTP_OK:
+            text = response.text
+            response.close()
+            lease.release(ok=self.is_healthy(response.status_code), status=response.status_code)
+            raise OAIApiException(f"API request failed with status code {response.status_code}: {text}")
+
+        def chunks() -> Iterator[str]:
+            ok = False
+            try:
+                for line in response.iter_lines():
+                    text = self.parse_event(line)
+                    if text is STREAM_DONE:
+                        break
+                    if text:
+                        yield text
+                else:
+                    raise OAIApiException("API stream ended before [DONE]")
+                ok = True
+            except requests.RequestException as e:
+                raise OAIApiException(f"API stream failed: {e}") from e
+            finally:
+                response.close()
+                lease.release(ok=ok)
+
+        return CompletionStream(chunks())
+
+class AsyncOAIApi(BaseOAIApi):
+    """Asyncio client class for making requests to the OAI API with a bounded number in flight."""
+
+    CONFIG_KEYS = BaseOAIApi.CONFIG_KEYS + ("max_concurrency",)
+
+    def __init__(self, api_key: str, endpoint: str, max_tokens: int,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, **options):
+        """
+        Initialize the AsyncOAIApi client.
+
+        Args:
+            api_key (str): API key for authentication.
+            endpoint (str): API endpoint URL.
+            max_tokens (int): Maximum number of tokens for the generated text.
+            max_concurrency (int): Maximum number of requests in flight at once.
+            **options: Transport options, see `BaseOAIApi`.
+        """
+        self.max_concurrency = max_concurrency
+        self.paths: Dict[str, str] = {}
+        self.pools: Dict[str, AsyncConnectionPool] = {}
+        super().__init__(api_key=api_key, endpoint=endpoint, max_tokens=max_tokens, **options)
+        self.path = urlsplit(self.uri).path
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.flight = AsyncSingleFlight()
+
+    def add_uris(self, uris: Dict[str, str]) -> None:
+        """Register the completion URIs of endpoints, opening a connection pool for each new one."""
+        paths = dict(self.paths)
+        pools = dict(self.pools)
+        for endpoint, uri in uris.items():
+            if endpoint not in pools:
+                paths[endpoint] = urlsplit(uri).path
+                pools[endpoint] = AsyncConnectionPool(uri, pool_size=max(self.pool_size, self.max_concurrency),
+                                                      keep_alive=self.keep_alive,
+                                                      connect_timeout=self.timeout[0], read_timeout=self.timeout[1])
+        self.paths = paths
+        self.pools = pools
+        super().add_uris(uris)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so that it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        for pool in self.pools.values():
+            await pool.close()
+
+    async def __aenter__(self) -> 'AsyncOAIApi':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def make_request(self, prompt: str, max_tokens: Optional[int] = None, share: Optional[bool] = None,
+                           stop: Optional[List[str]] = None, cache: bool = True) -> str:
+        """
+        Make an API request to generate text based on the given prompt.
+
+        Args:
+            prompt (str): The text prompt to guide the text generation.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use `share_requests`.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+            cache (bool): Whether to serve the completion from the cache, and store it there, if one is set.
+
+        Returns:
+            str: The generated text.
+
+        Raises:
+            OAIApiException: If the API request fails.
+        """
+        return (await self.make_completions(prompt=prompt, max_tokens=max_tokens, share=share, stop=stop,
+                                            cache=cache))[0]
+
+    async def make_completions(self, prompt: Union[str, List[str]], n: int = 1,
+                               max_tokens: Optional[int] = None, share: Optional[bool] = None,
+                               stop: Optional[List[str]] = None, cache: bool = True) -> List[str]:
+        """
+        Make a single API request for `n` choices per prompt. See `OAIApi.make_completions`.
+
+        Args:
+            prompt (Union[str, List[str]]): The text prompt, or a list of prompts to batch into one request.
+            n (int): Number of choices to generate for each prompt. Defaults to 1.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use `share_requests`.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+            cache (bool): Whether to serve the completions from the cache, and store them there, if one is set.
+                Callers that need fresh completions for a repeated prompt, such as to replace rejected ones, pass
+                False.
+
+        Returns:
+            List[str]: The generated texts, grouped by prompt as described in `parse_choices`.
+
+        Raises:
+            OAIApiException: If the API request fails.
+        """
+        payload = self.build_payload(prompt=prompt, max_tokens=max_tokens, n=n, stop=stop)
+        if cache and self.cache is not None:
+            cached = self.cache.lookup(payload)
+            if cached is not None:
+                metrics.increment("cache_hits")
+                return cached
+
+        tokens = self.estimate_tokens(prompt, n, max_tokens or self.max_tokens)
+        if not (self.share_requests if share is None else share):
+            return await self.complete(payload, tokens, cache)
+        texts, shared = await self.flight.do(payload, lambda: self.complete(payload, tokens, cache))
+        if shared:
+            metrics.increment("shared_requests")
+            return list(texts)
+        return texts
+
+    async def complete(self, payload: bytes, tokens: int = 0, cache: bool = True) -> List[str]:
+        """Post a built payload and parse its choices, storing them in the cache if one is set. See `OAIApi.complete`."""
+        async with self.semaphore:
+            start = time.perf_counter()
+            lease, response = await self.post(payload, tokens)
+            try:
+                body = await self.read(response)
+            except BaseException:
+                # The body was cut off, so the backend failed however the response began
+                lease.release(ok=False)
+                raise
+            lease.release(ok=self.is_healthy(response.status), status=response.status)
+        with metrics.timer("json_decode"):
+            texts = self.parse_choices(response.status, body)
+        metrics.observe("completion", time.perf_counter() - start)
+        if cache and self.cache is not None:
+            self.cache.store(payload, texts)
+        return texts
+
+    async def stream_request(self, prompt: str, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None) -> AsyncCompletionStream:
+        """
+        Make a streaming API request, returning the generated text as it arrives.
+
+        The request counts against the concurrency limit until the stream has been consumed.
+
+        Args:
+            prompt (str): The text prompt to guide the text generation.
+            max_tokens (Optional[int]): Maximum number of tokens for the generated text. Defaults to None.
+            stop (Optional[List[str]]): Sequences that end the generated text, or None for the client's `stop`.
+
+        Returns:
+            AsyncCompletionStream: An async iterator over the generated text, with time-to-first-token and
+                tokens/sec.
+
+        Raises:
+            OAIApiException: If the API request fails. Iterating raises it if the stream fails or ends before [DONE].
+        """
+        payload = self.build_payload(prompt=prompt, max_tokens=max_tokens, stream=True, stop=stop)
+        await self.semaphore.acquire()
+        try:
+            lease, response = await self.post(payload, self.estimate_tokens(prompt, 1, max_tokens or self.max_tokens))
+            if response.status != HTTP_OK:
+                body = await self.read(response)
+                lease.release(ok=self.is_healthy(response.status), status=response.status)
+                raise OAIApiException(f"API request failed with status code {response.status}: {body.decode('utf-8', errors='replace')}")
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+        async def chunks() -> AsyncIterator[str]:
+            done = False
+            ok = False
+            try:
+                # Read to the end of the body after [DONE] so that the connection can be reused
+                async for line in response.iter_lines():
+                    text = None if done else self.parse_event(line)
+                    if text is STREAM_DONE:
+                        done = True
+                    elif text:
+                        yield text
+                if not done:
+                    raise OAIApiException("API stream ended before [DONE]")
+                ok = True
+            except TransportException as e:
+                raise OAIApiException(f"API stream failed: {e}") from e
+            finally:
+                response.close()
+                lease.release(ok=ok)
+                self.semaphore.release()
+
+        return AsyncCompletionStream(chunks())
+
+    async def read(self, response: AsyncStreamingResponse) -> bytes:
+        """Read the body of a response, converting transport failures."""
+        try:
+            return await response.read()
+        except TransportException as e:
+            raise OAIApiException(f"API request failed: {e}") from e
+
+    async def post(self, payload: bytes, tokens: int = 0) -> Tuple[Lease, AsyncStreamingResponse]:
+        """
+        Post a payload to the completions endpoint, retrying with backoff on connection errors and 429/5xx.
+
+        Each attempt goes to the backend picked by the load balancer, once its limits allow, and a retry avoids
+        the backend that just failed whenever another is available.
+
+        Args:
+            payload (bytes): The serialized request body.
+            tokens (int): The tokens the request may use, charged against the backend's token limit.
+
+        Returns:
+            Tuple[Lease, AsyncStreamingResponse]: The lease on the backend that answered, to be released once
+                the body has been read, and the final response.
+
+        Raises:
+            OAIApiException: If the server cannot be reached after all retries.
+        """
+        failed = None
+        for attempt in range(self.max_retries + 1):
+            lease = self.balancer.acquire(exclude=failed)
+            failed = lease.endpoint
+            try:
+                await lease.athrottle(tokens)
+                start = time.perf_counter()
+                response = await self.pools[lease.endpoint].stream("POST", self.paths[lease.endpoint], self.headers, payload)
+                metrics.observe("ttfb", time.perf_counter() - start)
+                self.record_status(response.status)
+                if response.status not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return lease, response
+                # Drain the error body so that the connection can be reused
+                await response.read()
+                lease.release(ok=False, status=response.status)
+                delay = self.retry_delay(attempt, response.headers.get("retry-after"))
+            except TransportException as e:
+                lease.release(ok=False)
+                metrics.increment("completion_errors", status="connection")
+                if attempt == self.max_retries:
+                    raise OAIApiException(f"API request failed: {e}") from e
+                delay = self.retry_delay(attempt)
+            except BaseException:
+                lease.release(ok=False)
+                raise
+            self.logger.warning("Retrying request in %.2fs (attempt %d of %d)", delay, attempt + 1, self.max_retries)
+            await asyncio.sleep(delay)
@@ -0,0 +1,216 @@
+# core/balancer.py - Martin Bukowski - 2023-08-26
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+from .limiter import ConcurrencyLimit, EndpointLimiter, LIMIT_KEYS, OVERLOAD_STATUS_CODES, limiters
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = "least_outstanding"
+WEIGHTED_ROUND_ROBIN = "weighted_round_robin"
+STRATEGIES = (LEAST_OUTSTANDING, WEIGHTED_ROUND_ROBIN)
+
+DEFAULT_STRATEGY = LEAST_OUTSTANDING
+DEFAULT_MAX_FAILURES = 3
+DEFAULT_EJECT_SECONDS = 30.0
+# Smoothing factor for the moving average of request latency
+LATENCY_ALPHA = 0.2
+
+EndpointSpec = Union[str, Dict[str, Any]]
+
+class Backend:
+    """A completion endpoint and its health and latency statistics."""
+
+    def __init__(self, endpoint: str, weight: int = 1, limiter: Optional[EndpointLimiter] = None):
+        """Initialize a new Backend.
+
+        Args:
+            endpoint (str): The endpoint base URL.
+            weight (int): The relative share of requests for weighted round-robin.
+            limiter (Optional[EndpointLimiter]): The endpoint's rate and concurrency limits, if any.
+        """
+        self.endpoint = endpoint
+        self.weight = max(1, weight)
+        self.limiter = limiter
+        self.current_weight = 0
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.latency_ewma: Optional[float] = None
+
+    def available(self, now: float) -> bool:
+        """Whether the backend is in rotation; an ejected backend comes back for a probe once its time is up."""
+        return self.ejected_until <= now
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejected": not self.available(now),
+            "latency_avg": self.total_latency / self.requests if self.requests else None,
+            "latency_ewma": self.latency_ewma,
+            "limits": self.limiter.stats() if self.limiter is not None else None,
+        }
+
+class Lease:
+    """A request in flight against a backend."""
+
+    def __init__(self, balancer: 'LoadBalancer', backend: Backend):
+        self.balancer = balancer
+        self.backend = backend
+        self.started = time.perf_counter()
+        self.released = False
+        self.slot: Optional[ConcurrencyLimit] = None
+
+    @property
+    def endpoint(self) -> str:
+        return self.backend.endpoint
+
+    def throttle(self, tokens: float = 0) -> None:
+        """Block until the backend's limits allow sending a request using `tokens`."""
+        if self.backend.limiter is not None:
+            with metrics.timer("limiter_wait"):
+                self.slot = self.backend.limiter.acquire(tokens)
+            self.started = time.perf_counter()
+
+    async def athrottle(self, tokens: float = 0) -> None:
+        """Wait until the backend's limits allow sending a request using `tokens`. See `throttle`."""
+        if self.backend.limiter is not None:
+            with metrics.timer("limiter_wait"):
+                self.slot = await self.backend.limiter.aacquire(tokens)
+            self.started = time.perf_counter()
+
+    def release(self, ok: bool, status: Optional[int] = None) -> None:
+        """Record the outcome of the request and return the backend's slot. Only the first call counts.
+
+        Args:
+            ok (bool): Whether the backend answered successfully.
+            status (Optional[int]): The response status, or None if there was no response.
+        """
+        if not self.released:
+            self.released = True
+            latency = time.perf_counter() - self.started
+            self.balancer.release(self.backend, latency, ok)
+            if self.slot is not None:
+                reached = status is not None or ok
+                self.slot.release(latency if reached else None,
+                                  overloaded=status in OVERLOAD_STATUS_CODES or not reached)
+
+class LoadBalancer:
+    """Spreads requests across several completion endpoints.
+
+    Backends are picked by least outstanding requests or by smooth weighted round-robin. A backend that fails
+    `max_failures` times in a row is ejected for `eject_seconds`, after which it is probed with live traffic;
+    one success puts it back in rotation and one failure ejects it again.
+
+    Backends can be rate limited, with limits shared by every balancer in the process; see `EndpointLimiter`.
+    """
+
+    def __init__(self, endpoints: List[EndpointSpec], strategy: str = DEFAULT_STRATEGY,
+                 max_failures: int = DEFAULT_MAX_FAILURES, eject_seconds: float = DEFAULT_EJECT_SECONDS,
+                 limits: Optional[Dict[str, Any]] = None):
+        """Initialize a new LoadBalancer.
+
+        Args:
+            endpoints (List[EndpointSpec]): Endpoint URLs, or dicts with a `url`, an optional `weight` and
+                optional limits overriding `limits`.
+            strategy (str): `least_outstanding` or `weighted_round_robin`.
+            max_failures (int): Consecutive failures before a backend is ejected.
+            eject_seconds (float): Seconds an ejected backend stays out of rotation before being probed.
+            limits (Optional[Dict[str, Any]]): Default limits for every endpoint, with the keys in `LIMIT_KEYS`.
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        self.limits = limits or {}
+        self.backends = [self.make_backend(spec) for spec in endpoints]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.lock = threading.Lock()
+
+    def make_backend(self, spec: EndpointSpec) -> Backend:
+        if isinstance(spec, str):
+            return Backend(endpoint=spec, limiter=limiters.get(spec, **self.limits))
+        limits = {**self.limits, **{key: spec[key] for key in LIMIT_KEYS if key in spec}}
+        return Backend(endpoint=spec["url"], weight=spec.get("weight", 1), limiter=limiters.get(spec["url"], **limits))
+
+    def acquire(self, exclude: Optional[str] = None) -> Lease:
+        """Pick a backend for a request.
+
+        Args:
+            exclude (Optional[str]): An endpoint to avoid if any other is available, such as the one a retried
+                request just failed on.
+
+        Returns:
+            Lease: The lease on the chosen backend; release it with the outcome of the request.
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [backend for backend in self.backends if backend.available(now)]
+            if exclude is not None and len(candidates) > 1:
+                candidates = [backend for backend in candidates if backend.endpoint != exclude] or candidates
+            if not candidates:
+                # Everything is ejected; probe whichever backend is due back first
+                candidates = [min(self.backends, key=lambda backend: backend.ejected_until)]
+            if self.strategy == WEIGHTED_ROUND_ROBIN:
+                backend = self.next_weighted(candidates)
+            else:
+                backend = min(candidates, key=lambda backend: (backend.outstanding / backend.weight, backend.requests))
+            backend.outstanding += 1
+        return Lease(self, backend)
+
+    @staticmethod
+    def next_weighted(candidates: List[Backend]) -> Backend:
+        """Smooth weighted round-robin: spread picks evenly in proportion to weight."""
+        total = 0
+        best = None
+        for backend in candidates:
+            backend.current_weight += backend.weight
+            total += backend.weight
+            if best is None or backend.current_weight > best.current_weight:
+                best = backend
+        best.current_weight -= total
+        return best
+
+    def release(self, backend: Backend, latency: float, ok: bool) -> None:
+        """Record the outcome of a request on a backend.
+
+        Args:
+            backend (Backend): The backend the request went to.
+            latency (float): Seconds the request took.
+            ok (bool): Whether the backend answered successfully.
+        """
+        with self.lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.total_latency += latency
+            if backend.latency_ewma is None:
+                backend.latency_ewma = latency
+            else:
+                backend.latency_ewma += LATENCY_ALPHA * (latency - backend.latency_ewma)
+            if ok:
+                backend.failures = 0
+                backend.ejected_until = 0.0
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.max_failures:
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"Ejecting backend {backend.endpoint} for {self.eject_seconds}s "
+                               f"after {backend.failures} consecutive failures")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return request counts, health and latency for each backend."""
+        now = time.monotonic()
+        with self.lock:
+            return [backend.stats(now) for backend in self.backends]
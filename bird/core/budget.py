@@ -0,0 +1,152 @@
+# core/budget.py - Martin Bukowski - 2023-08-26
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from .api import CHARS_PER_TOKEN, FINISH_LENGTH
+from .prompter import Prompter, DEFAULT_STYLES
+from ..model.bird import Bird
+
+DEFAULT_PERCENTILE = 95.0
+# Completions remembered per style
+LENGTH_WINDOW = 256
+# Completions seen for a style before its budget adapts
+MIN_SAMPLES = 20
+# Slack over the learned length, as token counts are estimated from characters
+HEADROOM = 1.25
+MIN_TOKENS = 8
+# The default styles are on every phrase, so their lengths say nothing about any one style
+UNLEARNED_STYLES = frozenset(style.casefold() for style in DEFAULT_STYLES)
+
+# The max_tokens and stop sequences for a request; None leaves the client's default
+Limits = Tuple[Optional[int], Optional[List[str]]]
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def truncated(text: str, max_tokens: int) -> bool:
+    """Whether a completion was cut off at its budget, as the server reports, or else as estimated."""
+    finish_reason = getattr(text, "finish_reason", None)
+    if finish_reason is not None:
+        return finish_reason == FINISH_LENGTH
+    return estimate_tokens(text) >= max_tokens
+
+class TokenBudget:
+    """Picks the max_tokens and stop sequences for each phrase from its styles and bird.
+
+    Styles in `prompts.json` may set `max_tokens` and `stop`, and birds may set `maxTokens`. A request's budget
+    is the largest budget among its styles, capped by the bird's, falling back to the client's `max_tokens`;
+    its stop sequences are those of its styles, or the client's `stop` if none set any.
+
+    With `adaptive`, the completion lengths of each style are tracked, and once a style has `MIN_SAMPLES` of
+    them its budget shrinks to the given percentile of their lengths, plus `HEADROOM`. The default styles,
+    which every phrase has, are not learned, so a request's learned budget comes from its own styles. Budgets never grow past
+    the static ones. A completion that uses its whole budget was likely cut short, so it counts as needing
+    the static budget, and the learned budget grows back if cut-offs become common.
+    """
+
+    def __init__(self, prompter: Prompter, adaptive: bool = False, percentile: float = DEFAULT_PERCENTILE):
+        """Initialize a new TokenBudget.
+
+        Args:
+            prompter (Prompter): The prompter holding the style settings; reloaded styles apply at once.
+            adaptive (bool): Learn budgets from observed completion lengths.
+            percentile (float): The percentile of observed lengths to budget for.
+        """
+        self.prompter = prompter
+        self.adaptive = adaptive
+        self.percentile = percentile
+        self.lock = threading.Lock()
+        self.lengths: Dict[str, Deque[int]] = {}
+        # The learned budget of each style, recomputed after new observations
+        self.learned: Dict[str, Optional[int]] = {}
+
+    @classmethod
+    def from_config(cls, prompter: Prompter, adaptive_max_tokens: bool = False,
+                    max_tokens_percentile: float = DEFAULT_PERCENTILE, **config) -> 'TokenBudget':
+        """Create a new TokenBudget from configuration settings.
+
+        Args:
+            prompter (Prompter): The prompter holding the style settings.
+            adaptive_max_tokens (bool): Learn budgets from observed completion lengths.
+            max_tokens_percentile (float): The percentile of observed lengths to budget for.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            TokenBudget: A new TokenBudget.
+        """
+        return cls(prompter=prompter, adaptive=adaptive_max_tokens, percentile=max_tokens_percentile)
+
+    def static_budget(self, bird: Bird, styles: List[str], default: int) -> int:
+        """The budget set for a phrase by its styles and bird, before any learning."""
+        budgets = [prompt.max_tokens for prompt in map(self.prompter.get_style, styles)
+                   if prompt is not None and prompt.max_tokens is not None]
+        budget = max(budgets) if budgets else default
+        if bird.maxTokens is not None:
+            budget = min(budget, bird.maxTokens)
+        return budget
+
+    def limits(self, bird: Bird, styles: List[str], default: int) -> Limits:
+        """Resolve the max_tokens and stop sequences for a phrase.
+
+        Args:
+            bird (Bird): The bird the phrase is for.
+            styles (List[str]): The phrase's styles.
+            default (int): The client's `max_tokens`.
+
+        Returns:
+            Limits: The max_tokens, and the stop sequences or None for the client's default.
+        """
+        budget = self.static_budget(bird, styles, default)
+        if self.adaptive:
+            learned = [self.learned_budget(style) for style in styles if style.casefold() not in UNLEARNED_STYLES]
+            if learned and all(tokens is not None for tokens in learned):
+                budget = min(budget, max(learned))
+        stops = [prompt.stop for prompt in map(self.prompter.get_style, styles) if prompt is not None and prompt.stop]
+        stop = list(dict.fromkeys(sequence for sequences in stops for sequence in sequences)) if stops else None
+        return budget, stop
+
+    def observe(self, bird: Bird, styles: List[str], texts: List[str], max_tokens: int, default: int) -> None:
+        """Record the lengths of completions generated for a phrase.
+
+        Args:
+            bird (Bird): The bird the completions were generated for.
+            styles (List[str]): The phrase's styles.
+            texts (List[str]): The completions. Those the server reports were cut off by `max_tokens`, or
+                without a `finish_reason` are estimated to have reached it, count as needing the static budget.
+            max_tokens (int): The budget they were generated with.
+            default (int): The client's `max_tokens`.
+        """
+        if not self.adaptive:
+            return
+        ceiling = self.static_budget(bird, styles, default)
+        lengths = [ceiling if truncated(text, max_tokens) else estimate_tokens(text) for text in texts]
+        with self.lock:
+            for style in styles:
+                key = style.casefold()
+                if key in UNLEARNED_STYLES:
+                    continue
+                window = self.lengths.get(key)
+                if window is None:
+                    window = self.lengths[key] = deque(maxlen=LENGTH_WINDOW)
+                window.extend(lengths)
+                self.learned.pop(key, None)
+
+    def learned_budget(self, style: str) -> Optional[int]:
+        """The learned budget of a style, or None until it has enough observations."""
+        key = style.casefold()
+        if key in self.learned:
+            return self.learned[key]
+        with self.lock:
+            window = self.lengths.get(key)
+            budget = None
+            if window is not None and len(window) >= MIN_SAMPLES:
+                lengths = sorted(window)
+                length = lengths[min(len(lengths) - 1, math.ceil(len(lengths) * self.percentile / 100) - 1)]
+                budget = max(MIN_TOKENS, math.ceil(length * HEADROOM))
+            self.learned[key] = budget
+        return budget
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """Return the learned budget of every observed style."""
+        return {style: self.learned_budget(style) for style in list(self.lengths)}
@@ -0,0 +1,234 @@
+# core/cache.py - Martin Bukowski - 2023-08-26
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 3600.0
+DEFAULT_CACHE_VARIANTS = 1
+DEFAULT_CACHE_PATH = "data/cache.sqlite"
+
+class CompletionCache:
+    """Base class for completion caches keyed on the full request payload.
+
+    Each key holds up to `variants` distinct completions. A lookup only counts as a hit once all variants have
+    been collected; until then the caller goes to the API and stores the new completion as another variant.
+    Hits serve one of the stored variants at random.
+    """
+
+    def __init__(self, ttl: Optional[float] = DEFAULT_CACHE_TTL, variants: int = DEFAULT_CACHE_VARIANTS):
+        """Initialize a new CompletionCache.
+
+        Args:
+            ttl (Optional[float]): Seconds an entry stays valid after it is first stored, or None to never expire.
+            variants (int): The number of variants to collect per key before serving from the cache.
+        """
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_backend: Optional[str] = None, cache_size: int = DEFAULT_CACHE_SIZE,
+                    cache_ttl: Optional[float] = DEFAULT_CACHE_TTL, cache_variants: int = DEFAULT_CACHE_VARIANTS,
+                    cache_path: str = DEFAULT_CACHE_PATH, **config) -> Optional['CompletionCache']:
+        """Create a completion cache from configuration settings.
+
+        Args:
+            cache_backend (Optional[str]): `memory`, `sqlite`, or None to disable caching.
+            cache_size (int): The maximum number of keys to keep.
+            cache_ttl (Optional[float]): Seconds an entry stays valid, or None to never expire.
+            cache_variants (int): The number of variants to collect per key before serving from the cache.
+            cache_path (str): The database file for the `sqlite` backend.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            Optional[CompletionCache]: The cache, or None if caching is disabled.
+        """
+        if cache_backend is None:
+            return None
+        if cache_backend == "memory":
+            return MemoryCache(max_size=cache_size, ttl=cache_ttl, variants=cache_variants)
+        if cache_backend == "sqlite":
+            return SQLiteCache(path=cache_path, max_size=cache_size, ttl=cache_ttl, variants=cache_variants)
+        raise ValueError(f"Unknown cache backend: {cache_backend}")
+
+    @staticmethod
+    def make_key(payload: Union[bytes, str]) -> str:
+        """Hash a serialized request payload into a cache key."""
+        return hashlib.sha256(payload if isinstance(payload, bytes) else payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, payload: Union[bytes, str]) -> Optional[List[str]]:
+        """Look up the completion for a request payload.
+
+        Args:
+            payload (Union[bytes, str]): The serialized request payload.
+
+        Returns:
+            Optional[List[str]]: A cached completion, or None on a miss.
+        """
+        stored = self.get(self.make_key(payload))
+        with self.lock:
+            if stored is not None and len(stored) >= self.variants:
+                self.hits += 1
+                return random.choice(stored)
+            self.misses += 1
+            return None
+
+    def store(self, payload: Union[bytes, str], completion: List[str]) -> None:
+        """Store a completion for a request payload as one of its variants.
+
+        Args:
+            payload (Union[bytes, str]): The serialized request payload.
+            completion (List[str]): The completion texts returned by the API.
+        """
+        self.add(self.make_key(payload), completion)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters and the number of cached keys."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def get(self, key: str) -> Optional[List[List[str]]]:
+        """Return the live variants stored under a key, if any."""
+        raise NotImplementedError
+
+    def add(self, key: str, completion: List[str]) -> None:
+        """Add a variant under a key, up to the configured number of variants."""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+class MemoryCache(CompletionCache):
+    """An in-process LRU completion cache with a time to live."""
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE, ttl: Optional[float] = DEFAULT_CACHE_TTL,
+                 variants: int = DEFAULT_CACHE_VARIANTS):
+        """Initialize a new MemoryCache.
+
+        Args:
+            max_size (int): The maximum number of keys to keep; the least recently used are evicted first.
+            ttl (Optional[float]): Seconds an entry stays valid, or None to never expire.
+            variants (int): The number of variants to collect per key before serving from the cache.
+        """
+        super().__init__(ttl=ttl, variants=variants)
+        self.max_size = max_size
+        self.entries: 'OrderedDict[str, Tuple[float, List[List[str]]]]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[List[List[str]]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, stored = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return stored
+
+    def add(self, key: str, completion: List[str]) -> None:
+        with self.lock:
+            now = time.monotonic()
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < now:
+                expires = now + self.ttl if self.ttl is not None else float("inf")
+                entry = (expires, [])
+                self.entries[key] = entry
+            if len(entry[1]) < self.variants:
+                entry[1].append(completion)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+class SQLiteCache(CompletionCache):
+    """A completion cache in a SQLite database, which can be shared by several processes."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = DEFAULT_CACHE_SIZE,
+                 ttl: Optional[float] = DEFAULT_CACHE_TTL, variants: int = DEFAULT_CACHE_VARIANTS):
+        """Initialize a new SQLiteCache.
+
+        Args:
+            path (str): The database file.
+            max_size (int): The maximum number of keys to keep; the least recently used are evicted first.
+            ttl (Optional[float]): Seconds an entry stays valid, or None to never expire.
+            variants (int): The number of variants to collect per key before serving from the cache.
+        """
+        super().__init__(ttl=ttl, variants=variants)
+        self.path = path
+        self.max_size = max_size
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS completions (
+            key TEXT PRIMARY KEY,
+            variants TEXT NOT NULL,
+            expires REAL NOT NULL,
+            used REAL NOT NULL
+        )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS completions_used ON completions (used)")
+
+    def get(self, key: str) -> Optional[List[List[str]]]:
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT variants, expires FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE completions SET used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def add(self, key: str, completion: List[str]) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else float("inf")
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT variants, expires FROM completions WHERE key = ?", (key,)).fetchone()
+                stored = json.loads(row[0]) if row is not None and row[1] >= now else []
+                if row is not None and row[1] >= now:
+                    expires = row[1]
+                if len(stored) < self.variants:
+                    stored.append(completion)
+                self.db.execute("INSERT OR REPLACE INTO completions (key, variants, expires, used) VALUES (?, ?, ?, ?)",
+                                (key, json.dumps(stored), expires, now))
+                self.db.execute("""DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY used DESC LIMIT -1 OFFSET ?)""", (self.max_size,))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def clear(self) -> None:
+        with self.lock:
+            self.db.execute("DELETE FROM completions")
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.db.close()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
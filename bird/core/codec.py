@@ -0,0 +1,73 @@
+# core/codec.py - Martin Bukowski - 2023-08-26
+import json
+import logging
+from typing import Any, Dict, Optional, Type, Union
+
+logger = logging.getLogger(__name__)
+
+# Codecs tried in order when none is configured
+AUTO_CODECS = ("orjson", "msgspec", "json")
+
+class Codec:
+    """Serializes request payloads to UTF-8 JSON bytes and parses response bodies.
+
+    Subclasses wrap a JSON library. `loads` accepts bytes straight off the socket, so response bodies are never
+    decoded to an intermediate str.
+    """
+
+    name = "json"
+    # Raised by `loads` on malformed JSON
+    decode_error: Type[Exception] = ValueError
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialize an object to compact UTF-8 JSON."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """Parse JSON from bytes or a str."""
+        return json.loads(data)
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+
+class MsgspecCodec(Codec):
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+        self.dumps = msgspec.json.encode
+        self.loads = msgspec.json.decode
+        self.decode_error = msgspec.DecodeError
+
+CODECS: Dict[str, Type[Codec]] = {"json": Codec, "orjson": OrjsonCodec, "msgspec": MsgspecCodec}
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """Create a codec by name, or the fastest one installed.
+
+    Args:
+        name (Optional[str]): `json`, `orjson` or `msgspec`, or None to pick the first installed of
+            `AUTO_CODECS`. The standard library's `json` is always available.
+
+    Returns:
+        Codec: The codec.
+
+    Raises:
+        ValueError: If the name is unknown, or the library it names is not installed.
+    """
+    if name is None:
+        for candidate in AUTO_CODECS:
+            try:
+                return CODECS[candidate]()
+            except ImportError:
+                continue
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name!r}; expected one of {', '.join(CODECS)}")
+    try:
+        return CODECS[name]()
+    except ImportError as e:
+        raise ValueError(f"JSON codec {name!r} is not installed: {e}") from e
@@ -0,0 +1,236 @@
+# core/dedup.py - Martin Bukowski - 2023-08-26
+import re
+import threading
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .api import FINISH_LENGTH
+from .metrics import metrics
+
+# Phrases are compared by the overlapping character n-grams of their words
+SHINGLE_SIZE = 4
+# Bins of the one-permutation MinHash signature; a shingle's 32-bit hash picks its bin with the low bits and
+# ranks within it by the rest
+NUM_BINS = 32
+BIN_BITS = 5
+# Rows per LSH band; phrases sharing any band of their signature are compared
+BAND_ROWS = 4
+MAX_HASH = (1 << 32) - 1
+ROTATION_OFFSET = 0x9E3779B1
+DEFAULT_THRESHOLD = 0.7
+DEFAULT_FILTER_RETRIES = 2
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# The bird name and styles a set of phrases is deduplicated within
+IndexKey = Tuple[str, Tuple[str, ...]]
+
+# Rejection reasons
+EMPTY = "empty"
+TRUNCATED = "truncated"
+NEAR_DUPLICATE = "near_duplicate"
+
+def normalize(text: str) -> str:
+    """Reduce a phrase to its lower-cased words, so punctuation and spacing make no difference."""
+    return " ".join(WORD_PATTERN.findall(text.casefold()))
+
+def signature(text: str) -> bytes:
+    """The MinHash signature of a normalized phrase, as `NUM_BINS` packed 32-bit values.
+
+    Uses one-permutation hashing: each shingle's hash picks a bin and the bin keeps the smallest value, and
+    empty bins borrow from the next full one. The fraction of values two signatures share estimates the
+    Jaccard similarity of the phrases' shingles. Shingles are taken over the UTF-8 bytes and hashed with
+    CRC-32, so signatures are the same in every process and run.
+    """
+    data = text.encode("utf-8")
+    if len(data) <= SHINGLE_SIZE:
+        shingles = {data}
+    else:
+        shingles = {data[i:i + SHINGLE_SIZE] for i in range(len(data) - SHINGLE_SIZE + 1)}
+    bins = [-1] * NUM_BINS
+    for h in map(zlib.crc32, shingles):
+        slot = h & (NUM_BINS - 1)
+        value = h >> BIN_BITS
+        if bins[slot] < 0 or value < bins[slot]:
+            bins[slot] = value
+    dense = bins
+    if -1 in bins:
+        # Densify by rotation, offsetting borrowed values so that they differ from the lending bin's own
+        dense = list(bins)
+        for slot in range(NUM_BINS):
+            offset = 0
+            while bins[(slot + offset) % NUM_BINS] < 0:
+                offset += 1
+            dense[slot] = (bins[(slot + offset) % NUM_BINS] + offset * ROTATION_OFFSET) & MAX_HASH
+    return array("I", dense).tobytes()
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimate the similarity of two phrases from their signatures."""
+    left, right = array("I", a), array("I", b)
+    return sum(x == y for x, y in zip(left, right)) / NUM_BINS
+
+def merge_stats(stats: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum the `PhraseFilter.stats` of several filters, such as one per worker process."""
+    checked, stored, keys = 0, 0, 0
+    rejected = {EMPTY: 0, TRUNCATED: 0, NEAR_DUPLICATE: 0}
+    for entry in stats:
+        checked += entry["checked"]
+        stored += entry["stored"]
+        keys += entry["keys"]
+        for reason, count in entry["rejected"].items():
+            rejected[reason] = rejected.get(reason, 0) + count
+    accepted = checked - sum(rejected.values())
+    return {"checked": checked, "accepted": accepted, "rejected": rejected,
+            "acceptance_rate": accepted / checked if checked else None, "stored": stored, "keys": keys}
+
+class MinHashIndex:
+    """Signatures of the phrases stored for one (bird, styles), bucketed by LSH band.
+
+    Signatures are appended to one bytes buffer, and each of their bands is hashed into a dict of buckets, so
+    a lookup costs a few dict probes and signature comparisons however many phrases are stored, at about
+    `NUM_BINS * 4` bytes plus a bucket entry per band for each phrase. A bucket holds a single phrase id until
+    a second phrase lands in it.
+    """
+
+    __slots__ = ("signatures", "buckets", "count")
+
+    BAND_SIZE = BAND_ROWS * 4
+    BANDS = NUM_BINS // BAND_ROWS
+
+    def __init__(self):
+        self.signatures = bytearray()
+        self.buckets: Dict[int, object] = {}
+        self.count = 0
+
+    def band_keys(self, sig: bytes) -> List[int]:
+        return [hash((band, sig[band * self.BAND_SIZE:(band + 1) * self.BAND_SIZE])) for band in range(self.BANDS)]
+
+    def get(self, phrase_id: int) -> bytes:
+        size = NUM_BINS * 4
+        return bytes(self.signatures[phrase_id * size:(phrase_id + 1) * size])
+
+    def query(self, sig: bytes, threshold: float) -> bool:
+        """Whether a stored phrase is at least `threshold` similar to a signature."""
+        checked = set()
+        for key in self.band_keys(sig):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            for phrase_id in (bucket if isinstance(bucket, list) else (bucket,)):
+                if phrase_id in checked:
+                    continue
+                checked.add(phrase_id)
+                if similarity(sig, self.get(phrase_id)) >= threshold:
+                    return True
+        return False
+
+    def add(self, sig: bytes) -> None:
+        """Store a signature."""
+        phrase_id = self.count
+        self.signatures += sig
+        self.count += 1
+        for key in self.band_keys(sig):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                self.buckets[key] = phrase_id
+            elif isinstance(bucket, list):
+                bucket.append(phrase_id)
+            else:
+                self.buckets[key] = [bucket, phrase_id]
+
+class PhraseFilter:
+    """Rejects empty, truncated and near-duplicate phrases, remembering every phrase it accepts.
+
+    Near-duplicates are found with MinHash over character shingles, indexed per (bird, styles) with
+    locality-sensitive hashing, so checking a phrase stays fast with millions stored. Phrases at least
+    `threshold` similar to one already accepted for the same bird and styles are rejected, as are phrases with
+    no words and phrases the server reports were cut off by their token budget.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, retries: int = DEFAULT_FILTER_RETRIES):
+        """Initialize a new PhraseFilter.
+
+        Args:
+            threshold (float): The estimated similarity, from 0 to 1, at which a phrase counts as a
+                near-duplicate. 1 only rejects phrases with the same words.
+            retries (int): How many times a caller should regenerate rejected phrases before giving up.
+        """
+        self.threshold = threshold
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.indexes: Dict[IndexKey, MinHashIndex] = {}
+        self.checked = 0
+        self.rejected: Dict[str, int] = {EMPTY: 0, TRUNCATED: 0, NEAR_DUPLICATE: 0}
+
+    @classmethod
+    def from_config(cls, phrase_filter: bool = False, filter_threshold: float = DEFAULT_THRESHOLD,
+                    filter_retries: int = DEFAULT_FILTER_RETRIES, **config) -> Optional['PhraseFilter']:
+        """Create a new PhraseFilter from configuration settings.
+
+        Args:
+            phrase_filter (bool): Whether to filter phrases at all.
+            filter_threshold (float): The similarity at which a phrase counts as a near-duplicate.
+            filter_retries (int): How many times to regenerate rejected phrases.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            Optional[PhraseFilter]: A new PhraseFilter, or None if filtering is disabled.
+        """
+        if not phrase_filter:
+            return None
+        return cls(threshold=filter_threshold, retries=filter_retries)
+
+    @staticmethod
+    def make_key(name: str, styles: List[str]) -> IndexKey:
+        return name, tuple(styles)
+
+    def check(self, key: IndexKey, phrase: str) -> Optional[str]:
+        """Check a phrase, and remember it if it is accepted.
+
+        Args:
+            key (IndexKey): The (bird name, styles) the phrase was generated for.
+            phrase (str): The phrase. A `Completion` with a `finish_reason` of `length` counts as truncated;
+                a plain str never does.
+
+        Returns:
+            Optional[str]: None if the phrase is accepted, or the reason it was rejected: `empty`, `truncated`
+                or `near_duplicate`.
+        """
+        with metrics.timer("filter"):
+            reason = None
+            text = normalize(phrase)
+            if not text:
+                reason = EMPTY
+            elif getattr(phrase, "finish_reason", None) == FINISH_LENGTH:
+                reason = TRUNCATED
+            else:
+                sig = signature(text)
+                with self.lock:
+                    index = self.indexes.get(key)
+                    if index is None:
+                        index = self.indexes[key] = MinHashIndex()
+                    if index.query(sig, self.threshold):
+                        reason = NEAR_DUPLICATE
+                    else:
+                        index.add(sig)
+            with self.lock:
+                self.checked += 1
+                if reason is not None:
+                    self.rejected[reason] += 1
+        metrics.increment("filtered_phrases", result=reason or "accepted")
+        return reason
+
+    def accept(self, key: IndexKey, phrases: List[str]) -> List[str]:
+        """Check several phrases, returning those accepted. See `check`."""
+        return [phrase for phrase in phrases if self.check(key, phrase) is None]
+
+    def stats(self) -> Dict[str, object]:
+        """Return the phrases checked, accepted and rejected by reason, the acceptance rate and the phrases stored."""
+        with self.lock:
+            rejected = dict(self.rejected)
+            checked = self.checked
+            stored = sum(index.count for index in self.indexes.values())
+            keys = len(self.indexes)
+        accepted = checked - sum(rejected.values())
+        return {"checked": checked, "accepted": accepted, "rejected": rejected,
+                "acceptance_rate": accepted / checked if checked else None, "stored": stored, "keys": keys}
@@ -0,0 +1,222 @@
+# core/engine.py - Martin Bukowski - 2023-08-26
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .api import OAIApi
+from .budget import TokenBudget
+from .dedup import PhraseFilter, merge_stats
+from .examples import ExampleStore
+from .generator import PhraseWizard, DEFAULT_CHOICES, DEFAULT_WORKERS
+from .prompter import Prompter
+from .rookery import Rookery
+from .sampler import Sampler, Seed
+
+logger = logging.getLogger(__name__)
+
+# Jobs handed to a worker process at a time
+DEFAULT_CHUNK_SIZE = 64
+
+# Limits that are totals across the worker processes, and so are split between them
+SHARED_LIMIT_KEYS = ("requests_per_second", "tokens_per_minute", "concurrency_limit")
+
+# A chunk's results as JSON lines, with the number of results and of errors among them
+ChunkResult = Tuple[str, int, int]
+# A chunk's results, with the id of the process that ran it and its phrase filter's running stats
+WorkerResult = Tuple[ChunkResult, int, Optional[Dict[str, Any]]]
+
+def split_limits(limits: Dict[str, Any], processes: int) -> Dict[str, Any]:
+    """Return the limits with each of `SHARED_LIMIT_KEYS` divided between the processes."""
+    split = dict(limits)
+    for key in SHARED_LIMIT_KEYS:
+        if split.get(key):
+            # A concurrency limit stays a whole number, and at least one request each
+            split[key] = max(1, split[key] // processes) if key == "concurrency_limit" else split[key] / processes
+    return split
+
+def worker_config(config: Dict[str, Any], processes: int) -> Dict[str, Any]:
+    """Return the configuration for each of a number of worker processes.
+
+    Rate and concurrency limits are kept per process, so those set globally or on endpoint objects are divided
+    between the processes, and together they stay within what is configured.
+
+    Args:
+        config (Dict[str, Any]): The configuration of the whole run.
+        processes (int): The number of worker processes.
+
+    Returns:
+        Dict[str, Any]: The configuration each worker process loads its resources from.
+    """
+    if processes <= 1:
+        return config
+    shared = split_limits(config, processes)
+    if isinstance(config.get("endpoint"), list):
+        shared["endpoint"] = [split_limits(spec, processes) if isinstance(spec, dict) else spec
+                              for spec in config["endpoint"]]
+    if shared != config:
+        logger.info(f"Dividing rate and concurrency limits between {processes} worker processes")
+    return shared
+
+class Worker:
+    """The resources of one worker process, loaded once when the process starts."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.api = OAIApi.from_config(**config)
+        self.rookery = Rookery.from_config(**config)
+        self.prompter = Prompter.from_config(**config)
+        self.wizard = PhraseWizard.factory(api=self.api, rookery=self.rookery, examples=ExampleStore.from_config(**config),
+                                           budget=TokenBudget.from_config(prompter=self.prompter, **config),
+                                           phrase_filter=PhraseFilter.from_config(**config),
+                                           provenance=config.get("phrase_store_path") is not None)
+        self.seed: Seed = config.get("sample_seed")
+
+    def run(self, start: int, jobs: List[Dict[str, Any]], workers: int, choices: int) -> ChunkResult:
+        """Generate phrases for a chunk of jobs, returning them already serialized."""
+        if self.seed is not None:
+            # Seeded per chunk, so the prompts drawn do not depend on which process runs which chunk
+            self.prompter.sampler = Sampler(seed=f"{self.seed}:{start}", cycle=self.prompter.sampler.cycle)
+        lines = []
+        errors = 0
+        for result in self.wizard.generate_many(jobs=jobs, rookery=self.rookery, prompter=self.prompter,
+                                                workers=workers, ordered=True, choices=choices):
+            result["job"] += start
+            errors += "error" in result
+            lines.append(json.dumps(result))
+        return "".join(line + "\n" for line in lines), len(lines), errors
+
+# The worker of the current process, set by `init_worker`
+worker: Optional[Worker] = None
+
+def init_worker(config: Dict[str, Any]) -> None:
+    global worker
+    worker = Worker(config)
+
+def run_chunk(start: int, jobs: List[Dict[str, Any]], workers: int, choices: int) -> WorkerResult:
+    phrase_filter = worker.wizard.phrase_filter
+    result = worker.run(start, jobs, workers, choices)
+    return result, os.getpid(), phrase_filter.stats() if phrase_filter is not None else None
+
+class ProcessEngine:
+    """Generates phrases for a stream of batch jobs over a pool of worker processes.
+
+    Each process loads the API client, birds, styles and examples once, keeps its own connection pool, and
+    runs `PhraseWizard.generate_many` over its own threads. The coordinator hands out jobs in chunks and gets
+    each chunk's results back as one block of JSON lines, so the per-job cost of crossing processes is a
+    small pickle of the job on the way out and a share of one string on the way back. JSON encoding, prompt
+    building and response parsing all happen in the workers.
+
+    At most two chunks per process are in flight, so job streams of any length run in constant memory. With
+    a `sample_seed`, each chunk's prompts are drawn from a seed derived from its position, so a run gives the
+    same results however many processes it uses. Each process filters phrases with its own phrase filter,
+    whose stats come back with every chunk and are summed by `filter_stats`. Each process also has its own
+    rate limiters, so the configured limits are divided between the processes.
+    """
+
+    def __init__(self, config: Dict[str, Any], processes: Optional[int] = None, workers: int = DEFAULT_WORKERS,
+                 choices: int = DEFAULT_CHOICES, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Initialize a new ProcessEngine.
+
+        Args:
+            config (Dict[str, Any]): The configuration the worker processes load their resources from, with the
+                limits in `SHARED_LIMIT_KEYS` divided between them.
+            processes (Optional[int]): The number of worker processes, or None for one per core.
+            workers (int): The number of request threads in each process.
+            choices (int): The maximum number of phrases to request per API call.
+            chunk_size (int): The number of jobs handed to a process at a time.
+        """
+        self.config = config
+        self.processes = processes or os.cpu_count() or 1
+        self.workers = workers
+        self.choices = choices
+        self.chunk_size = max(1, chunk_size)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # The latest phrase filter stats of each worker process
+        self.filters: Dict[int, Dict[str, Any]] = {}
+
+    def start(self) -> 'ProcessEngine':
+        """Start the worker processes; `run` starts them on first use."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker,
+                                                initargs=(worker_config(self.config, self.processes),))
+        return self
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self) -> 'ProcessEngine':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def chunks(self, jobs: Iterable[Dict[str, Any]]) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """Split jobs into chunks, each tagged with the index of its first job."""
+        chunk = []
+        start = 0
+        for index, job in enumerate(jobs):
+            if not chunk:
+                start = index
+            chunk.append(job)
+            if len(chunk) >= self.chunk_size:
+                yield start, chunk
+                chunk = []
+        if chunk:
+            yield start, chunk
+
+    def run_chunks(self, jobs: Iterable[Dict[str, Any]], ordered: bool = False) -> Iterator[ChunkResult]:
+        """Generate phrases for a stream of jobs, yielding each chunk's results as JSON lines.
+
+        Args:
+            jobs (Iterable[Dict[str, Any]]): The jobs to run, as for `PhraseWizard.generate_many`.
+            ordered (bool): Yield chunks in input order rather than completion order.
+
+        Yields:
+            ChunkResult: The chunk's results as JSON lines tagged with their `job` index, the number of
+                results and the number of errors among them.
+        """
+        self.start()
+        window = self.processes * 2
+        pending = deque()
+        queued = self.chunks(jobs)
+
+        def fill() -> None:
+            while len(pending) < window:
+                chunk = next(queued, None)
+                if chunk is None:
+                    return
+                pending.append(self.executor.submit(run_chunk, chunk[0], chunk[1], self.workers, self.choices))
+
+        fill()
+        while pending:
+            if ordered:
+                future: Future = pending.popleft()
+                yield self.collect(future.result())
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield self.collect(future.result())
+            fill()
+
+    def collect(self, result: WorkerResult) -> ChunkResult:
+        """Record the filter stats a chunk came back with, and return its results."""
+        chunk, pid, stats = result
+        if stats is not None:
+            self.filters[pid] = stats
+        return chunk
+
+    def filter_stats(self) -> Optional[Dict[str, Any]]:
+        """Return the phrase filter stats summed over the worker processes, or None without a filter."""
+        return merge_stats(self.filters.values()) if self.filters else None
+
+    def run(self, jobs: Iterable[Dict[str, Any]], ordered: bool = False) -> Iterator[Dict[str, Any]]:
+        """Generate phrases for a stream of jobs, yielding each result. See `run_chunks`."""
+        for lines, _, _ in self.run_chunks(jobs, ordered=ordered):
+            for line in lines.splitlines():
+                yield json.loads(line)
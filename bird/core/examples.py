@@ -0,0 +1,155 @@
+# core/examples.py - Martin Bukowski - 2023-08-26
+import bisect
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from ..model.example import Example
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXAMPLE_COUNT = 3
+DEFAULT_EXAMPLE_TOKEN_BUDGET = 256
+# Candidates examined per example wanted, bounding selection when most candidates are over budget
+SCAN_FACTOR = 4
+
+IndexKey = Tuple[str, str]
+# (-score, example_id, example), so that lists sort best first and ties keep insertion order
+Entry = Tuple[float, int, Example]
+
+class ExampleStore:
+    """Past good phrases indexed by bird and style, for few-shot prompts.
+
+    Each (bird, style) list is kept sorted by score, so selecting the top examples only walks the head of a
+    few lists. Selection is deterministic and returns examples in the order they were added, so the same bird
+    and styles always render the same few-shot block and the prompt prefix stays cacheable on the server.
+    """
+
+    def __init__(self, count: int = DEFAULT_EXAMPLE_COUNT, token_budget: int = DEFAULT_EXAMPLE_TOKEN_BUDGET,
+                 path: Optional[str] = None):
+        """Initialize a new ExampleStore.
+
+        Args:
+            count (int): The maximum number of examples per prompt.
+            token_budget (int): The maximum estimated tokens of examples per prompt.
+            path (Optional[str]): A JSONL file of {name, styles, phrase, score} examples to load.
+        """
+        self.count = count
+        self.token_budget = token_budget
+        self.path = path
+        self.index: Dict[IndexKey, List[Entry]] = {}
+        self.phrases: Dict[str, set] = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @classmethod
+    def from_config(cls, example_data_path: Optional[str] = None, example_count: int = DEFAULT_EXAMPLE_COUNT,
+                    example_token_budget: int = DEFAULT_EXAMPLE_TOKEN_BUDGET, **config) -> Optional['ExampleStore']:
+        """Create an example store from configuration settings.
+
+        Args:
+            example_data_path (Optional[str]): A JSONL file of examples, or None to disable few-shot prompts.
+            example_count (int): The maximum number of examples per prompt.
+            example_token_budget (int): The maximum estimated tokens of examples per prompt.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            Optional[ExampleStore]: The store, or None if few-shot prompts are disabled.
+        """
+        if example_data_path is None:
+            return None
+        return cls(count=example_count, token_budget=example_token_budget, path=example_data_path)
+
+    def add(self, name: str, styles: List[str], phrase: str, score: float = 1.0) -> Optional[Example]:
+        """Add a phrase as an example for a bird and each of its styles.
+
+        Args:
+            name (str): The bird name.
+            styles (List[str]): The styles the phrase was generated with.
+            phrase (str): The phrase.
+            score (float): How good the phrase is; higher scores are picked first.
+
+        Returns:
+            Optional[Example]: The new example, or None if the bird already has this phrase.
+        """
+        with self.lock:
+            seen = self.phrases.setdefault(name, set())
+            if not phrase or phrase in seen:
+                return None
+            seen.add(phrase)
+            example = Example(example_id=self.size, name=name, styles=list(styles), phrase=phrase, score=score)
+            self.size += 1
+            entry = (-score, example.example_id, example)
+            for style in dict.fromkeys(styles):
+                bisect.insort(self.index.setdefault((name, style), []), entry)
+        return example
+
+    def select(self, name: str, styles: List[str], count: Optional[int] = None,
+               token_budget: Optional[int] = None) -> List[Example]:
+        """Pick the best examples for a bird and styles that fit the token budget.
+
+        Styles are searched in order, so examples sharing the first style are preferred and styles appended to
+        every request, which come last, only fill the remaining slots.
+
+        Args:
+            name (str): The bird name.
+            styles (List[str]): The requested styles.
+            count (Optional[int]): The maximum number of examples, defaulting to the store's.
+            token_budget (Optional[int]): The maximum estimated tokens, defaulting to the store's.
+
+        Returns:
+            List[Example]: The chosen examples, oldest first.
+        """
+        count = self.count if count is None else count
+        budget = self.token_budget if token_budget is None else token_budget
+        chosen: Dict[int, Example] = {}
+        scanned = 0
+        with self.lock:
+            for style in styles:
+                for _, example_id, example in self.index.get((name, style), ()):
+                    if len(chosen) >= count or budget <= 0 or scanned >= count * SCAN_FACTOR:
+                        break
+                    scanned += 1
+                    if example_id in chosen or example.tokens > budget:
+                        continue
+                    chosen[example_id] = example
+                    budget -= example.tokens
+        return [chosen[example_id] for example_id in sorted(chosen)]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def load(self, path: str) -> None:
+        """Load examples from a JSONL file, such as the output of the `batch` command.
+
+        Args:
+            path (str): The file to read.
+        """
+        with open(path, 'r') as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                    self.add(name=data["name"], styles=data["styles"], phrase=data["phrase"],
+                             score=data.get("score", 1.0))
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    logger.error(f"Skipping invalid example on line {line_number} of {path}: {e}")
+
+    def save(self, path: str) -> None:
+        """Save all examples to a JSONL file, replacing it atomically.
+
+        Args:
+            path (str): The file to write.
+        """
+        with self.lock:
+            examples = {entry[1]: entry[2] for entries in self.index.values() for entry in entries}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for example_id in sorted(examples):
+                f.write(json.dumps(examples[example_id].to_dict()) + "\n")
+        os.replace(tmp_path, path)
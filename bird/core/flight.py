@@ -0,0 +1,111 @@
+# core/flight.py - Martin Bukowski - 2023-08-26
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+class Call(Generic[T]):
+    """A call in flight, whose outcome is handed to every caller that joined it."""
+
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[T] = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one call, for threads.
+
+    The first caller for a key runs the function; callers arriving while it runs block until it finishes and
+    receive the same result, or the same exception. The key is forgotten as soon as the call finishes, so
+    later callers start a new call: this deduplicates work in flight, it does not cache results.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[Hashable, Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """Run `fn`, or wait for the call already running under the same key.
+
+        Args:
+            key (Hashable): Identifies calls that can share a result, such as the request payload.
+            fn (Callable[[], T]): The call to make.
+
+        Returns:
+            Tuple[T, bool]: The result, and whether it was shared from another caller's call.
+
+        Raises:
+            Exception: Whatever `fn` raised, in every caller that shared the call.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.value, False
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+class AsyncSingleFlight:
+    """Collapses concurrent calls with the same key into one call, for asyncio.
+
+    The call runs as its own task, so a caller that is cancelled does not cancel it for the callers still
+    waiting on it. Calls are only shared between callers on the same event loop.
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Await `fn()`, or the call already running under the same key.
+
+        Args:
+            key (Hashable): Identifies calls that can share a result, such as the request payload.
+            fn (Callable[[], Awaitable[T]]): Makes the call to await.
+
+        Returns:
+            Tuple[T, bool]: The result, and whether it was shared from another caller's call.
+
+        Raises:
+            Exception: Whatever the call raised, in every caller that shared it.
+        """
+        task = self.calls.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self.calls[key] = task
+        task.add_done_callback(lambda done: self.forget(key, done))
+        return await asyncio.shield(task), False
+
+    def forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the outcome as retrieved, in case every caller was cancelled before it finished
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self.calls)
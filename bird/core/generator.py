@@ -1,41 +1,157 @@
 # core/generator.py - Martin Bukowski - 2023-08-26
-from typing import List, Dict, Any
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
 import logging
-from .api import OAIApi
+from .api import OAIApi, AsyncOAIApi, CompletionStream, AsyncCompletionStream
+from .budget import Limits, TokenBudget
+from .dedup import PhraseFilter
+from .prompter import Prompter, DEFAULT_STYLES
+from .rookery import Rookery
+from .examples import ExampleStore
+from .metrics import metrics
+from .sampler import Sampler
+from .template import PromptTemplate
 from ..model.bird import Bird
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_WORKERS = 8
+DEFAULT_CHOICES = 16
+
+def job_count(job: Dict[str, Any]) -> int:
+    """Return the number of phrases a batch job asks for.
+
+    Raises:
+        ValueError: If the job's `n` is not an integer.
+    """
+    n = job.get("n", 1)
+    if isinstance(n, int) and not isinstance(n, bool):
+        return n
+    if isinstance(n, str) and n.strip().lstrip("+-").isdigit():
+        return int(n)
+    raise ValueError(f"'n' must be an integer, not {n!r}")
+
 class PhraseWizard:
     """Generates phrases based on bird personalities and styles."""
     
-    def __init__(self, api: OAIApi):
+    def __init__(self, api: Union[OAIApi, AsyncOAIApi], templates: Optional[Dict[str, PromptTemplate]] = None,
+                 examples: Optional[ExampleStore] = None, budget: Optional[TokenBudget] = None,
+                 phrase_filter: Optional[PhraseFilter] = None, provenance: bool = False):
         """Initialize the PhraseWizard with an API client.
 
         Args:
-            api (OAIApi): The API client for generating text.
+            api (Union[OAIApi, AsyncOAIApi]): The API client for generating text. Use an `AsyncOAIApi`
+                with `agenerate_phrase`.
+            templates (Optional[Dict[str, PromptTemplate]]): Precompiled prompt templates by bird name, such as
+                `Rookery.templates`. Templates for other birds are compiled on first use.
+            examples (Optional[ExampleStore]): Past phrases to build few-shot prompts from.
+            budget (Optional[TokenBudget]): Picks each phrase's max_tokens and stop sequences from its styles
+                and bird. Without one, requests use the API client's defaults.
+            phrase_filter (Optional[PhraseFilter]): Rejects empty, truncated and near-duplicate phrases
+                generated for batch jobs, which are then regenerated.
+            provenance (bool): Add the resolved `prompts`, the request `latency` and the `backend` that
+                served it to each batch result, for the phrase store.
         """
         self.api = api
+        self.templates = templates if templates is not None else {}
+        self.examples = examples
+        self.budget = budget
+        self.phrase_filter = phrase_filter
+        self.provenance = provenance
 
     @classmethod
-    def factory(cls, api: OAIApi) -> 'PhraseWizard':
+    def factory(cls, api: Union[OAIApi, AsyncOAIApi], rookery: Optional[Rookery] = None,
+                examples: Optional[ExampleStore] = None, budget: Optional[TokenBudget] = None,
+                phrase_filter: Optional[PhraseFilter] = None, provenance: bool = False) -> 'PhraseWizard':
         """Factory method to create a new PhraseWizard instance.
 
         Args:
-            api (OAIApi): The API client for generating text.
+            api (Union[OAIApi, AsyncOAIApi]): The API client for generating text.
+            rookery (Optional[Rookery]): A rookery whose precompiled prompt templates to use.
+            examples (Optional[ExampleStore]): Past phrases to build few-shot prompts from.
+            budget (Optional[TokenBudget]): Picks each phrase's max_tokens and stop sequences.
+            phrase_filter (Optional[PhraseFilter]): Rejects empty, truncated and near-duplicate batch phrases.
+            provenance (bool): Add the prompts, latency and backend of each phrase to batch results.
 
         Returns:
             PhraseWizard: A new PhraseWizard instance.
         """
-        return cls(api=api)
+        return cls(api=api, templates=rookery.templates if rookery is not None else None, examples=examples,
+                   budget=budget, phrase_filter=phrase_filter, provenance=provenance)
+
+    def get_template(self, bird: Bird) -> PromptTemplate:
+        """Return the compiled prompt template for a bird, compiling it if needed.
+
+        Args:
+            bird (Bird): The bird character.
+
+        Returns:
+            PromptTemplate: The template, whose `prefix` is the same for every prompt for the bird.
+        """
+        template = self.templates.get(bird.name)
+        # A reloaded bird is a new object, so a template compiled for an older one is stale
+        if template is None or template.bird is not bird:
+            template = PromptTemplate.compile(bird)
+            self.templates[bird.name] = template
+        return template
+
+    def build_prompt(self, bird: Bird, prompts: List[str], styles: List[str]) -> str:
+        """Build the completion prompt for the given bird, prompts, and styles.
+
+        Args:
+            bird (Bird): The bird character for which to generate a phrase.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrase.
+
+        Returns:
+            str: The prompt text, with the best matching examples from the example store if one is set.
+        """
+        with metrics.timer("prompt_build"):
+            examples = self.examples.select(name=bird.name, styles=styles) if self.examples is not None else ()
+            return self.get_template(bird).render(prompts=prompts, styles=styles, examples=examples)
+
+    def resolve_limits(self, bird: Bird, styles: List[str], max_tokens: Optional[int] = None,
+                       stop: Optional[List[str]] = None) -> Limits:
+        """Resolve the max_tokens and stop sequences for a phrase, keeping any given explicitly.
+
+        Args:
+            bird (Bird): The bird character.
+            styles (List[str]): The styles to apply to the phrase.
+            max_tokens (Optional[int]): An explicit token budget, or None to use the wizard's budget.
+            stop (Optional[List[str]]): Explicit stop sequences, or None to use the styles'.
+
+        Returns:
+            Limits: The max_tokens and stop sequences, either None for the API client's default.
+        """
+        if self.budget is not None:
+            budget, style_stop = self.budget.limits(bird=bird, styles=styles, default=self.api.max_tokens)
+            max_tokens = max_tokens if max_tokens is not None else budget
+            stop = stop if stop is not None else style_stop
+        return max_tokens, stop
+
+    def observe(self, bird: Bird, styles: List[str], texts: List[str], max_tokens: Optional[int]) -> None:
+        """Report generated phrases to the budget, so it can learn their lengths."""
+        if self.budget is not None:
+            self.budget.observe(bird=bird, styles=styles, texts=texts,
+                                max_tokens=max_tokens if max_tokens is not None else self.api.max_tokens,
+                                default=self.api.max_tokens)
 
-    def generate_phrase(self, bird: Bird, prompts: List[str], styles: List[str], **kwargs: Any) -> str:
+    def generate_phrase(self, bird: Bird, prompts: List[str], styles: List[str], share: Optional[bool] = None,
+                        max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, cache: bool = True,
+                        **kwargs: Any) -> str:
         """Generate a phrase based on the given bird, prompts, and styles.
 
         Args:
             bird (Bird): The bird character for which to generate a phrase.
             prompts (List[str]): The prompts to guide the phrase generation.
             styles (List[str]): The styles to apply to the phrase.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use the API client's `share_requests`.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            cache (bool): Whether to use the API client's completion cache, if one is set.
             **kwargs (Any): Additional keyword arguments.
 
         Returns:
@@ -44,19 +160,414 @@ class PhraseWizard:
         Raises:
             Exception: Rethrows any known exceptions encountered during phrase generation.
         """
+        with metrics.timer("generate"):
+            prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+            max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
+
+            # Generate the phrase using the API
+            try:
+                generated_text = self.api.make_request(prompt=prompt, share=share, max_tokens=max_tokens, stop=stop,
+                                                       cache=cache)
+                self.observe(bird=bird, styles=styles, texts=[generated_text], max_tokens=max_tokens)
+                return generated_text
+            except Exception as e:
+                logger.error(f"Failed to generate phrase for bird {bird.name}: {e}")
+                raise e
+
+    async def agenerate_phrase(self, bird: Bird, prompts: List[str], styles: List[str], share: Optional[bool] = None,
+                               max_tokens: Optional[int] = None, stop: Optional[List[str]] = None, cache: bool = True,
+                               **kwargs: Any) -> str:
+        """Asynchronously generate a phrase based on the given bird, prompts, and styles.
+
+        The wizard must have been created with an `AsyncOAIApi`, whose concurrency limit bounds the number
+        of completions in flight across all callers.
+
+        Args:
+            bird (Bird): The bird character for which to generate a phrase.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrase.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use the API client's `share_requests`.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            cache (bool): Whether to use the API client's completion cache, if one is set.
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            str: The generated phrase.
+
+        Raises:
+            Exception: Rethrows any known exceptions encountered during phrase generation.
+        """
+        with metrics.timer("generate"):
+            prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+            max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
+
+            try:
+                generated_text = await self.api.make_request(prompt=prompt, share=share, max_tokens=max_tokens,
+                                                             stop=stop, cache=cache)
+                self.observe(bird=bird, styles=styles, texts=[generated_text], max_tokens=max_tokens)
+                return generated_text
+            except Exception as e:
+                logger.error(f"Failed to generate phrase for bird {bird.name}: {e}")
+                raise e
+
+    def stream_phrase(self, bird: Bird, prompts: List[str], styles: List[str], max_tokens: Optional[int] = None,
+                      stop: Optional[List[str]] = None, **kwargs: Any) -> CompletionStream:
+        """Generate a phrase, streaming its text as it is produced.
+
+        Args:
+            bird (Bird): The bird character for which to generate a phrase.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrase.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            CompletionStream: An iterator over the phrase text, which records time-to-first-token and tokens/sec.
+        """
+        prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+        max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
+
+        try:
+            return self.api.stream_request(prompt=prompt, max_tokens=max_tokens, stop=stop)
+        except Exception as e:
+            logger.error(f"Failed to generate phrase for bird {bird.name}: {e}")
+            raise e
 
-        # TODO we need to make this a multi-shot prompt
+    async def astream_phrase(self, bird: Bird, prompts: List[str], styles: List[str], max_tokens: Optional[int] = None,
+                             stop: Optional[List[str]] = None, **kwargs: Any) -> AsyncCompletionStream:
+        """Asynchronously generate a phrase, streaming its text as it is produced. See `stream_phrase`.
+
+        Args:
+            bird (Bird): The bird character for which to generate a phrase.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrase.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            AsyncCompletionStream: An async iterator over the phrase text.
+        """
+        prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+        max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
 
-        prompt = f"""Character: {bird.name}
-Persona: {bird.persona}
-Description: {bird.description}
-Generate a phrase for this character.  It should be {', '.join(prompts)}.
-{bird.name} [{','.join(styles)}]: \""""
-        
-        # Generate the phrase using the API
         try:
-            generated_text = self.api.make_request(prompt=prompt)
-            return generated_text
+            return await self.api.stream_request(prompt=prompt, max_tokens=max_tokens, stop=stop)
         except Exception as e:
             logger.error(f"Failed to generate phrase for bird {bird.name}: {e}")
-            raise e
\ No newline at end of file
+            raise e
+
+    def generate_phrases(self, bird: Bird, prompts: List[str], styles: List[str], n: int = 1,
+                         share: Optional[bool] = None, max_tokens: Optional[int] = None,
+                         stop: Optional[List[str]] = None, cache: bool = True, **kwargs: Any) -> List[str]:
+        """Generate `n` candidate phrases for the given bird, prompts, and styles in a single request.
+
+        Args:
+            bird (Bird): The bird character for which to generate phrases.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrases.
+            n (int): The number of phrases to generate.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use the API client's `share_requests`.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            cache (bool): Whether to use the API client's completion cache, if one is set.
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            List[str]: The generated phrases.
+
+        Raises:
+            Exception: Rethrows any known exceptions encountered during phrase generation.
+        """
+        with metrics.timer("generate"):
+            prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+            max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
+
+            try:
+                texts = self.api.make_completions(prompt=prompt, n=n, share=share, max_tokens=max_tokens, stop=stop,
+                                                  cache=cache)
+                self.observe(bird=bird, styles=styles, texts=texts, max_tokens=max_tokens)
+                return texts
+            except Exception as e:
+                logger.error(f"Failed to generate phrases for bird {bird.name}: {e}")
+                raise e
+
+    async def agenerate_phrases(self, bird: Bird, prompts: List[str], styles: List[str], n: int = 1,
+                                share: Optional[bool] = None, max_tokens: Optional[int] = None,
+                                stop: Optional[List[str]] = None, cache: bool = True, **kwargs: Any) -> List[str]:
+        """Asynchronously generate `n` candidate phrases in a single request. See `generate_phrases`.
+
+        Args:
+            bird (Bird): The bird character for which to generate phrases.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrases.
+            n (int): The number of phrases to generate.
+            share (Optional[bool]): Whether to share the completion with concurrent identical requests, or
+                None to use the API client's `share_requests`.
+            max_tokens (Optional[int]): The token budget, or None to resolve it from the styles and bird.
+            stop (Optional[List[str]]): The stop sequences, or None to resolve them from the styles.
+            cache (bool): Whether to use the API client's completion cache, if one is set.
+            **kwargs (Any): Additional keyword arguments.
+
+        Returns:
+            List[str]: The generated phrases.
+        """
+        with metrics.timer("generate"):
+            prompt = self.build_prompt(bird=bird, prompts=prompts, styles=styles)
+            max_tokens, stop = self.resolve_limits(bird=bird, styles=styles, max_tokens=max_tokens, stop=stop)
+
+            try:
+                texts = await self.api.make_completions(prompt=prompt, n=n, share=share, max_tokens=max_tokens,
+                                                        stop=stop, cache=cache)
+                self.observe(bird=bird, styles=styles, texts=texts, max_tokens=max_tokens)
+                return texts
+            except Exception as e:
+                logger.error(f"Failed to generate phrases for bird {bird.name}: {e}")
+                raise e
+
+    def generate_batch(self, requests: List[Tuple[Bird, List[str], List[str]]], n: int = 1) -> List[List[str]]:
+        """Generate phrases for several (bird, prompts, styles) requests with one multi-prompt API call.
+
+        The requests share one max_tokens and set of stop sequences, so the API client's defaults apply rather
+        than the wizard's budget.
+
+        Args:
+            requests (List[Tuple[Bird, List[str], List[str]]]): The bird, prompts, and styles of each request.
+            n (int): The number of phrases to generate per request.
+
+        Returns:
+            List[List[str]]: The generated phrases, one list of `n` phrases per request.
+        """
+        prompts = [self.build_prompt(bird=bird, prompts=bird_prompts, styles=styles)
+                   for bird, bird_prompts, styles in requests]
+        texts = self.api.make_completions(prompt=prompts, n=n)
+        return [texts[i * n:(i + 1) * n] for i in range(len(requests))]
+
+    def compose(self, bird: Bird, styles: List[str], prompter: Prompter,
+                sampler: Optional[Sampler] = None) -> Tuple[List[str], List[str]]:
+        """Resolve the prompts for a bird and styles, and add the default styles.
+
+        Args:
+            bird (Bird): The bird character for which to generate a phrase.
+            styles (List[str]): The requested styles.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            sampler (Optional[Sampler]): The sampler to draw prompts with, such as one seeded for a single
+                request, instead of the prompter's own.
+
+        Returns:
+            Tuple[List[str], List[str]]: The resolved prompts and the styles including the defaults.
+        """
+        prompts = prompter.get_prompts(bird=bird, styles=styles, sampler=sampler)
+        return prompts, styles + DEFAULT_STYLES
+
+    def prepare_job(self, job: Dict[str, Any], rookery: Rookery, prompter: Prompter,
+                    k: int = 1) -> Tuple[Dict[str, Any], Bird, List[List[str]]]:
+        """Look up a batch job's bird and draw `k` sets of prompts for it.
+
+        A job may carry its own `seed`, which makes its prompts the same on every run regardless of the jobs
+        around it.
+
+        Args:
+            job (Dict[str, Any]): The job, with a `name`, a list of `styles` and an optional `seed`.
+            rookery (Rookery): The rookery used to look up the bird.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            k (int): The number of sets of prompts to draw.
+
+        Returns:
+            Tuple[Dict[str, Any], Bird, List[List[str]]]: The result template with the job name and styles
+                including the defaults, the bird, and the sets of prompts.
+
+        Raises:
+            ValueError: If the bird or a style is not found.
+        """
+        name = job.get("name")
+        styles = list(job.get("styles", []))
+        bird = rookery.get_bird(bird_name=name)
+        if bird is None:
+            raise ValueError(f"Could not find bird with name {name}")
+        unknown = prompter.unknown_styles(bird, styles)
+        if unknown:
+            raise ValueError(f"Unknown styles for {name}: {', '.join(unknown)}")
+        sampler = prompter.sampler
+        if job.get("seed") is not None:
+            sampler = Sampler(seed=job["seed"], cycle=sampler.cycle)
+        prompt_sets = sampler.draw_prompts(bird=bird, styles=styles, prompter=prompter, k=k)
+        return {"name": name, "styles": styles + DEFAULT_STYLES}, bird, prompt_sets
+
+    def generate_candidates(self, bird: Bird, prompts: List[str], styles: List[str], n: int = 1) -> List[str]:
+        """Generate `n` phrases in one request for a batch job, never sharing or caching completions."""
+        # Batches and phrase pools collect distinct phrases, so identical jobs and the resampling of rejected
+        # phrases never get a completion that was shared or served before
+        if n == 1:
+            return [self.generate_phrase(bird=bird, prompts=prompts, styles=styles, share=False, cache=False)]
+        return self.generate_phrases(bird=bird, prompts=prompts, styles=styles, n=n, share=False, cache=False)
+
+    def generate_detailed(self, bird: Bird, prompts: List[str], styles: List[str],
+                          n: int = 1) -> List[Tuple[str, float, Optional[str]]]:
+        """Generate `n` phrases for a batch job, regenerating those the phrase filter rejects.
+
+        Only the rejected phrases are requested again, up to the filter's `retries` times, so fewer than `n`
+        phrases may come back.
+
+        Args:
+            bird (Bird): The bird character.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrases.
+            n (int): The number of phrases to generate.
+
+        Returns:
+            List[Tuple[str, float, Optional[str]]]: The accepted phrases, each with the seconds taken by the
+                request that produced it and the endpoint that served it.
+        """
+        key = self.phrase_filter.make_key(bird.name, styles) if self.phrase_filter is not None else None
+        accepted: List[Tuple[str, float, Optional[str]]] = []
+        for _ in range(1 + (self.phrase_filter.retries if self.phrase_filter is not None else 0)):
+            start = time.perf_counter()
+            candidates = self.generate_candidates(bird=bird, prompts=prompts, styles=styles, n=n - len(accepted))
+            latency = time.perf_counter() - start
+            backend = self.api.last_endpoint()
+            if self.phrase_filter is not None:
+                candidates = self.phrase_filter.accept(key=key, phrases=candidates)
+            accepted += [(phrase, latency, backend) for phrase in candidates]
+            if len(accepted) >= n:
+                break
+        return accepted
+
+    def generate_filtered(self, bird: Bird, prompts: List[str], styles: List[str], n: int = 1) -> List[str]:
+        """Generate `n` phrases for a batch job, regenerating those the phrase filter rejects.
+
+        See `generate_detailed`, which also returns the latency and backend of each phrase.
+
+        Returns:
+            List[str]: The accepted phrases.
+        """
+        if self.phrase_filter is None:
+            return self.generate_candidates(bird=bird, prompts=prompts, styles=styles, n=n)
+        return [phrase for phrase, _, _ in self.generate_detailed(bird=bird, prompts=prompts, styles=styles, n=n)]
+
+    def execute_job(self, result: Dict[str, Any], bird: Bird, prompts: List[str], n: int = 1) -> List[Dict[str, Any]]:
+        """Generate `n` phrases in one request for a prepared batch job, capturing any failure in the result.
+
+        With a phrase filter, rejected phrases are regenerated, and a job whose phrases are all rejected
+        gets an error.
+
+        Args:
+            result (Dict[str, Any]): The result template from `prepare_job`.
+            bird (Bird): The bird character.
+            prompts (List[str]): The prompts to guide the phrase generation.
+            n (int): The number of phrases to request.
+
+        Returns:
+            List[Dict[str, Any]]: One result per phrase with the job name, styles and `phrase`, plus its
+                `prompts`, `latency` and `backend` with `provenance`, or a single result carrying an `error`.
+        """
+        try:
+            if self.provenance:
+                results = [{**result, "phrase": phrase, "prompts": prompts, "latency": latency, "backend": backend}
+                           for phrase, latency, backend in self.generate_detailed(bird=bird, prompts=prompts,
+                                                                                  styles=result["styles"], n=n)]
+            else:
+                results = [{**result, "phrase": phrase}
+                           for phrase in self.generate_filtered(bird=bird, prompts=prompts, styles=result["styles"], n=n)]
+        except Exception as e:
+            return [{**result, "error": str(e)}]
+        if not results:
+            return [{**result, "error": "Every generated phrase was rejected by the phrase filter"}]
+        return results
+
+    def run_job(self, job: Dict[str, Any], rookery: Rookery, prompter: Prompter, n: int = 1) -> List[Dict[str, Any]]:
+        """Generate `n` phrases in one request for a batch job, capturing any failure in the result.
+
+        Args:
+            job (Dict[str, Any]): The job, with a `name`, a list of `styles` and an optional `seed`.
+            rookery (Rookery): The rookery used to look up the bird.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            n (int): The number of phrases to request.
+
+        Returns:
+            List[Dict[str, Any]]: One result per phrase with the job name, styles and `phrase`, or a single
+                result carrying an `error`.
+        """
+        try:
+            result, bird, prompt_sets = self.prepare_job(job=job, rookery=rookery, prompter=prompter)
+        except Exception as e:
+            return [{"name": job.get("name"), "styles": job.get("styles", []), "error": str(e)}]
+        return self.execute_job(result=result, bird=bird, prompts=prompt_sets[0], n=n)
+
+    def generate_many(self, jobs: Iterable[Dict[str, Any]], rookery: Rookery, prompter: Prompter,
+                      workers: int = DEFAULT_WORKERS, ordered: bool = False,
+                      choices: int = DEFAULT_CHOICES) -> Iterator[Dict[str, Any]]:
+        """Generate phrases for a stream of jobs over a pool of worker threads.
+
+        Each job is a dict with a bird `name`, a list of `styles`, an optional count `n` (default 1) and an
+        optional `seed`. A job is split into requests of up to `choices` phrases each, which share one prompt
+        per request. Prompts are drawn on the calling thread in job order, so a seeded sampler draws the same
+        prompts on every run however the requests are scheduled. Jobs are consumed lazily, with at most a few
+        requests per worker queued at a time, so arbitrarily long job streams run in constant memory. Failed
+        requests are reported in the results rather than raised.
+
+        Args:
+            jobs (Iterable[Dict[str, Any]]): The jobs to run.
+            rookery (Rookery): The rookery used to look up birds.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            workers (int): The number of worker threads.
+            ordered (bool): Yield results in input order rather than completion order.
+            choices (int): The maximum number of phrases to request per API call.
+
+        Yields:
+            Dict[str, Any]: One result per requested phrase, tagged with the `job` index it came from.
+        """
+        def tasks() -> Iterator[Tuple[int, Dict[str, Any], Optional[Bird], Optional[List[str]], int]]:
+            for index, job in enumerate(jobs):
+                if isinstance(job.get("styles"), str):
+                    job = {**job, "styles": [job["styles"]]}
+                per_request = max(1, choices)
+                try:
+                    total = job_count(job)
+                    if total <= 0:
+                        continue
+                    # One draw per request, all at once
+                    result, bird, prompt_sets = self.prepare_job(job=job, rookery=rookery, prompter=prompter,
+                                                                 k=-(-total // per_request))
+                except Exception as e:
+                    yield index, {"name": job.get("name"), "styles": job.get("styles", []), "error": str(e)}, None, None, 0
+                    continue
+                remaining = total
+                for prompts in prompt_sets:
+                    if remaining <= 0:
+                        break
+                    n = min(remaining, per_request)
+                    remaining -= n
+                    yield index, result, bird, prompts, n
+
+        def run(index: int, result: Dict[str, Any], bird: Optional[Bird], prompts: Optional[List[str]],
+                n: int) -> List[Dict[str, Any]]:
+            results = self.execute_job(result=result, bird=bird, prompts=prompts, n=n) if bird is not None else [result]
+            return [{"job": index, **result} for result in results]
+
+        window = max(1, workers) * 2
+        pending = deque()
+        queued = tasks()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def fill() -> None:
+                while len(pending) < window:
+                    task = next(queued, None)
+                    if task is None:
+                        return
+                    pending.append(executor.submit(run, *task))
+
+            fill()
+            while pending:
+                if ordered:
+                    future: Future = pending.popleft()
+                    yield from future.result()
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                        yield from future.result()
+                fill()
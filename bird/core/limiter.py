@@ -0,0 +1,332 @@
+# core/limiter.py - Martin Bukowski - 2023-08-26
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration keys that limit an endpoint; each can be set globally or on an endpoint object
+LIMIT_KEYS = ("requests_per_second", "tokens_per_minute", "concurrency_limit", "adaptive_concurrency", "target_latency")
+
+DEFAULT_CONCURRENCY_LIMIT = 64
+# The adaptive limit starts here, and grows while the endpoint keeps up
+INITIAL_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+# Multiplicative decrease on overload
+BACKOFF_RATIO = 0.5
+# Statuses that mean the endpoint is overloaded, rather than that the request was bad
+OVERLOAD_STATUS_CODES = (429, 503)
+# Smoothing factors for the recent and long-run latency averages
+SHORT_LATENCY_ALPHA = 0.2
+LONG_LATENCY_ALPHA = 0.02
+# Without a target latency, recent latency this many times the long-run average counts as overload
+LATENCY_TOLERANCE = 2.0
+# Seconds of traffic a bucket can absorb in a burst; token budgets allow longer bursts, as one request can
+# spend many seconds' worth of tokens
+BURST_SECONDS = 1.0
+TOKEN_BURST_SECONDS = 10.0
+
+class TokenBucket:
+    """Spends tokens that refill at a steady rate, up to a burst capacity.
+
+    A reservation always succeeds and may leave the bucket in debt; the caller waits out the returned delay
+    before going ahead. Blocking threads and asyncio tasks can then share one bucket.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """Initialize a new TokenBucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (Optional[float]): The most tokens the bucket holds, or None for `BURST_SECONDS` worth.
+        """
+        self.lock = threading.Lock()
+        self.configure(rate, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def configure(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate * BURST_SECONDS)
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take tokens from the bucket.
+
+        Args:
+            amount (float): The tokens to take.
+
+        Returns:
+            float: Seconds to wait before the tokens are really available, 0 if they already are.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+class ConcurrencyLimit:
+    """Bounds the requests in flight to an endpoint, optionally adapting the bound to how the endpoint copes.
+
+    With `adaptive`, the limit follows additive-increase/multiplicative-decrease: every request that finishes
+    in time raises it by `1 / limit`, about one per round of requests, and an overload halves it, at most once
+    per round trip. A request is overloaded when the endpoint answers 429 or 503, cannot be reached, or when
+    recent latency exceeds `target_latency`, or `LATENCY_TOLERANCE` times its long-run average without one.
+
+    Waiters are queued in order and handed a slot as one frees up. Threads block on an event; asyncio tasks
+    await a future, which may be resolved from another thread.
+    """
+
+    def __init__(self, max_limit: int = DEFAULT_CONCURRENCY_LIMIT, adaptive: bool = False,
+                 target_latency: Optional[float] = None):
+        """Initialize a new ConcurrencyLimit.
+
+        Args:
+            max_limit (int): The most requests in flight at once.
+            adaptive (bool): Adapt the limit between `MIN_CONCURRENCY` and `max_limit`, starting at
+                `INITIAL_CONCURRENCY`; otherwise the limit is `max_limit`.
+            target_latency (Optional[float]): Seconds above which a request counts as overloaded, or None to
+                compare against the long-run average.
+        """
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.waiters: Deque[Callable[[], Any]] = deque()
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.decreased_at = 0.0
+        self.limit = float(min(max_limit, INITIAL_CONCURRENCY) if adaptive else max_limit)
+        self.configure(max_limit=max_limit, adaptive=adaptive, target_latency=target_latency)
+
+    def configure(self, max_limit: int = DEFAULT_CONCURRENCY_LIMIT, adaptive: bool = False,
+                  target_latency: Optional[float] = None) -> None:
+        """Change the settings, keeping the current adaptive limit where it still fits."""
+        with self.lock:
+            self.max_limit = max(MIN_CONCURRENCY, max_limit)
+            self.adaptive = adaptive
+            self.target_latency = target_latency
+            self.limit = min(self.limit, self.max_limit) if adaptive else float(self.max_limit)
+            woken = self.wake()
+        for wake in woken:
+            wake()
+
+    def available(self) -> bool:
+        return self.inflight < max(MIN_CONCURRENCY, int(self.limit))
+
+    def wake(self) -> List[Callable[[], Any]]:
+        """Hand free slots to queued waiters, returning their wake-ups to call once the lock is released."""
+        woken = []
+        while self.waiters and self.available():
+            self.inflight += 1
+            woken.append(self.waiters.popleft())
+        return woken
+
+    def acquire(self) -> None:
+        """Block until a slot is free, and take it."""
+        with self.lock:
+            if not self.waiters and self.available():
+                self.inflight += 1
+                return
+            event = threading.Event()
+            self.waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self) -> None:
+        """Wait until a slot is free, and take it, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if not self.waiters and self.available():
+                self.inflight += 1
+                return
+            future = loop.create_future()
+            waiter = lambda: loop.call_soon_threadsafe(self.grant, future)
+            self.waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                queued = waiter in self.waiters
+                if queued:
+                    self.waiters.remove(waiter)
+            # A slot handed over just before the cancellation is given back
+            if not queued and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def grant(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """Give a slot back, adapting the limit to how the request went.
+
+        Args:
+            latency (Optional[float]): Seconds the request took, or None if it never reached the endpoint.
+            overloaded (bool): Whether the endpoint was overloaded, such as by answering 429 or 503.
+        """
+        with self.lock:
+            self.inflight -= 1
+            if self.adaptive and (latency is not None or overloaded):
+                self.adapt(latency, overloaded)
+            woken = self.wake()
+        for wake in woken:
+            wake()
+
+    def adapt(self, latency: Optional[float], overloaded: bool) -> None:
+        if latency is not None and not overloaded:
+            if self.short_latency is None:
+                self.short_latency = self.long_latency = latency
+            else:
+                self.short_latency += SHORT_LATENCY_ALPHA * (latency - self.short_latency)
+                self.long_latency += LONG_LATENCY_ALPHA * (latency - self.long_latency)
+            target = self.target_latency if self.target_latency is not None else LATENCY_TOLERANCE * self.long_latency
+            overloaded = self.short_latency > target
+
+        if not overloaded:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            return
+        # Requests already in flight report the same overload; only back off once per round trip
+        now = time.monotonic()
+        if now - self.decreased_at >= (self.short_latency or 0.0):
+            self.limit = max(MIN_CONCURRENCY, self.limit * BACKOFF_RATIO)
+            self.decreased_at = now
+
+class EndpointLimiter:
+    """The request rate, token rate and concurrency limits of one endpoint.
+
+    A request first takes a concurrency slot, then waits for both rate buckets, so its latency as seen by the
+    adaptive limit starts after any waiting. Use `acquire` from threads and `aacquire` from asyncio.
+    """
+
+    def __init__(self, endpoint: str, **limits: Any):
+        """Initialize a new EndpointLimiter.
+
+        Args:
+            endpoint (str): The endpoint base URL.
+            **limits: The settings named in `LIMIT_KEYS`, see `configure`.
+        """
+        self.endpoint = endpoint
+        self.requests: Optional[TokenBucket] = None
+        self.tokens: Optional[TokenBucket] = None
+        self.concurrency: Optional[ConcurrencyLimit] = None
+        self.configure(**limits)
+
+    def configure(self, requests_per_second: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                  concurrency_limit: Optional[int] = None, adaptive_concurrency: bool = False,
+                  target_latency: Optional[float] = None) -> None:
+        """Change the limits, keeping the state of those that are still set.
+
+        Args:
+            requests_per_second (Optional[float]): The most requests started per second, or None for no limit.
+            tokens_per_minute (Optional[float]): The most tokens, prompt and completion, per minute, or None.
+            concurrency_limit (Optional[int]): The most requests in flight, or None for no limit unless
+                adaptive, in which case it defaults to `DEFAULT_CONCURRENCY_LIMIT`.
+            adaptive_concurrency (bool): Adapt the concurrency limit to latency and overload responses.
+            target_latency (Optional[float]): Seconds above which an adaptive limit treats requests as overloaded.
+        """
+        self.requests = self.bucket(self.requests, requests_per_second)
+        token_rate = tokens_per_minute / 60 if tokens_per_minute else None
+        self.tokens = self.bucket(self.tokens, token_rate, capacity=token_rate * TOKEN_BURST_SECONDS if token_rate else None)
+        if concurrency_limit is None and not adaptive_concurrency:
+            self.concurrency = None
+            return
+        settings = {"max_limit": concurrency_limit or DEFAULT_CONCURRENCY_LIMIT, "adaptive": adaptive_concurrency,
+                    "target_latency": target_latency}
+        if self.concurrency is None:
+            self.concurrency = ConcurrencyLimit(**settings)
+        else:
+            self.concurrency.configure(**settings)
+
+    @staticmethod
+    def bucket(bucket: Optional[TokenBucket], rate: Optional[float],
+               capacity: Optional[float] = None) -> Optional[TokenBucket]:
+        if not rate:
+            return None
+        if bucket is None:
+            return TokenBucket(rate, capacity)
+        bucket.configure(rate, capacity)
+        return bucket
+
+    def delay(self, tokens: float) -> float:
+        """Reserve a request and its tokens, returning the seconds to wait before sending it."""
+        delay = self.requests.reserve() if self.requests is not None else 0.0
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens: float = 0) -> Optional[ConcurrencyLimit]:
+        """Block until a request using `tokens` may be sent.
+
+        Returns:
+            Optional[ConcurrencyLimit]: The concurrency limit a slot was taken from, to release it on.
+        """
+        concurrency = self.concurrency
+        if concurrency is not None:
+            concurrency.acquire()
+        delay = self.delay(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return concurrency
+
+    async def aacquire(self, tokens: float = 0) -> Optional[ConcurrencyLimit]:
+        """Wait until a request using `tokens` may be sent. See `acquire`."""
+        concurrency = self.concurrency
+        if concurrency is not None:
+            await concurrency.aacquire()
+        try:
+            delay = self.delay(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:
+            if concurrency is not None:
+                concurrency.release()
+            raise
+        return concurrency
+
+    def stats(self) -> Dict[str, Any]:
+        concurrency = self.concurrency
+        return {
+            "requests_per_second": self.requests.rate if self.requests is not None else None,
+            "tokens_per_minute": self.tokens.rate * 60 if self.tokens is not None else None,
+            "concurrency_limit": int(concurrency.limit) if concurrency is not None else None,
+            "inflight": concurrency.inflight if concurrency is not None else None,
+        }
+
+class LimiterRegistry:
+    """The limiters of every endpoint in the process, so that all clients of an endpoint share its limits."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limiters: Dict[str, EndpointLimiter] = {}
+
+    def get(self, endpoint: str, **limits: Any) -> Optional[EndpointLimiter]:
+        """Return the shared limiter of an endpoint, applying the given limits to it.
+
+        Args:
+            endpoint (str): The endpoint base URL.
+            **limits: The settings named in `LIMIT_KEYS`.
+
+        Returns:
+            Optional[EndpointLimiter]: The limiter, or None if no limit is set.
+        """
+        if not any(limits.get(key) for key in LIMIT_KEYS):
+            return None
+        with self.lock:
+            limiter = self.limiters.get(endpoint)
+            if limiter is None:
+                limiter = self.limiters[endpoint] = EndpointLimiter(endpoint, **limits)
+                logger.info(f"Limiting requests to {endpoint}: {limits}")
+            else:
+                limiter.configure(**limits)
+            return limiter
+
+    def clear(self) -> None:
+        with self.lock:
+            self.limiters = {}
+
+# The process-wide registry
+limiters = LimiterRegistry()
@@ -0,0 +1,163 @@
+# core/metrics.py - Martin Bukowski - 2023-08-26
+import bisect
+import contextlib
+import threading
+import time
+from typing import Any, ContextManager, Dict, List, Sequence, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = "bird"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Shared by every timer while metrics are disabled, so that timing a stage costs one attribute check
+NULL_TIMER = contextlib.nullcontext()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """A count, sum and cumulative bucket counts of observed durations."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # One count per bound, plus the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """The bucket counts as Prometheus reports them: each bucket includes every smaller one."""
+        buckets = []
+        total = 0
+        for bound, count in zip([*map(str, self.bounds), "+Inf"], self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+class Timer:
+    """Times a `with` block and records it against a stage."""
+
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+class Metrics:
+    """Per-stage latency histograms and labelled counters, exported as Prometheus text or a JSON snapshot.
+
+    Stages are the steps of producing a phrase, such as `prompt_build`, `ttfb` and `completion`. Counters
+    count events such as `completion_errors` by `status`. While disabled, `timer` returns a shared no-op
+    context and `observe` and `increment` return at once, so instrumented code pays almost nothing.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Initialize a new Metrics registry.
+
+        Args:
+            enabled (bool): Whether to record anything.
+            buckets (Sequence[float]): Upper bounds, in seconds, of the histogram buckets.
+        """
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+
+    def configure(self, metrics: bool = False, **config) -> None:
+        """Enable or disable recording from configuration settings.
+
+        Args:
+            metrics (bool): Whether to record metrics.
+            **config: Additional configuration options (not currently used).
+        """
+        self.enabled = metrics
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def timer(self, stage: str) -> ContextManager:
+        """Time a `with` block as one observation of a stage."""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record one duration for a stage."""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add to a counter, such as `increment("completion_errors", status=503)`."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return everything recorded so far as plain data.
+
+        Returns:
+            Dict[str, Any]: `stages` maps each stage to its `count`, `sum` in seconds and cumulative
+                `buckets`; `counters` lists each counter's `name`, `labels` and `value`.
+        """
+        with self.lock:
+            stages = {stage: {"count": histogram.count, "sum": histogram.sum, "buckets": dict(histogram.cumulative())}
+                      for stage, histogram in sorted(self.stages.items())}
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+        return {"enabled": self.enabled, "stages": stages, "counters": counters}
+
+    def prometheus(self) -> str:
+        """Render everything recorded so far in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot["stages"]:
+            name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# HELP {name} Time spent in each stage of producing a phrase.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in snapshot["stages"].items():
+                for bound, count in histogram["buckets"].items():
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+        seen = set()
+        for counter in snapshot["counters"]:
+            name = f"{METRIC_PREFIX}_{counter['name']}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            labels = ",".join(f'{label}="{escape(value)}"' for label, value in counter["labels"].items())
+            lines.append(f"{name}{{{labels}}} {counter['value']}" if labels else f"{name} {counter['value']}")
+        return "\n".join(lines) + "\n"
+
+def escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+# The process-wide registry, enabled by the `metrics` configuration key
+metrics = Metrics()
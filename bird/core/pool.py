@@ -0,0 +1,262 @@
+# core/pool.py - Martin Bukowski - 2023-08-26
+import json
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from .generator import PhraseWizard, DEFAULT_CHOICES
+from .prompter import Prompter
+from .rookery import Rookery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PHRASE_POOL_SIZE = 32
+DEFAULT_PHRASE_POOL_LOW_WATER = 8
+# Served phrases remembered per (bird, styles), so that refills do not bring them back
+DEFAULT_PHRASE_POOL_HISTORY = 1024
+
+PoolKey = Tuple[str, Tuple[str, ...]]
+
+class PhrasePool:
+    """Serves pre-generated phrases per (bird, styles), refilling them in the background.
+
+    Phrases are handed out at most once, so callers see no repeats until a pool runs dry. The last `history`
+    phrases served from each pool are remembered, and a refill skips them along with those still queued.
+    When a pool drops below the low-water mark, a background thread tops it back up through the
+    `PhraseWizard`.
+    """
+
+    def __init__(self, wizard: PhraseWizard, rookery: Rookery, prompter: Prompter,
+                 size: int = DEFAULT_PHRASE_POOL_SIZE, low_water: int = DEFAULT_PHRASE_POOL_LOW_WATER,
+                 path: Optional[str] = None, choices: int = DEFAULT_CHOICES,
+                 history: int = DEFAULT_PHRASE_POOL_HISTORY):
+        """Initialize a new PhrasePool.
+
+        Args:
+            wizard (PhraseWizard): The wizard used to generate phrases.
+            rookery (Rookery): The rookery used to look up birds.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            size (int): The number of phrases to keep per (bird, styles).
+            low_water (int): Refill a pool once it holds fewer phrases than this.
+            path (Optional[str]): A JSON file to load the pools from and save them to.
+            choices (int): The maximum number of phrases to request per API call when refilling.
+            history (int): The number of served phrases per (bird, styles) that refills will not add again.
+        """
+        self.wizard = wizard
+        self.rookery = rookery
+        self.prompter = prompter
+        self.size = size
+        self.low_water = low_water
+        self.path = path
+        self.choices = choices
+        self.history = history
+        self.pools: Dict[PoolKey, Deque[str]] = {}
+        # Recently served phrases of each pool, oldest first; a dict keeps insertion order and finds in O(1)
+        self.served: Dict[PoolKey, Dict[str, None]] = {}
+        self.lock = threading.Lock()
+        self.pending: Set[PoolKey] = set()
+        self.refills: 'queue.Queue[Optional[PoolKey]]' = queue.Queue()
+        self.worker: Optional[threading.Thread] = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @classmethod
+    def from_config(cls, wizard: PhraseWizard, rookery: Rookery, prompter: Prompter,
+                    phrase_pool_size: int = DEFAULT_PHRASE_POOL_SIZE,
+                    phrase_pool_low_water: int = DEFAULT_PHRASE_POOL_LOW_WATER,
+                    phrase_pool_path: Optional[str] = None,
+                    phrase_pool_history: int = DEFAULT_PHRASE_POOL_HISTORY, **config) -> 'PhrasePool':
+        """Create a new PhrasePool from configuration settings.
+
+        Args:
+            wizard (PhraseWizard): The wizard used to generate phrases.
+            rookery (Rookery): The rookery used to look up birds.
+            prompter (Prompter): The prompter used to resolve style prompts.
+            phrase_pool_size (int): The number of phrases to keep per (bird, styles).
+            phrase_pool_low_water (int): Refill a pool once it holds fewer phrases than this.
+            phrase_pool_path (Optional[str]): A JSON file to persist the pools to.
+            phrase_pool_history (int): The number of served phrases per (bird, styles) not to add again.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            PhrasePool: A new PhrasePool.
+        """
+        return cls(wizard=wizard, rookery=rookery, prompter=prompter, size=phrase_pool_size,
+                   low_water=phrase_pool_low_water, path=phrase_pool_path, history=phrase_pool_history)
+
+    @staticmethod
+    def make_key(name: str, styles: List[str]) -> PoolKey:
+        return name, tuple(styles)
+
+    def start(self) -> 'PhrasePool':
+        """Start the background refill thread."""
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="phrase-pool-refill", daemon=True)
+            self.worker.start()
+        return self
+
+    def stop(self, save: bool = True) -> None:
+        """Finish any queued refills, stop the background thread, and save the pools if a path is set."""
+        if self.worker is not None:
+            self.refills.put(None)
+            self.worker.join()
+            self.worker = None
+        if save and self.path is not None:
+            self.save(self.path)
+
+    def __enter__(self) -> 'PhrasePool':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def get(self, name: str, styles: List[str]) -> Optional[str]:
+        """Take a phrase from the pool for a bird and styles.
+
+        Args:
+            name (str): The bird name.
+            styles (List[str]): The requested styles.
+
+        Returns:
+            Optional[str]: A phrase that has not been served before, or None if the pool is empty. An empty
+                pool is refilled in the background, so a later call will usually succeed.
+        """
+        key = self.make_key(name, styles)
+        with self.lock:
+            pool = self.pools.get(key)
+            phrase = pool.popleft() if pool else None
+            remaining = len(pool) if pool else 0
+            if phrase is not None and self.history > 0:
+                served = self.served.setdefault(key, {})
+                served[phrase] = None
+                if len(served) > self.history:
+                    del served[next(iter(served))]
+        if remaining < self.low_water:
+            self.request_refill(key)
+        return phrase
+
+    def get_or_generate(self, name: str, styles: List[str]) -> Optional[str]:
+        """Take a phrase from the pool, filling it synchronously first if it is empty.
+
+        Args:
+            name (str): The bird name.
+            styles (List[str]): The requested styles.
+
+        Returns:
+            Optional[str]: A phrase, or None if none could be generated. The failure is logged.
+        """
+        phrase = self.get(name, styles)
+        if phrase is None:
+            try:
+                self.refill(self.make_key(name, styles))
+            except Exception as e:
+                logger.error(f"Failed to fill phrase pool for {name}: {e}")
+                return None
+            phrase = self.get(name, styles)
+        return phrase
+
+    def request_refill(self, key: PoolKey) -> None:
+        """Queue a background refill for a pool, unless one is already queued."""
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        self.refills.put(key)
+
+    def run(self) -> None:
+        """Background thread loop that processes queued refills."""
+        while True:
+            key = self.refills.get()
+            if key is None:
+                return
+            try:
+                self.refill(key)
+            except Exception as e:
+                logger.error(f"Failed to refill phrase pool for {key}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+
+    def refill(self, key: PoolKey) -> int:
+        """Generate phrases to top a pool back up to its full size.
+
+        Args:
+            key (PoolKey): The (bird name, styles) pool to refill.
+
+        Returns:
+            int: The number of phrases added.
+
+        Raises:
+            ValueError: If no phrase could be generated, with the first error reported by the wizard.
+        """
+        name, styles = key
+        with self.lock:
+            missing = self.size - len(self.pools.get(key, ()))
+        if missing <= 0:
+            return 0
+        jobs = [{"name": name, "styles": list(styles), "n": missing}]
+        phrases = []
+        errors = []
+        for result in self.wizard.generate_many(jobs=jobs, rookery=self.rookery, prompter=self.prompter,
+                                                workers=1, choices=self.choices):
+            if "error" in result:
+                errors.append(result["error"])
+            else:
+                phrases.append(result["phrase"])
+        if errors and not phrases:
+            raise ValueError(errors[0])
+        with self.lock:
+            pool = self.pools.setdefault(key, deque())
+            seen = set(pool).union(self.served.get(key, ()))
+            added = 0
+            for phrase in phrases:
+                if phrase and phrase not in seen and len(pool) < self.size:
+                    pool.append(phrase)
+                    seen.add(phrase)
+                    added += 1
+        return added
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of pools and pooled phrases."""
+        with self.lock:
+            return {"pools": len(self.pools), "phrases": sum(len(pool) for pool in self.pools.values())}
+
+    def save(self, path: str) -> None:
+        """Save the pools to a JSON file, replacing it atomically.
+
+        The file holds a list of `{"name", "styles", "phrases"}` objects, one per pool, so that any bird name
+        or style survives the round trip.
+
+        Args:
+            path (str): The file to write.
+        """
+        with self.lock:
+            data = [{"name": name, "styles": list(styles), "phrases": list(pool)}
+                    for (name, styles), pool in self.pools.items()]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+        """Load pools from a JSON file written by `save`.
+
+        Args:
+            path (str): The file to read.
+        """
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to load phrase pool from {path}: {e}")
+            return
+        try:
+            pools = {self.make_key(entry["name"], entry["styles"]): deque(entry["phrases"][:self.size])
+                     for entry in data}
+        except (KeyError, TypeError) as e:
+            logger.error(f"Failed to load phrase pool from {path}: invalid entry: {e!r}")
+            return
+        with self.lock:
+            self.pools.update(pools)
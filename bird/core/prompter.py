@@ -1,21 +1,71 @@
 # core/prompter.py - Martin Bukowski - 2023-08-26
 import json
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from ..model.bird import Bird
 from ..model.prompt import Prompt
+from .sampler import Sampler, validate_entries
 
 logger = logging.getLogger(__name__)
 
+# Styles appended to every request
+DEFAULT_STYLES = ['Witty']
+
+class StyleTable:
+    """An immutable snapshot of the prompts by style, with their case-insensitive index."""
+
+    __slots__ = ("prompts", "by_style")
+
+    def __init__(self, prompts: Dict[str, Prompt]):
+        """Index prompts by casefolded style.
+
+        Args:
+            prompts (Dict[str, Prompt]): Dictionary mapping style names to Prompt objects, not modified after.
+        """
+        self.prompts = prompts
+        self.by_style = {style.casefold(): prompt for style, prompt in prompts.items()}
+
+    def get(self, style: str) -> Optional[Prompt]:
+        prompt_obj = self.prompts.get(style, None)
+        if prompt_obj is None:
+            prompt_obj = self.by_style.get(style.casefold(), None)
+        return prompt_obj
+
 class Prompter:
     """Handles the management and retrieval of prompts based on different styles."""
     
-    def __init__(self, prompts: Dict[str, Prompt]):
+    def __init__(self, prompts: Dict[str, Prompt], sampler: Optional[Sampler] = None):
         """Initialize a new Prompter object.
 
         Args:
             prompts (Dict[str, Prompt]): Dictionary mapping style names to Prompt objects.
+            sampler (Optional[Sampler]): Draws the prompts, by weight and seed; defaults to an unseeded sampler.
         """
-        self.prompts = prompts
+        self.table = StyleTable(prompts)
+        self.sampler = sampler if sampler is not None else Sampler()
+
+    @property
+    def prompts(self) -> Dict[str, Prompt]:
+        return self.table.prompts
+
+    def update(self, prompts: Dict[str, Prompt]) -> List[str]:
+        """Swap in reloaded prompts without a lock on the read path.
+
+        The prompts and their index are replaced together in a single assignment, so readers see either the old
+        styles or the new ones, never a mix.
+
+        Args:
+            prompts (Dict[str, Prompt]): The reloaded prompts by style name.
+
+        Returns:
+            List[str]: The styles that were added, changed or removed.
+        """
+        old = self.table.prompts
+        changed = [style for style in old if style not in prompts]
+        changed += [style for style, prompt in prompts.items() if style not in old
+                    or any(getattr(old[style], slot) != getattr(prompt, slot) for slot in Prompt.__slots__)]
+        self.table = StyleTable(prompts)
+        return changed
 
     @classmethod
     def from_config(cls, prompt_data_path: str, **config) -> 'Prompter':
@@ -23,33 +73,45 @@ class Prompter:
 
         Args:
             prompt_data_path (str): The path to the JSON file containing prompt data.
-            **config: Additional configuration options (not currently used).
+            **config: Additional configuration options, such as `sample_seed` and `sample_cycle` for the sampler.
 
         Returns:
             Prompter: A new Prompter object.
         """
         prompts = cls.load_prompts(prompt_data_path)
-        return cls(prompts=prompts)
+        return cls(prompts=prompts, sampler=Sampler.from_config(**config))
 
     @staticmethod
     def load_prompts(prompt_data_path: str) -> Dict[str, Prompt]:
-        """Load prompts from a JSON file.
+        """Load prompts from a JSON file, or a JSONL file with one style per line.
 
         Args:
-            prompt_data_path (str): The path to the JSON file containing prompt data.
+            prompt_data_path (str): The path to the JSON or JSONL file containing prompt data.
 
         Returns:
             Dict[str, Prompt]: A dictionary mapping style names to Prompt objects.
+
+        Raises:
+            ValueError: If a style's prompt entries are malformed or badly weighted.
         """
         try:
             with open(prompt_data_path, 'r') as f:
-                prompt_data = json.load(f)
+                if prompt_data_path.endswith(".jsonl"):
+                    # One {"category", "description", "prompts"} object per line
+                    prompt_data = {}
+                    for line in f:
+                        if line.strip():
+                            data = json.loads(line)
+                            prompt_data[data.pop("category")] = data
+                else:
+                    prompt_data = json.load(f)
 
             # TODO: Optionally, validate the structure of prompt_data here
             
             prompts = {}
             for category, data in prompt_data.items():
                 prompt = Prompt(category=category, **data)
+                validate_entries(prompt.prompts, f"prompts of style {category}")
                 prompts[category] = prompt
 
             return prompts
@@ -60,17 +122,61 @@ class Prompter:
             logger.error(f"Invalid JSON format in prompt data file at {prompt_data_path}")
             raise
 
+    def get_style(self, style: str) -> Optional[Prompt]:
+        """Retrieve the Prompt for a style, falling back to a case-insensitive match.
+
+        Args:
+            style (str): The style name.
+
+        Returns:
+            Optional[Prompt]: The Prompt, or None if the style is not found.
+        """
+        return self.table.get(style)
+
+    def unknown_styles(self, bird: Bird, styles: List[str]) -> List[str]:
+        """Return the styles that are neither known styles nor custom styles of the bird."""
+        return [style for style in styles if self.get_style(style) is None and style not in bird.customStyle]
+
+    def canonical_styles(self, bird: Bird, styles: List[str]) -> List[str]:
+        """Return the styles under their own names, without repeats and in a fixed order.
+
+        Requests naming the same styles in another case or order resolve to the same list, so they can share
+        a phrase pool. Styles that are not known are taken to be custom styles of the bird, and kept as given.
+        """
+        resolved = []
+        for style in styles:
+            prompt_obj = self.get_style(style)
+            resolved.append(prompt_obj.category if prompt_obj is not None else style)
+        return sorted(dict.fromkeys(resolved), key=str.casefold)
+
     def get_prompt(self, style: str, **kwargs) -> Optional[str]:
         """Retrieve a prompt based on the given style.
 
         Args:
-            style (str): The style to retrieve a prompt for.
+            style (str): The style to retrieve a prompt for, ignoring case.
             **kwargs: Additional options (not currently used).
 
         Returns:
             Optional[str]: The prompt text, or None if the style is not found.
         """
-        prompt_obj = self.prompts.get(style, None)
+        prompt_obj = self.get_style(style)
         if prompt_obj:
-            return prompt_obj.get_prompt()
+            return self.sampler.choice(prompt_obj.prompts)
         return None
+
+    def get_prompts(self, bird: Bird, styles: List[str], sampler: Optional[Sampler] = None, **kwargs) -> List[str]:
+        """Resolve the prompts for a bird and a list of styles.
+
+        Each style resolves to a prompt for that style, falling back to the bird's custom style. One of the
+        bird's own prompts is appended at the end.
+
+        Args:
+            bird (Bird): The bird to resolve prompts for.
+            styles (List[str]): The styles to resolve.
+            sampler (Optional[Sampler]): The sampler to draw with instead of the prompter's own.
+            **kwargs: Additional options (not currently used).
+
+        Returns:
+            List[str]: The resolved prompt texts.
+        """
+        return (sampler or self.sampler).draw_prompts(bird=bird, styles=styles, prompter=self)[0]
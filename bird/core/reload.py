@@ -0,0 +1,172 @@
+# core/reload.py - Martin Bukowski - 2023-08-26
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .api import BaseOAIApi
+from .metrics import metrics
+from .prompter import Prompter
+from .rookery import Rookery
+from .roster import DEFAULT_BIRD_CACHE_SIZE
+from .util import load_config, DEFAULT_CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+# A file's modification time and size, or None while it is missing
+Stamp = Optional[Tuple[int, int]]
+
+def stamp(path: str) -> Stamp:
+    """Fingerprint a file by its modification time and size."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class Reloader:
+    """Reloads the configuration, birds and prompts when their files change, without a restart.
+
+    The files are polled for a new modification time or size. A changed file is loaded and validated in full
+    before anything is swapped, so a bad edit is logged and the last good data keeps being served. A file is
+    only marked as seen once it has been applied, so a failed reload is retried on the next check. The API
+    client keeps its connection pools, and the rookery and prompter are updated in place, so every component
+    holding them sees the new data.
+    """
+
+    def __init__(self, api: BaseOAIApi, rookery: Rookery, prompter: Prompter, config: Dict[str, Any],
+                 config_path: str = DEFAULT_CONFIG_PATH, interval: Optional[float] = None):
+        """Initialize a new Reloader.
+
+        Args:
+            api (BaseOAIApi): The API client to reconfigure.
+            rookery (Rookery): The rookery to update.
+            prompter (Prompter): The prompter to update.
+            config (Dict[str, Any]): The configuration the resources were loaded with.
+            config_path (str): The configuration file to watch.
+            interval (Optional[float]): Seconds between checks by the background thread, or None to only
+                reload when `check` is called.
+        """
+        self.api = api
+        self.rookery = rookery
+        self.prompter = prompter
+        self.config = config
+        self.config_path = config_path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stamps: Dict[str, Stamp] = {path: stamp(path) for path in self.watched_paths()}
+        self.stopped = threading.Event()
+        self.worker: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, api: BaseOAIApi, rookery: Rookery, prompter: Prompter, config_path: str = DEFAULT_CONFIG_PATH,
+                    reload_interval: Optional[float] = None, **config) -> 'Reloader':
+        """Create a new Reloader from configuration settings.
+
+        Args:
+            api (BaseOAIApi): The API client to reconfigure.
+            rookery (Rookery): The rookery to update.
+            prompter (Prompter): The prompter to update.
+            config_path (str): The configuration file to watch.
+            reload_interval (Optional[float]): Seconds between checks, or None to only reload on demand.
+            **config: The rest of the configuration the resources were loaded with.
+
+        Returns:
+            Reloader: A new Reloader.
+        """
+        return cls(api=api, rookery=rookery, prompter=prompter, config={**config, "reload_interval": reload_interval},
+                   config_path=config_path, interval=reload_interval)
+
+    def watched_paths(self) -> List[str]:
+        return [self.config_path, self.config["bird_data_path"], self.config["prompt_data_path"]]
+
+    def changed(self, path: str) -> Tuple[bool, Stamp]:
+        """Return whether the file's current stamp differs from the last one applied, and the current stamp."""
+        current = stamp(path)
+        return current != self.stamps.get(path, ()), current
+
+    def check(self) -> List[str]:
+        """Reload whatever has changed since the last check.
+
+        Returns:
+            List[str]: What was reloaded: any of "config", "birds" and "prompts".
+        """
+        with self.lock:
+            reloaded = []
+            changed, current = self.changed(self.config_path)
+            if changed and self.reload_config():
+                self.stamps[self.config_path] = current
+                reloaded.append("config")
+
+            # A path that is new to the config counts as changed, even if the file itself is older
+            config = self.config
+            for path, reload, name in ((config["bird_data_path"], self.reload_birds, "birds"),
+                                       (config["prompt_data_path"], self.reload_prompts, "prompts")):
+                changed, current = self.changed(path)
+                if changed and reload(config):
+                    self.stamps[path] = current
+                    reloaded.append(name)
+            return reloaded
+
+    def reload_config(self) -> bool:
+        try:
+            with metrics.timer("config_load"):
+                config = load_config(self.config_path)
+            metrics.configure(**config)
+            self.api.reconfigure(**config)
+        except Exception as e:
+            logger.error(f"Keeping the current configuration, failed to reload {self.config_path}: {e}")
+            return False
+        self.config = config
+        return True
+
+    def reload_birds(self, config: Dict[str, Any]) -> bool:
+        path = config["bird_data_path"]
+        try:
+            with metrics.timer("rookery_load"):
+                birds = Rookery.load_roster(path, bird_cache_size=config.get("bird_cache_size", DEFAULT_BIRD_CACHE_SIZE))
+            changed = self.rookery.update(birds)
+        except Exception as e:
+            logger.error(f"Keeping the current birds, failed to reload {path}: {e}")
+            return False
+        logger.info(f"Reloaded {len(birds)} birds from {path}, {len(changed)} changed")
+        return True
+
+    def reload_prompts(self, config: Dict[str, Any]) -> bool:
+        path = config["prompt_data_path"]
+        try:
+            with metrics.timer("prompter_load"):
+                prompts = Prompter.load_prompts(path)
+            changed = self.prompter.update(prompts)
+        except Exception as e:
+            logger.error(f"Keeping the current styles, failed to reload {path}: {e}")
+            return False
+        logger.info(f"Reloaded {len(prompts)} styles from {path}, {len(changed)} changed")
+        return True
+
+    def start(self) -> 'Reloader':
+        """Start checking for changes on a background thread, if an interval is set."""
+        if self.worker is None and self.interval:
+            self.stopped.clear()
+            self.worker = threading.Thread(target=self.run, name="reloader", daemon=True)
+            self.worker.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        if self.worker is not None:
+            self.stopped.set()
+            self.worker.join()
+            self.worker = None
+
+    def __enter__(self) -> 'Reloader':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Reload check failed: {e}")
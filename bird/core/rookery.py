@@ -1,24 +1,109 @@
 # core/rookery.py - Martin Bukowski - 2023-08-26
 import json
 import logging
-from typing import Dict, Optional
+import re
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from .roster import LazyRoster, DEFAULT_BIRD_CACHE_SIZE
+from .sampler import validate_bird
+from .template import PromptTemplate
 from ..model.bird import Bird
 
+# Splits a persona like "Shakespeare, Poet" into its keywords
+KEYWORD_PATTERN = re.compile(r"\w+")
+JSONL_SUFFIX = ".jsonl"
+
+class BirdIndexes:
+    """Case-insensitive secondary indexes over a roster of birds."""
+
+    __slots__ = ("by_id", "by_species", "by_persona", "by_custom_style")
+
+    def __init__(self, birds: Iterable[Bird]):
+        """Index birds by id, species, persona keyword and custom style.
+
+        Args:
+            birds (Iterable[Bird]): The birds to index, in roster order.
+        """
+        self.by_id: Dict[int, Bird] = {}
+        self.by_species: Dict[str, List[Bird]] = {}
+        self.by_persona: Dict[str, List[Bird]] = {}
+        self.by_custom_style: Dict[str, List[Bird]] = {}
+        for bird in birds:
+            self.by_id[bird.bird_id] = bird
+            self.by_species.setdefault(bird.species.casefold(), []).append(bird)
+            for keyword in dict.fromkeys(KEYWORD_PATTERN.findall(bird.persona.casefold())):
+                self.by_persona.setdefault(keyword, []).append(bird)
+            for style in bird.customStyle:
+                self.by_custom_style.setdefault(style.casefold(), []).append(bird)
+
+def same_bird(a: Bird, b: Bird) -> bool:
+    """Whether two birds hold the same data."""
+    return all(getattr(a, slot) == getattr(b, slot) for slot in Bird.__slots__)
+
 class Rookery:
-    def __init__(self, birds: Dict[str, Bird]):
-        """Initialize a new Rookery instance."""
+    def __init__(self, birds: Mapping[str, Bird]):
+        """Initialize a new Rookery instance.
+
+        Prompt templates are compiled and the secondary indexes built on first use, so that loading a large
+        roster only pays for what a command actually touches.
+
+        Args:
+            birds (Mapping[str, Bird]): The birds by name, either a dict or a `LazyRoster`.
+        """
         self.birds = birds
+        # Filled in by `PhraseWizard.get_template` as birds are first prompted
+        self.templates: Dict[str, PromptTemplate] = {}
+        # Each cache remembers the roster it was built from, so that `update` needs no lock on the read path
+        self._names: Optional[Tuple[Mapping[str, Bird], Dict[str, str]]] = None
+        self._indexes: Optional[Tuple[Mapping[str, Bird], BirdIndexes]] = None
+        # The lazy roster replaced by the last update, left open for readers that picked it up before the swap
+        self.retired: Optional[LazyRoster] = None
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def names(self) -> Dict[str, str]:
+        """Bird names by their casefolded form. Only the names are read, so this is cheap for a lazy roster."""
+        birds = self.birds
+        cached = self._names
+        if cached is None or cached[0] is not birds:
+            names: Dict[str, str] = {}
+            for name in birds:
+                names.setdefault(name.casefold(), name)
+            cached = self._names = (birds, names)
+        return cached[1]
+
+    @property
+    def indexes(self) -> 'BirdIndexes':
+        """The secondary indexes, built on first use. For a lazy roster this reads every bird once."""
+        birds = self.birds
+        cached = self._indexes
+        if cached is None or cached[0] is not birds:
+            cached = self._indexes = (birds, BirdIndexes(birds.values()))
+        return cached[1]
+
     @classmethod
-    def from_config(cls, bird_data_path: str, **config: Dict[str, Optional[str]]) -> 'Rookery':
-        """Create a new Rookery instance from a configuration file."""
-        birds = Rookery.load_birds(bird_data_path)
-        return cls(birds=birds)
+    def from_config(cls, bird_data_path: str, bird_cache_size: int = DEFAULT_BIRD_CACHE_SIZE,
+                    **config: Dict[str, Optional[str]]) -> 'Rookery':
+        """Create a new Rookery instance from a configuration file.
+
+        A `.jsonl` file, with one bird per line, is opened lazily: birds are parsed as they are looked up, and
+        up to `bird_cache_size` of them are kept in memory.
+        """
+        return cls(birds=cls.load_roster(bird_data_path, bird_cache_size=bird_cache_size))
+
+    @staticmethod
+    def load_roster(bird_data_path: str, bird_cache_size: int = DEFAULT_BIRD_CACHE_SIZE) -> Mapping[str, Bird]:
+        """Load birds from a JSON file, or open a JSONL file lazily."""
+        if bird_data_path.endswith(JSONL_SUFFIX):
+            return LazyRoster(bird_data_path, cache_size=bird_cache_size)
+        return Rookery.load_birds(bird_data_path)
 
     @staticmethod
     def load_birds(bird_data_path: str) -> Dict[str, Bird]:
-        """Load bird data from a JSON file."""
+        """Load bird data from a JSON file, checking each bird's prompt entries.
+
+        Raises:
+            ValueError: If the file cannot be read, or a bird's prompt entries are malformed or badly weighted.
+        """
         try:
             with open(bird_data_path, 'r') as f:
                 bird_data = json.load(f)
@@ -28,9 +113,92 @@ class Rookery:
         birds = {}
         for data in bird_data:
             bird = Bird(**data)
+            validate_bird(bird)
             birds[bird.name] = bird
         return birds
 
+    def update(self, birds: Mapping[str, Bird]) -> List[str]:
+        """Swap in a reloaded roster, keeping what is unchanged.
+
+        Birds whose data is unchanged keep their existing objects, and with them their compiled prompt
+        templates. The new roster replaces the old one in a single assignment, so readers see either the old
+        roster or the new one, never a mix, and take no lock. The name lookup and secondary indexes are rebuilt
+        on next use. A replaced lazy roster is closed at the next update, once readers have moved on from it.
+
+        Args:
+            birds (Mapping[str, Bird]): The reloaded birds by name, either a dict or a `LazyRoster`.
+
+        Returns:
+            List[str]: The names of the birds that were added, changed or removed.
+        """
+        old = self.birds
+        if isinstance(birds, LazyRoster) or isinstance(old, LazyRoster):
+            # Birds are parsed afresh from a lazy roster, so templates recompile on next use and only added or
+            # removed names can be reported without reading every bird
+            changed = sorted(set(birds).symmetric_difference(old))
+            self.templates.clear()
+            self.birds = birds
+            self.retire(old)
+            return changed
+
+        merged: Dict[str, Bird] = {}
+        changed = [name for name in old if name not in birds]
+        for name, bird in birds.items():
+            current = old.get(name)
+            if current is not None and same_bird(current, bird):
+                merged[name] = current
+            else:
+                merged[name] = bird
+                changed.append(name)
+        self.birds = merged
+        for name in changed:
+            self.templates.pop(name, None)
+        return changed
+
+    def retire(self, old: Mapping[str, Bird]) -> None:
+        """Close the roster retired by the previous update, and keep `old` open until the next one."""
+        if self.retired is not None:
+            self.retired.close()
+        self.retired = old if isinstance(old, LazyRoster) else None
+
     def get_bird(self, bird_name: str, **kwargs: Optional[Dict]) -> Optional[Bird]:
-        """Retrieve a Bird instance by name. Extra kwargs are for future extension."""
-        return self.birds.get(bird_name, None)
+        """Retrieve a Bird instance by name, falling back to a case-insensitive match. Extra kwargs are for future extension."""
+        bird = self.birds.get(bird_name, None)
+        if bird is None:
+            name = self.names.get(bird_name.casefold(), None)
+            bird = self.birds.get(name, None) if name is not None else None
+        return bird
+
+    def get_bird_by_id(self, bird_id: int) -> Optional[Bird]:
+        """Retrieve a Bird instance by its id."""
+        return self.indexes.by_id.get(bird_id, None)
+
+    def find_birds(self, species: Optional[str] = None, persona: Optional[str] = None,
+                   custom_style: Optional[str] = None) -> List[Bird]:
+        """Find the birds matching all of the given criteria, ignoring case.
+
+        Args:
+            species (Optional[str]): The exact species.
+            persona (Optional[str]): A keyword of the persona, like "poet".
+            custom_style (Optional[str]): A custom style the bird has.
+
+        Returns:
+            List[Bird]: The matching birds, in roster order.
+        """
+        indexes = self.indexes
+        matches: Optional[List[Bird]] = None
+        for index, key in ((indexes.by_species, species), (indexes.by_persona, persona),
+                           (indexes.by_custom_style, custom_style)):
+            if key is None:
+                continue
+            found = index.get(key.casefold(), [])
+            if matches is None:
+                matches = found
+            else:
+                ids = {id(bird) for bird in found}
+                matches = [bird for bird in matches if id(bird) in ids]
+        return list(matches if matches is not None else self.birds.values())
+
+    def iter_birds(self) -> Iterator[Bird]:
+        """Iterate over all birds in roster order, streaming them from disk for a lazy roster."""
+        return iter(self.birds.values())
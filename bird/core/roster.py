@@ -0,0 +1,130 @@
+# core/roster.py - Martin Bukowski - 2023-08-26
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterator
+from ..model.bird import Bird
+from .sampler import validate_bird
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BIRD_CACHE_SIZE = 1024
+INDEX_SUFFIX = ".index"
+
+class LazyRoster(Mapping):
+    """A read-only mapping of bird names to birds, backed by a JSONL file with one bird per line.
+
+    Opening the roster only reads an index of byte offsets, built with one pass over the file and kept next to
+    it so later launches skip even that. A bird is parsed when it is first looked up, and the most recently
+    used birds are kept in an LRU cache. `values()` streams the file instead of materializing every bird at once.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_BIRD_CACHE_SIZE):
+        """Initialize a new LazyRoster.
+
+        Args:
+            path (str): The JSONL file of birds.
+            cache_size (int): The number of parsed birds to keep.
+
+        Raises:
+            ValueError: If the file cannot be read or holds an invalid line.
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self.cache: 'OrderedDict[str, Bird]' = OrderedDict()
+        self.lock = threading.Lock()
+        try:
+            self.file = open(path, 'rb')
+            self.offsets = self.load_index()
+        except OSError as e:
+            raise ValueError(f"Failed to load bird data: {e}")
+
+    def stat_key(self) -> Dict[str, int]:
+        stat = os.fstat(self.file.fileno())
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def load_index(self) -> Dict[str, int]:
+        """Load the offset index saved next to the file, rebuilding it if the file has changed since."""
+        key = self.stat_key()
+        index_path = self.path + INDEX_SUFFIX
+        try:
+            with open(index_path, 'r') as f:
+                saved = json.load(f)
+            if saved["mtime_ns"] == key["mtime_ns"] and saved["size"] == key["size"]:
+                return dict(saved["offsets"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Rebuilding unreadable bird index {index_path}: {e}")
+
+        offsets = self.build_index()
+        try:
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({**key, "offsets": list(offsets.items())}, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning(f"Failed to save bird index {index_path}: {e}")
+        return offsets
+
+    def build_index(self) -> Dict[str, int]:
+        """Map each bird name to the byte offset of its line. A name defined twice resolves to the later line."""
+        offsets = {}
+        offset = 0
+        self.file.seek(0)
+        for line_number, line in enumerate(self.file, start=1):
+            if line.strip():
+                try:
+                    offsets[json.loads(line)["name"]] = offset
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Failed to load bird data: invalid bird on line {line_number}: {e!r}")
+            offset += len(line)
+        return offsets
+
+    def __getitem__(self, name: str) -> Bird:
+        with self.lock:
+            bird = self.cache.get(name)
+            if bird is not None:
+                self.cache.move_to_end(name)
+                return bird
+            offset = self.offsets[name]
+            self.file.seek(offset)
+            bird = Bird(**json.loads(self.file.readline()))
+            # Checked as each bird is parsed, since the file is never read whole
+            validate_bird(bird)
+            self.cache[name] = bird
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return bird
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def values(self) -> Iterator[Bird]:
+        """Stream every bird in file order, without filling the cache."""
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    data = json.loads(line)
+                    # Skip lines superseded by a later definition of the same name
+                    if self.offsets.get(data["name"]) == offset:
+                        yield Bird(**data)
+                offset += len(line)
+
+    def items(self) -> Iterator:
+        return ((bird.name, bird) for bird in self.values())
+
+    def close(self) -> None:
+        """Close the data file, waiting for any lookup reading it."""
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,195 @@
+# core/sampler.py - Martin Bukowski - 2023-08-26
+import itertools
+import random
+import threading
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Sequence, Tuple, Union
+from ..model.bird import Bird
+
+if TYPE_CHECKING:
+    from .prompter import Prompter
+
+# A prompt entry is either its text, or an object like {"text": "a sonnet", "weight": 2}
+Entry = Union[str, Dict[str, Any]]
+Seed = Optional[Union[int, str]]
+
+DEFAULT_WEIGHT = 1.0
+# Tables are cached per entry list; the cache is dropped when it grows past this, such as after many reloads
+MAX_TABLES = 4096
+
+class WeightedTable:
+    """The texts and cumulative weights of a list of prompt entries, computed once per list.
+
+    A draw is a binary search over the cumulative weights, and `draw` makes any number of draws in one call to
+    `random.Random.choices`.
+    """
+
+    __slots__ = ("texts", "weights", "cum_weights")
+
+    def __init__(self, entries: Sequence[Entry]):
+        """Initialize a new WeightedTable.
+
+        Args:
+            entries (Sequence[Entry]): The entries, as plain texts or {"text", "weight"} objects.
+
+        Raises:
+            ValueError: If the list is empty, or an entry is malformed or has a negative weight.
+        """
+        self.texts: List[str] = []
+        self.weights: List[float] = []
+        for entry in entries:
+            if isinstance(entry, str):
+                text, weight = entry, DEFAULT_WEIGHT
+            elif isinstance(entry, dict) and isinstance(entry.get("text"), str):
+                text, weight = entry["text"], entry.get("weight", DEFAULT_WEIGHT)
+            else:
+                raise ValueError(f"Invalid prompt entry {entry!r}: expected a string or a {{'text', 'weight'}} object")
+            if not isinstance(weight, (int, float)) or weight < 0:
+                raise ValueError(f"Invalid weight {weight!r} for prompt entry {text!r}")
+            self.texts.append(text)
+            self.weights.append(float(weight))
+        self.cum_weights = list(itertools.accumulate(self.weights))
+        if not self.cum_weights or self.cum_weights[-1] <= 0:
+            raise ValueError("Cannot sample from prompt entries without a positive total weight")
+
+    def draw(self, rng: random.Random, k: int = 1) -> List[str]:
+        """Draw `k` texts with replacement, in proportion to their weights."""
+        return rng.choices(self.texts, cum_weights=self.cum_weights, k=k)
+
+    def shuffle(self, rng: random.Random) -> List[str]:
+        """Order every text with positive weight randomly, heavier texts tending to come first.
+
+        This is a weighted draw without replacement (Efraimidis-Spirakis): each text is keyed on
+        `u ** (1 / weight)` for a uniform `u`, and the keys are sorted in descending order.
+        """
+        keys = [(rng.random() ** (1.0 / weight), text) for text, weight in zip(self.texts, self.weights) if weight > 0]
+        keys.sort(key=lambda key: key[0], reverse=True)
+        return [text for _, text in keys]
+
+def validate_entries(entries: Sequence[Entry], source: str) -> None:
+    """Check a list of prompt entries as it is loaded, so that a bad entry is not found at its first draw.
+
+    Args:
+        entries (Sequence[Entry]): The entries. An empty list is valid, and never drawn from.
+        source (str): Where the list comes from, for the error message.
+
+    Raises:
+        ValueError: If an entry is malformed or has a negative weight, or no entry has a positive weight.
+    """
+    if not entries:
+        return
+    try:
+        WeightedTable(entries)
+    except ValueError as e:
+        raise ValueError(f"Invalid {source}: {e}") from None
+
+def validate_bird(bird: Bird) -> None:
+    """Check a bird's `promptMeta` and `customStyle` entries. See `validate_entries`."""
+    validate_entries(bird.promptMeta, f"promptMeta of bird {bird.name}")
+    for style, entries in bird.customStyle.items():
+        validate_entries(entries, f"customStyle {style} of bird {bird.name}")
+
+class Sampler:
+    """Draws prompts and custom styles, optionally weighted, seeded and without repeats.
+
+    Entry lists may weight their entries, as in `["a sonnet", {"text": "a limerick", "weight": 3}]`. With a
+    seed, a sampler makes the same draws in the same order on every run. With `cycle`, every entry of a list
+    is drawn once, in a weighted random order, before any entry is drawn again.
+    """
+
+    def __init__(self, seed: Seed = None, cycle: bool = False):
+        """Initialize a new Sampler.
+
+        Args:
+            seed (Seed): The random seed, or None to seed from the system.
+            cycle (bool): Draw every entry of a list before repeating any of them.
+        """
+        self.seed = seed
+        self.cycle = cycle
+        self.random = random.Random(seed)
+        # The entry list is kept with its table, so that its id cannot be reused while cached
+        self.tables: Dict[int, Tuple[Sequence[Entry], WeightedTable]] = {}
+        self.decks: Dict[int, Tuple[Sequence[Entry], Deque[str]]] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, sample_seed: Seed = None, sample_cycle: bool = False, **config) -> 'Sampler':
+        """Create a new Sampler from configuration settings.
+
+        Args:
+            sample_seed (Seed): The random seed, or None to seed from the system.
+            sample_cycle (bool): Draw every entry of a list before repeating any of them.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            Sampler: A new Sampler.
+        """
+        return cls(seed=sample_seed, cycle=sample_cycle)
+
+    def table(self, entries: Sequence[Entry]) -> WeightedTable:
+        """Return the weighted table for an entry list, building it on first use."""
+        cached = self.tables.get(id(entries))
+        if cached is None or cached[0] is not entries:
+            if len(self.tables) >= MAX_TABLES:
+                self.tables = {}
+            cached = (entries, WeightedTable(entries))
+            self.tables[id(entries)] = cached
+        return cached[1]
+
+    def draw(self, entries: Sequence[Entry], k: int = 1) -> List[str]:
+        """Draw `k` texts from an entry list.
+
+        Args:
+            entries (Sequence[Entry]): The entries to draw from.
+            k (int): The number of texts to draw.
+
+        Returns:
+            List[str]: The drawn texts.
+        """
+        table = self.table(entries)
+        with self.lock:
+            if not self.cycle:
+                return table.draw(self.random, k)
+            cached = self.decks.get(id(entries))
+            if cached is None or cached[0] is not entries:
+                if len(self.decks) >= MAX_TABLES:
+                    self.decks = {}
+                cached = (entries, deque())
+                self.decks[id(entries)] = cached
+            deck = cached[1]
+            texts = []
+            while len(texts) < k:
+                if not deck:
+                    deck.extend(table.shuffle(self.random))
+                texts.append(deck.popleft())
+            return texts
+
+    def choice(self, entries: Sequence[Entry]) -> str:
+        """Draw one text from an entry list."""
+        return self.draw(entries, 1)[0]
+
+    def draw_prompts(self, bird: Bird, styles: List[str], prompter: 'Prompter', k: int = 1) -> List[List[str]]:
+        """Resolve the prompts for a bird and styles `k` times, drawing each list's texts in one call.
+
+        Each style resolves to one of its prompts, falling back to the bird's custom style, and one of the
+        bird's own prompts is appended at the end, as in `Prompter.get_prompts`.
+
+        Args:
+            bird (Bird): The bird to resolve prompts for.
+            styles (List[str]): The styles to resolve.
+            prompter (Prompter): The prompter holding the style prompts.
+            k (int): The number of prompt lists to draw.
+
+        Returns:
+            List[List[str]]: `k` lists of prompts, one per style plus the bird's own.
+        """
+        columns = []
+        for style in styles:
+            prompt = prompter.get_style(style)
+            entries = prompt.prompts if prompt is not None else bird.customStyle.get(style)
+            columns.append(self.draw(entries, k) if entries else [None] * k)
+        columns.append(self.draw(bird.promptMeta, k))
+        return [list(row) for row in zip(*columns)]
+
+# Draws for callers that do not bring a sampler of their own, such as `Bird.get_prompt`
+default_sampler = Sampler()
@@ -0,0 +1,255 @@
+# core/server.py - Martin Bukowski - 2023-08-26
+import json
+import logging
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from .api import OAIApi, OAIApiException
+from .generator import PhraseWizard, DEFAULT_STYLES
+from .metrics import metrics, PROMETHEUS_CONTENT_TYPE
+from .pool import PhrasePool
+from .prompter import Prompter
+from .reload import Reloader
+from .rookery import Rookery
+from .sampler import Sampler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+REQUEST_QUEUE_SIZE = 1024
+# Seconds an idle keep-alive connection is held open
+IDLE_TIMEOUT = 30.0
+# Seconds to wait for in-flight requests when shutting down
+SHUTDOWN_TIMEOUT = 30.0
+
+class BirdHTTPServer(ThreadingHTTPServer):
+    """A threaded HTTP server with a deep accept backlog that tracks requests in flight."""
+
+    request_queue_size = REQUEST_QUEUE_SIZE
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self.idle = threading.Condition()
+
+    def begin_request(self) -> None:
+        with self.idle:
+            self.active += 1
+
+    def end_request(self) -> None:
+        with self.idle:
+            self.active -= 1
+            if self.active == 0:
+                self.idle.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait until no requests are in flight, returning False if the timeout expires first."""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.active == 0, timeout=timeout)
+
+class BirdServer:
+    """Serves bird phrases over HTTP from resources loaded at startup, and reloaded when a reloader is set.
+
+    Endpoints:
+        GET /birds: The available birds.
+        GET /styles: The available styles.
+        GET /generate?name=<bird>&style=<style>[&style=...][&seed=<seed>]: A phrase for a bird, from the
+            phrase pool when one is configured, falling back to live generation when the pool is empty. A seed
+            skips the pool and makes the prompts drawn for the phrase reproducible.
+        GET /backends: Request counts, health and latency for each completion endpoint.
+        GET /metrics: Stage timings and error counts in the Prometheus text format, when `metrics` is enabled.
+        GET /metrics.json: The same as a JSON snapshot.
+    """
+
+    def __init__(self, api: OAIApi, rookery: Rookery, prompter: Prompter, pool: Optional[PhrasePool] = None,
+                 host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, wizard: Optional[PhraseWizard] = None,
+                 reloader: Optional[Reloader] = None):
+        """Initialize a new BirdServer.
+
+        Args:
+            api (OAIApi): The API client, whose connection pool stays warm for the life of the server.
+            rookery (Rookery): The available birds.
+            prompter (Prompter): The available styles.
+            pool (Optional[PhrasePool]): A phrase pool to serve phrases from.
+            host (str): The address to listen on.
+            port (int): The port to listen on; 0 picks a free port.
+            wizard (Optional[PhraseWizard]): The wizard for live generation, such as one with few-shot examples;
+                defaults to a plain wizard over `api`.
+            reloader (Optional[Reloader]): Reloads the configuration, birds and styles when their files change,
+                or on SIGHUP.
+        """
+        self.api = api
+        self.rookery = rookery
+        self.prompter = prompter
+        self.wizard = wizard if wizard is not None else PhraseWizard.factory(api=api, rookery=rookery)
+        self.pool = pool
+        self.reloader = reloader
+        self.httpd = self.create_httpd(host, port)
+        self.stopped = threading.Event()
+        # The listings are encoded once per roster and style set, and again only after a reload swaps them
+        self._birds_body: Optional[Tuple[Any, bytes]] = None
+        self._styles_body: Optional[Tuple[Any, bytes]] = None
+
+    @property
+    def birds_body(self) -> bytes:
+        birds = self.rookery.birds
+        cached = self._birds_body
+        if cached is None or cached[0] is not birds:
+            body = self.encode([{"name": bird.name, "species": bird.species, "persona": bird.persona}
+                                for bird in birds.values()])
+            cached = self._birds_body = (birds, body)
+        return cached[1]
+
+    @property
+    def styles_body(self) -> bytes:
+        prompts = self.prompter.prompts
+        cached = self._styles_body
+        if cached is None or cached[0] is not prompts:
+            body = self.encode([{"style": style, "description": prompt.description}
+                                for style, prompt in prompts.items()])
+            cached = self._styles_body = (prompts, body)
+        return cached[1]
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    @staticmethod
+    def encode(data: Any) -> bytes:
+        return json.dumps(data).encode("utf-8")
+
+    def create_httpd(self, host: str, port: int) -> BirdHTTPServer:
+        """Create the threaded HTTP server bound to the given address."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            timeout = IDLE_TIMEOUT
+            # Buffer the head and body into a single write per response, and send it without delay
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.server.begin_request()
+                try:
+                    parts = urlsplit(self.path)
+                    status, body = server.route(parts.path, parse_qs(parts.query))
+                    self.send_response(status)
+                    self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE if parts.path == "/metrics" else "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    if server.stopped.is_set():
+                        self.send_header("Connection", "close")
+                        self.close_connection = True
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    self.server.end_request()
+
+            def log_message(self, format, *args):
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        return BirdHTTPServer((host, port), Handler)
+
+    def route(self, path: str, query: Dict[str, list]) -> Tuple[int, bytes]:
+        """Dispatch a request to its endpoint.
+
+        Args:
+            path (str): The request path.
+            query (Dict[str, list]): The parsed query string.
+
+        Returns:
+            Tuple[int, bytes]: The status code and JSON body.
+        """
+        if path == "/birds":
+            return 200, self.birds_body
+        if path == "/styles":
+            return 200, self.styles_body
+        if path == "/generate":
+            return self.generate(query)
+        if path == "/backends":
+            return 200, self.encode(self.api.balancer.stats())
+        if path == "/filter":
+            phrase_filter = self.wizard.phrase_filter
+            return 200, self.encode(phrase_filter.stats() if phrase_filter is not None else {"enabled": False})
+        if path == "/metrics":
+            return 200, metrics.prometheus().encode("utf-8")
+        if path == "/metrics.json":
+            return 200, self.encode(metrics.snapshot())
+        return 404, self.encode({"error": f"Unknown path {path}"})
+
+    def generate(self, query: Dict[str, list]) -> Tuple[int, bytes]:
+        """Handle a /generate request."""
+        name = query.get("name", [None])[0]
+        styles = query.get("style", [])
+        if not name or not styles:
+            return 400, self.encode({"error": "Both 'name' and at least one 'style' are required"})
+        bird = self.rookery.get_bird(bird_name=name)
+        if bird is None:
+            return 404, self.encode({"error": f"Could not find bird with name {name}"})
+        unknown = self.prompter.unknown_styles(bird, styles)
+        if unknown:
+            return 400, self.encode({"error": f"Unknown styles for {name}: {', '.join(unknown)}"})
+        name = bird.name
+
+        seed = query.get("seed", [None])[0]
+        sampler = Sampler(seed=seed, cycle=self.prompter.sampler.cycle) if seed is not None else None
+        pooled = self.pool is not None and sampler is None
+        if pooled:
+            # Each spelling and order of the styles would otherwise fill a phrase pool of its own
+            styles = self.prompter.canonical_styles(bird, styles)
+        styles_with_defaults = styles + DEFAULT_STYLES
+        try:
+            phrase = self.pool.get(name=name, styles=styles) if pooled else None
+            if phrase is None:
+                prompts, styles_with_defaults = self.wizard.compose(bird=bird, styles=styles, prompter=self.prompter,
+                                                                    sampler=sampler)
+                phrase = self.wizard.generate_phrase(bird=bird, prompts=prompts, styles=styles_with_defaults)
+        except OAIApiException as e:
+            return 502, self.encode({"error": str(e)})
+        except Exception as e:
+            logger.error(f"Failed to generate phrase for {name}: {e}")
+            return 500, self.encode({"error": str(e)})
+        return 200, self.encode({"name": name, "styles": styles_with_defaults, "phrase": phrase})
+
+    def serve_forever(self) -> None:
+        """Serve requests until `shutdown` is called or the process receives SIGINT or SIGTERM.
+
+        With a reloader, SIGHUP reloads whatever files have changed.
+        """
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: threading.Thread(target=self.shutdown).start())
+            if self.reloader is not None and hasattr(signal, "SIGHUP"):
+                signal.signal(signal.SIGHUP, lambda *args: threading.Thread(target=self.reloader.check).start())
+        if self.pool is not None:
+            self.pool.start()
+        if self.reloader is not None:
+            self.reloader.start()
+        host, port = self.address
+        logger.info(f"Serving on http://{host}:{port}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self) -> None:
+        """Stop accepting requests; `serve_forever` returns once in-flight requests are answered."""
+        if not self.stopped.is_set():
+            self.stopped.set()
+            logger.info("Shutting down")
+            self.httpd.shutdown()
+
+    def close(self) -> None:
+        """Wait for in-flight requests, then release the socket, stop the reloader and phrase pool and close the API."""
+        if not self.httpd.wait_idle(timeout=SHUTDOWN_TIMEOUT):
+            logger.warning(f"Requests still in flight after {SHUTDOWN_TIMEOUT}s; closing anyway")
+        self.httpd.server_close()
+        if self.reloader is not None:
+            self.reloader.stop()
+        if self.pool is not None:
+            self.pool.stop()
+        self.api.close()
@@ -0,0 +1,258 @@
+# core/store.py - Martin Bukowski - 2023-08-26
+import csv
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = "data/phrases.sqlite"
+# Styles are stored joined, so a bird and its styles are one indexed key
+STYLE_SEPARATOR = "|"
+EXPORT_FORMATS = ("jsonl", "csv")
+CSV_FIELDS = ["id", "name", "styles", "phrase", "prompts", "latency", "backend", "created"]
+
+# The (bird name, joined styles) phrases are stored and queried under
+StoreKey = Tuple[str, str]
+
+class PhraseStore:
+    """A persistent store of generated phrases, in a SQLite database shared by several processes.
+
+    Each phrase is stored with its bird, styles, resolved prompts, the latency of the request that produced it
+    and the backend that served it. Phrases of the same bird and styles are numbered from 0 as they are added,
+    so a random phrase is two index lookups however many are stored. Bird names and styles match
+    case-insensitively, and styles match in the order given.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        """Initialize a new PhraseStore.
+
+        Args:
+            path (str): The database file, created if missing.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS phrases (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL COLLATE NOCASE,
+            styles TEXT NOT NULL COLLATE NOCASE,
+            seq INTEGER NOT NULL,
+            phrase TEXT NOT NULL,
+            prompts TEXT,
+            latency REAL,
+            backend TEXT,
+            created REAL NOT NULL
+        )""")
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS phrases_key ON phrases (name, styles, seq)")
+        # The number of phrases stored under each key, which is the next phrase's seq
+        self.db.execute("""CREATE TABLE IF NOT EXISTS phrase_keys (
+            name TEXT NOT NULL COLLATE NOCASE,
+            styles TEXT NOT NULL COLLATE NOCASE,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, styles)
+        )""")
+
+    @classmethod
+    def from_config(cls, phrase_store_path: Optional[str] = None, **config) -> Optional['PhraseStore']:
+        """Create a new PhraseStore from configuration settings.
+
+        Args:
+            phrase_store_path (Optional[str]): The database file, or None to store nothing.
+            **config: Additional configuration options (not currently used).
+
+        Returns:
+            Optional[PhraseStore]: A new PhraseStore, or None if no path is set.
+        """
+        if phrase_store_path is None:
+            return None
+        return cls(path=phrase_store_path)
+
+    @staticmethod
+    def make_key(name: str, styles: List[str]) -> StoreKey:
+        return name, STYLE_SEPARATOR.join(styles)
+
+    def add_many(self, results: Iterable[Dict[str, Any]]) -> int:
+        """Store batch results in one transaction, skipping those carrying an `error`.
+
+        Args:
+            results (Iterable[Dict[str, Any]]): Results with a `name`, `styles` and `phrase`, and optionally the
+                `prompts`, `latency` and `backend` added by a wizard with `provenance`.
+
+        Returns:
+            int: The number of phrases stored.
+        """
+        now = time.time()
+        rows = [(self.make_key(result["name"], result["styles"]), result) for result in results
+                if "error" not in result and result.get("phrase") is not None]
+        if not rows:
+            return 0
+        rows.sort(key=lambda row: (row[0][0].casefold(), row[0][1].casefold()))
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for _, group in groupby(rows, key=lambda row: (row[0][0].casefold(), row[0][1].casefold())):
+                    group = list(group)
+                    (name, styles), _ = group[0]
+                    row = self.db.execute("SELECT count FROM phrase_keys WHERE name = ? AND styles = ?",
+                                          (name, styles)).fetchone()
+                    count = row[0] if row is not None else 0
+                    self.db.executemany(
+                        """INSERT INTO phrases (name, styles, seq, phrase, prompts, latency, backend, created)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(name, styles, count + i, result["phrase"],
+                          json.dumps(result["prompts"]) if result.get("prompts") is not None else None,
+                          result.get("latency"), result.get("backend"), now)
+                         for i, (_, result) in enumerate(group)])
+                    self.db.execute("INSERT OR REPLACE INTO phrase_keys (name, styles, count) VALUES (?, ?, ?)",
+                                    (name, styles, count + len(group)))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def add(self, name: str, styles: List[str], phrase: str, prompts: Optional[List[str]] = None,
+            latency: Optional[float] = None, backend: Optional[str] = None) -> None:
+        """Store one phrase. See `add_many`."""
+        self.add_many([{"name": name, "styles": styles, "phrase": phrase, "prompts": prompts, "latency": latency,
+                        "backend": backend}])
+
+    @staticmethod
+    def make_row(row: tuple) -> Dict[str, Any]:
+        phrase_id, name, styles, phrase, prompts, latency, backend, created = row
+        return {"id": phrase_id, "name": name, "styles": styles.split(STYLE_SEPARATOR) if styles else [],
+                "phrase": phrase, "prompts": json.loads(prompts) if prompts is not None else None,
+                "latency": latency, "backend": backend, "created": created}
+
+    def random_phrase(self, name: str, styles: List[str]) -> Optional[Dict[str, Any]]:
+        """Pick a stored phrase for a bird and styles uniformly at random.
+
+        Args:
+            name (str): The bird name.
+            styles (List[str]): The styles, including the defaults, in the order they were generated with.
+
+        Returns:
+            Optional[Dict[str, Any]]: The phrase and its details, or None if none is stored.
+        """
+        name, styles = self.make_key(name, styles)
+        with self.lock:
+            row = self.db.execute("SELECT count FROM phrase_keys WHERE name = ? AND styles = ?", (name, styles)).fetchone()
+            if row is None or row[0] == 0:
+                return None
+            row = self.db.execute(
+                """SELECT id, name, styles, phrase, prompts, latency, backend, created FROM phrases
+                WHERE name = ? AND styles = ? AND seq = ?""", (name, styles, self.random.randrange(row[0]))).fetchone()
+        return self.make_row(row) if row is not None else None
+
+    def where(self, name: Optional[str] = None, styles: Optional[List[str]] = None) -> Tuple[str, tuple]:
+        clauses, params = [], []
+        if name is not None:
+            clauses.append("name = ?")
+            params.append(name)
+        if styles is not None:
+            clauses.append("styles = ?")
+            params.append(STYLE_SEPARATOR.join(styles))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
+
+    def query(self, name: Optional[str] = None, styles: Optional[List[str]] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return stored phrases in the order they were added.
+
+        Args:
+            name (Optional[str]): Only phrases for this bird.
+            styles (Optional[List[str]]): Only phrases with exactly these styles.
+            limit (Optional[int]): The most phrases to return, or None for all.
+
+        Returns:
+            List[Dict[str, Any]]: The phrases and their details.
+        """
+        where, params = self.where(name, styles)
+        sql = f"SELECT id, name, styles, phrase, prompts, latency, backend, created FROM phrases{where} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [self.make_row(row) for row in rows]
+
+    def iter_phrases(self, name: Optional[str] = None, styles: Optional[List[str]] = None,
+                     page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Iterate over stored phrases in the order they were added, a page at a time, in constant memory."""
+        where, params = self.where(name, styles)
+        sql = (f"SELECT id, name, styles, phrase, prompts, latency, backend, created FROM phrases"
+               f"{where}{' AND' if where else ' WHERE'} id > ? ORDER BY id LIMIT ?")
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute(sql, params + (last, page_size)).fetchall()
+            for row in rows:
+                yield self.make_row(row)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def export(self, sink: TextIO, format: str = "jsonl", name: Optional[str] = None,
+               styles: Optional[List[str]] = None) -> int:
+        """Write stored phrases to a file.
+
+        Args:
+            sink (TextIO): The file to write to.
+            format (str): `jsonl` for one JSON object per line, or `csv` with a header row, styles joined by
+                `|` and prompts as a JSON list.
+            name (Optional[str]): Only phrases for this bird.
+            styles (Optional[List[str]]): Only phrases with exactly these styles.
+
+        Returns:
+            int: The number of phrases written.
+
+        Raises:
+            ValueError: If the format is unknown.
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {format!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+        count = 0
+        writer = None
+        if format == "csv":
+            writer = csv.DictWriter(sink, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+        for phrase in self.iter_phrases(name=name, styles=styles):
+            if writer is not None:
+                writer.writerow({**phrase, "styles": STYLE_SEPARATOR.join(phrase["styles"]),
+                                 "prompts": json.dumps(phrase["prompts"]) if phrase["prompts"] is not None else ""})
+            else:
+                sink.write(json.dumps(phrase) + "\n")
+            count += 1
+        return count
+
+    def count(self, name: Optional[str] = None, styles: Optional[List[str]] = None) -> int:
+        """The number of phrases stored, optionally only for a bird and styles."""
+        if name is not None and styles is not None:
+            with self.lock:
+                row = self.db.execute("SELECT count FROM phrase_keys WHERE name = ? AND styles = ?",
+                                      self.make_key(name, styles)).fetchone()
+            return row[0] if row is not None else 0
+        where, params = self.where(name, styles)
+        with self.lock:
+            return self.db.execute(f"SELECT COUNT(*) FROM phrases{where}", params).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.db.close()
+
+    def __enter__(self) -> 'PhraseStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count()
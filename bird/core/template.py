@@ -0,0 +1,60 @@
+# core/template.py - Martin Bukowski - 2023-08-26
+from typing import List, Sequence
+from ..model.bird import Bird
+from ..model.example import Example
+
+class PromptTemplate:
+    """A bird's completion prompt, with the text that never changes for the bird compiled once.
+
+    The prompt opens with a static header (the character sheet), followed by any few-shot examples, and ends
+    with the varying prompts and styles. Keeping the header byte-identical across requests lets servers with
+    prompt caching, such as llama.cpp with `cache_prompt`, reuse its evaluation.
+    """
+
+    def __init__(self, bird: Bird, header: str, instruction: str, speaker: str):
+        """Initialize a new PromptTemplate.
+
+        Args:
+            bird (Bird): The bird the template was compiled for.
+            header (str): The static text that opens every prompt for the bird.
+            instruction (str): The static text between the examples and the prompts.
+            speaker (str): The static text between the prompts and the styles.
+        """
+        self.bird = bird
+        self.header = header
+        self.instruction = instruction
+        self.speaker = speaker
+        self.prefix = header + instruction
+
+    @classmethod
+    def compile(cls, bird: Bird) -> 'PromptTemplate':
+        """Compile the static parts of a bird's prompt.
+
+        Args:
+            bird (Bird): The bird to compile the template for.
+
+        Returns:
+            PromptTemplate: The compiled template.
+        """
+        header = f"""Character: {bird.name}
+Persona: {bird.persona}
+Description: {bird.description}
+"""
+        instruction = "Generate a phrase for this character.  It should be "
+        return cls(bird=bird, header=header, instruction=instruction, speaker=f".\n{bird.name} [")
+
+    def render(self, prompts: List[str], styles: List[str], examples: Sequence[Example] = ()) -> str:
+        """Splice the examples, prompts and styles into the compiled template.
+
+        Args:
+            prompts (List[str]): The prompts to guide the phrase generation.
+            styles (List[str]): The styles to apply to the phrase.
+            examples (Sequence[Example]): Past phrases to show before the instruction.
+
+        Returns:
+            str: The prompt text.
+        """
+        if not examples:
+            return f"{self.prefix}{', '.join(prompts)}{self.speaker}{','.join(styles)}]: \""
+        shots = "".join(example.line for example in examples)
+        return f"{self.header}{shots}{self.instruction}{', '.join(prompts)}{self.speaker}{','.join(styles)}]: \""
@@ -0,0 +1,301 @@
+# core/transport.py - Martin Bukowski - 2023-08-26
+import asyncio
+import logging
+import ssl
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CRLF = b"\r\n"
+HTTP_VERSION = "HTTP/1.1"
+READ_SIZE = 65536
+
+class TransportException(Exception):
+    """Raised when the connection to the server fails or the response is malformed."""
+    pass
+
+class AsyncHTTPResponse:
+    """A fully read HTTP response."""
+
+    def __init__(self, status: int, reason: str, headers: Dict[str, str], body: bytes):
+        """Initialize a new AsyncHTTPResponse.
+
+        Args:
+            status (int): The HTTP status code.
+            reason (str): The HTTP reason phrase.
+            headers (Dict[str, str]): The response headers, with lower-cased names.
+            body (bytes): The response body.
+        """
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+class AsyncStreamingResponse:
+    """An HTTP response whose body is read incrementally from the connection."""
+
+    def __init__(self, pool: 'AsyncConnectionPool', reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 status: int, reason: str, headers: Dict[str, str]):
+        """Initialize a new AsyncStreamingResponse.
+
+        Args:
+            pool (AsyncConnectionPool): The pool to release the connection to.
+            reader (asyncio.StreamReader): The connection reader.
+            writer (asyncio.StreamWriter): The connection writer.
+            status (int): The HTTP status code.
+            reason (str): The HTTP reason phrase.
+            headers (Dict[str, str]): The response headers, with lower-cased names.
+        """
+        self.pool = pool
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.consumed = False
+        self.closed = False
+
+    async def readline(self) -> bytes:
+        return await asyncio.wait_for(self.reader.readline(), timeout=self.pool.read_timeout)
+
+    async def readexactly(self, size: int) -> bytes:
+        return await asyncio.wait_for(self.reader.readexactly(size), timeout=self.pool.read_timeout)
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the body as it arrives, releasing the connection when done.
+
+        Raises:
+            TransportException: If the connection fails, times out or is closed mid-body.
+        """
+        try:
+            if self.headers.get("transfer-encoding", "").lower() == "chunked":
+                while True:
+                    size_line = await self.readline()
+                    if not size_line:
+                        # Closed before the terminating zero-length chunk, so the body is incomplete
+                        raise asyncio.IncompleteReadError(b"", None)
+                    size = int(size_line.split(b";", 1)[0].strip(), 16)
+                    if size == 0:
+                        # Consume any trailers up to the terminating blank line
+                        while (await self.readline()) not in (CRLF, b"\n", b""):
+                            pass
+                        break
+                    yield await self.readexactly(size)
+                    await self.readexactly(len(CRLF))
+            elif "content-length" in self.headers:
+                remaining = int(self.headers["content-length"])
+                while remaining > 0:
+                    chunk = await asyncio.wait_for(self.reader.read(min(remaining, READ_SIZE)), timeout=self.pool.read_timeout)
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                while True:
+                    chunk = await asyncio.wait_for(self.reader.read(READ_SIZE), timeout=self.pool.read_timeout)
+                    if not chunk:
+                        break
+                    yield chunk
+            self.consumed = True
+        except asyncio.TimeoutError as e:
+            raise TransportException(f"Timed out reading response from {self.pool.host}:{self.pool.port}") from e
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            raise TransportException(f"Connection to {self.pool.host}:{self.pool.port} failed: {e!r}") from e
+        finally:
+            self.close()
+
+    async def iter_lines(self) -> AsyncIterator[bytes]:
+        """Yield the body line by line as it arrives, without line terminators."""
+        buffer = b""
+        async for chunk in self.iter_chunks():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if buffer:
+            yield buffer.rstrip(b"\r")
+
+    async def read(self) -> bytes:
+        """Read the rest of the body."""
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    def close(self) -> None:
+        """Release the connection, which is only reused if the body was fully consumed."""
+        if not self.closed:
+            self.closed = True
+            reusable = self.consumed and self.headers.get("connection", "").lower() != "close"
+            self.pool.release(self.reader, self.writer, reusable)
+
+class AsyncConnectionPool:
+    """A minimal asyncio HTTP/1.1 client that keeps idle keep-alive connections to a single host."""
+
+    def __init__(self, url: str, pool_size: int = 10, keep_alive: bool = True,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None):
+        """Initialize a new AsyncConnectionPool.
+
+        Args:
+            url (str): Base URL of the server; only the scheme, host and port are used.
+            pool_size (int): Maximum number of idle connections to keep open.
+            keep_alive (bool): Whether to reuse connections between requests.
+            connect_timeout (Optional[float]): Seconds to wait for a connection to be established.
+            read_timeout (Optional[float]): Seconds to wait for the server to send a response.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme!r}")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.host_header = parts.netloc.rsplit("@", 1)[-1]
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle: Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = deque()
+        # The encoded request head for each method and path, with the headers it was encoded from
+        self.heads: Dict[Tuple[str, str], Tuple[Dict[str, str], bytes]] = {}
+
+    async def connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open a new connection to the server."""
+        try:
+            with metrics.timer("connect"):
+                return await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                    timeout=self.connect_timeout,
+                )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise TransportException(f"Failed to connect to {self.host}:{self.port}: {e!r}") from e
+
+    def release(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reusable: bool) -> None:
+        """Return a connection to the idle pool, or close it."""
+        if reusable and self.keep_alive and len(self.idle) < self.pool_size and not writer.is_closing():
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def request(self, method: str, path: str, headers: Dict[str, str], body: bytes = b"") -> AsyncHTTPResponse:
+        """Send a request and read the full response.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path, including any query string.
+            headers (Dict[str, str]): Additional request headers.
+            body (bytes): The request body.
+
+        Returns:
+            AsyncHTTPResponse: The response.
+
+        Raises:
+            TransportException: If the connection fails or the response is malformed.
+        """
+        response = await self.stream(method, path, headers, body)
+        content = await response.read()
+        return AsyncHTTPResponse(status=response.status, reason=response.reason, headers=response.headers, body=content)
+
+    async def stream(self, method: str, path: str, headers: Dict[str, str], body: bytes = b"") -> 'AsyncStreamingResponse':
+        """Send a request and return as soon as the response headers have been read.
+
+        A request sent on a pooled connection that turns out to have been closed by the server is retried
+        once on a fresh connection. The connection returns to the pool once the body has been consumed.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The request path, including any query string.
+            headers (Dict[str, str]): Additional request headers.
+            body (bytes): The request body.
+
+        Returns:
+            AsyncStreamingResponse: The response, with its body still to be read.
+
+        Raises:
+            TransportException: If the connection fails or the response is malformed.
+        """
+        request = self.encode_request(method, path, headers, body)
+        while self.idle:
+            reader, writer = self.idle.popleft()
+            if writer.is_closing() or reader.at_eof():
+                writer.close()
+                continue
+            try:
+                return await self.send(reader, writer, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Stale keep-alive connection; fall through to a fresh one
+                writer.close()
+        reader, writer = await self.connect()
+        try:
+            return await self.send(reader, writer, request)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise TransportException(f"Connection to {self.host}:{self.port} failed: {e!r}") from e
+
+    def encode_request(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> bytes:
+        """Serialize the request line, headers and body.
+
+        Everything but the Content-Length is encoded once per method and path, and reused for as long as the
+        same headers dict is passed in, so replace the dict rather than mutate it to change the headers.
+        """
+        cached = self.heads.get((method, path))
+        if cached is None or cached[0] is not headers:
+            lines = [f"{method} {path} {HTTP_VERSION}", f"Host: {self.host_header}"]
+            if not self.keep_alive:
+                lines.append("Connection: close")
+            lines.extend(f"{name}: {value}" for name, value in headers.items())
+            cached = (headers, ("\r\n".join(lines) + "\r\n").encode("latin-1"))
+            self.heads[(method, path)] = cached
+        return b"%sContent-Length: %d\r\n\r\n%s" % (cached[1], len(body), body)
+
+    async def send(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: bytes) -> 'AsyncStreamingResponse':
+        """Write a request on a connection and read back the response head."""
+        writer.write(request)
+        await writer.drain()
+        try:
+            status, reason, headers = await asyncio.wait_for(self.read_head(reader), timeout=self.read_timeout)
+        except asyncio.TimeoutError as e:
+            writer.close()
+            raise TransportException(f"Timed out reading response from {self.host}:{self.port}") from e
+        except BaseException:
+            writer.close()
+            raise
+        return AsyncStreamingResponse(self, reader, writer, status=status, reason=reason, headers=headers)
+
+    @staticmethod
+    async def read_head(reader: asyncio.StreamReader) -> Tuple[int, str, Dict[str, str]]:
+        """Read a status line and headers from the connection."""
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Server closed the connection")
+        try:
+            version, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+            status = int(status)
+        except ValueError as e:
+            raise TransportException(f"Malformed status line: {status_line!r}") from e
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (CRLF, b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if version == "HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+            headers["connection"] = "close"
+        if "content-length" not in headers and headers.get("transfer-encoding", "").lower() != "chunked":
+            # The body runs until the server closes the connection
+            headers["connection"] = "close"
+        return status, reason[0] if reason else "", headers
+
+    async def close(self) -> None:
+        """Close all idle connections."""
+        while self.idle:
+            _, writer = self.idle.popleft()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
@@ -5,6 +5,8 @@ from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONFIG_PATH = "config/config.json"
+
 def validate_config(config: Dict[str, Any]) -> None:
     """Validate the configuration dictionary.
 
@@ -20,10 +22,85 @@ def validate_config(config: Dict[str, Any]) -> None:
         if key not in config:
             raise ValueError(f"Missing '{key}' in configuration.")
 
+    endpoint = config['endpoint']
+    if isinstance(endpoint, list):
+        if not endpoint or not all(isinstance(e, str) or (isinstance(e, dict) and "url" in e) for e in endpoint):
+            raise ValueError("'endpoint' list entries must be URLs or objects with a 'url'.")
+    elif not isinstance(endpoint, str):
+        raise ValueError("'endpoint' must be a URL or a list of endpoints.")
+
     if not isinstance(config['max_tokens'], int):
         raise ValueError("'max_tokens' must be an integer.")
 
-def load_config(config_path: str = "config/config.json") -> Dict[str, Any]:
+    for key in ["pool_size", "max_retries", "cache_size", "cache_variants", "phrase_pool_size", "phrase_pool_low_water",
+                "max_failures", "phrase_pool_history", "example_count", "example_token_budget", "bird_cache_size", "filter_retries"]:
+        if key in config and not isinstance(config[key], int):
+            raise ValueError(f"'{key}' must be an integer.")
+
+    for key in ["connect_timeout", "read_timeout", "backoff_factor", "max_backoff", "eject_seconds"]:
+        if key in config and not isinstance(config[key], (int, float)):
+            raise ValueError(f"'{key}' must be a number.")
+
+    for key in ["keep_alive", "cache_prompt", "share_requests", "sample_cycle", "metrics", "adaptive_max_tokens",
+                "phrase_filter"]:
+        if key in config and not isinstance(config[key], bool):
+            raise ValueError(f"'{key}' must be true or false.")
+
+    if config.get("sample_seed") is not None and not isinstance(config["sample_seed"], (int, str)):
+        raise ValueError("'sample_seed' must be an integer, a string or null.")
+
+    stop = config.get("stop")
+    if stop is not None and (not isinstance(stop, list) or not all(isinstance(s, str) and s for s in stop)):
+        raise ValueError("'stop' must be a list of non-empty strings or null.")
+
+    percentile = config.get("max_tokens_percentile", 95)
+    if not isinstance(percentile, (int, float)) or isinstance(percentile, bool) or not 0 < percentile <= 100:
+        raise ValueError("'max_tokens_percentile' must be a number between 0 and 100.")
+
+    threshold = config.get("filter_threshold", 0.7)
+    if not isinstance(threshold, (int, float)) or isinstance(threshold, bool) or not 0 < threshold <= 1:
+        raise ValueError("'filter_threshold' must be a number between 0 and 1.")
+
+    if config.get("json_codec") not in (None, "json", "orjson", "msgspec"):
+        raise ValueError("'json_codec' must be 'json', 'orjson', 'msgspec' or null.")
+
+    if config.get("balance_strategy", "least_outstanding") not in ("least_outstanding", "weighted_round_robin"):
+        raise ValueError("'balance_strategy' must be 'least_outstanding' or 'weighted_round_robin'.")
+
+    if config.get("phrase_store_path") is not None and not isinstance(config["phrase_store_path"], str):
+        raise ValueError("'phrase_store_path' must be a file path or null.")
+
+    if config.get("cache_backend") not in (None, "memory", "sqlite"):
+        raise ValueError("'cache_backend' must be 'memory', 'sqlite' or null.")
+
+    for key in ["cache_ttl", "reload_interval"]:
+        if config.get(key) is not None and not isinstance(config[key], (int, float)):
+            raise ValueError(f"'{key}' must be a number or null.")
+
+    # Rate limits can be set for every endpoint, and overridden on endpoint objects
+    validate_limits(config)
+    if isinstance(endpoint, list):
+        for e in endpoint:
+            if isinstance(e, dict):
+                validate_limits(e)
+
+def validate_limits(limits: Dict[str, Any]) -> None:
+    """Validate the rate limit settings of the configuration or of one endpoint.
+
+    Raises:
+        ValueError: If a limit is invalid.
+    """
+    for key in ["requests_per_second", "tokens_per_minute", "target_latency"]:
+        value = limits.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            raise ValueError(f"'{key}' must be a positive number or null.")
+    value = limits.get("concurrency_limit")
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+        raise ValueError("'concurrency_limit' must be a positive integer or null.")
+    if "adaptive_concurrency" in limits and not isinstance(limits["adaptive_concurrency"], bool):
+        raise ValueError("'adaptive_concurrency' must be true or false.")
+
+def load_config(config_path: str = DEFAULT_CONFIG_PATH) -> Dict[str, Any]:
     """Load and validate configuration settings from a JSON file.
 
     Args:
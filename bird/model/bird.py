@@ -1,11 +1,16 @@
 # model/bird.py - Martin Bukowski - 2023-08-26
-import random
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from ..core.sampler import Sampler
 
 class Bird:
+    __slots__ = ("bird_id", "name", "species", "persona", "description", "promptMeta", "physicalDetails",
+                 "customStyle", "maxTokens")
+
     def __init__(self, bird_id: int, name: str, species: str, persona: str, 
                  description: str, promptMeta: List[str], physicalDetails: str, 
-                 customStyle: Dict[str, List[str]]):
+                 customStyle: Dict[str, List[str]], maxTokens: Optional[int] = None):
         self.bird_id = bird_id
         self.name = name
         self.species = species
@@ -14,15 +19,22 @@ class Bird:
         self.promptMeta = promptMeta
         self.physicalDetails = physicalDetails
         self.customStyle = customStyle
+        # Caps the token budget of this bird's phrases
+        self.maxTokens = maxTokens
 
     def __str__(self):
         return f"{self.name} ({self.species}) - {self.description}"
 
-    def get_custom_style(self, style: str) -> Optional[str]:
+    def get_custom_style(self, style: str, sampler: Optional['Sampler'] = None) -> Optional[str]:
+        """Draw a prompt of one of the bird's custom styles by weight, or None if it has no such style."""
         styles = self.customStyle.get(style, None)
         if styles is None:
             return None
-        return random.choice(styles)
+        # Imported here, as the sampler module imports this one
+        from ..core.sampler import default_sampler
+        return (sampler or default_sampler).choice(styles)
 
-    def get_prompt(self) -> List[str]:
-        return random.choice(self.promptMeta)
\ No newline at end of file
+    def get_prompt(self, sampler: Optional['Sampler'] = None) -> str:
+        """Draw one of the bird's own prompts by weight."""
+        from ..core.sampler import default_sampler
+        return (sampler or default_sampler).choice(self.promptMeta)
@@ -0,0 +1,23 @@
+# model/example.py - Martin Bukowski - 2023-08-26
+from typing import Any, Dict, List
+
+# Rough characters per token, used to budget prompt space without a tokenizer
+CHARS_PER_TOKEN = 4
+
+class Example:
+    __slots__ = ("example_id", "name", "styles", "phrase", "score", "line", "tokens")
+
+    def __init__(self, example_id: int, name: str, styles: List[str], phrase: str, score: float = 1.0):
+        self.example_id = example_id
+        self.name = name
+        self.styles = styles
+        self.phrase = phrase
+        self.score = score
+        self.line = f"{name} [{','.join(styles)}]: \"{phrase}\"\n"
+        self.tokens = len(self.line) // CHARS_PER_TOKEN + 1
+
+    def __str__(self):
+        return self.line.rstrip("\n")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "styles": self.styles, "phrase": self.phrase, "score": self.score}
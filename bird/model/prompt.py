@@ -1,15 +1,26 @@
 # model/prompt.py - Martin Bukowski - 2023-08-26
-from typing import List
-import random
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from ..core.sampler import Sampler
 
 class Prompt:
-    def __init__(self, category: str, description: str, prompts: List[str]):
+    __slots__ = ("category", "description", "prompts", "max_tokens", "stop")
+
+    def __init__(self, category: str, description: str, prompts: List[str], max_tokens: Optional[int] = None,
+                 stop: Optional[List[str]] = None):
         self.category = category
         self.description = description
         self.prompts = prompts
+        # Token budget and stop sequences for phrases in this style, if they differ from the defaults
+        self.max_tokens = max_tokens
+        self.stop = stop
 
     def __str__(self):
         return f"{self.category} - {self.description}"
 
-    def get_prompt(self):
-        return random.choice(self.prompts)
+    def get_prompt(self, sampler: Optional['Sampler'] = None) -> str:
+        """Draw one of the style's prompts by weight."""
+        # Imported here, as the sampler module imports the models
+        from ..core.sampler import default_sampler
+        return (sampler or default_sampler).choice(self.prompts)
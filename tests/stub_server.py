@@ -0,0 +1,90 @@
+# tests/stub_server.py
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubCompletionServer:
+    """A local OpenAI-compatible completion server for tests.
+
+    Every request to /v1/completions answers with the next status code from `statuses` (200 once the list is
+    exhausted) and echoes each prompt back `n` times as the completion choices, listed in reverse index order.
+    Streaming requests get the text back one word per server-sent event. With `truncate`, the connection is
+    closed partway through every successful body. Requests and connections are counted.
+    """
+
+    def __init__(self, statuses=None, text=None, truncate=False):
+        self.statuses = list(statuses or [])
+        self.text = text
+        self.truncate = truncate
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                payload = json.loads(body)
+                with stub.lock:
+                    stub.requests.append(payload)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                if status == 200 and payload.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    words = (stub.text or payload["prompt"]).split(" ")
+                    events = [json.dumps({"choices": [{"text": (" " if i else "") + word}]}) for i, word in enumerate(words)]
+                    for event in events + ([] if stub.truncate else ["[DONE]"]):
+                        data = f"data: {event}\n\n".encode()
+                        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    if stub.truncate:
+                        self.close_connection = True
+                        return
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+                if status == 200:
+                    prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+                    n = payload.get("n", 1)
+                    choices = [{"index": i * n + j, "text": stub.text or prompt}
+                               for i, prompt in enumerate(prompts) for j in range(n)]
+                    data = json.dumps({"choices": choices[::-1]}).encode()
+                else:
+                    data = b"error"
+                if status == 200 and stub.truncate:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    half = data[:len(data) // 2]
+                    self.wfile.write(f"{len(half):x}\r\n".encode() + half + b"\r\n")
+                    self.close_connection = True
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,38 +1,42 @@
 # tests/test_api.py
 import unittest
 from unittest.mock import patch
+import asyncio
 import json
 import sys
 
 # Monkeypatch our local copy of the bird module
 sys.path.append('.')
 
-from bird.core.api import OAIApi, OAIApiException
+from bird.core.api import OAIApi, AsyncOAIApi, OAIApiException, STREAM_DONE
+from bird.core.cache import MemoryCache
+from bird.core.codec import CODECS, get_codec
+from stub_server import StubCompletionServer
 
 class TestOAIApi(unittest.TestCase):
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_make_request_successful(self, mock_post):
         # Mock a successful API response
         mock_response = mock_post.return_value
         mock_response.status_code = 200
-        mock_response.text = json.dumps({
+        mock_response.content = json.dumps({
             'choices': [
                 {'text': 'Test response'}
             ]
-        })
+        }).encode()
 
         api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
         result = api.make_request('Test prompt')
 
         self.assertEqual(result, 'Test response')
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_make_request_unsuccessful(self, mock_post):
         # Mock an unsuccessful API response
         mock_response = mock_post.return_value
         mock_response.status_code = 400
-        mock_response.text = 'Bad Request'
+        mock_response.content = b'Bad Request'
 
         api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
 
@@ -47,5 +51,362 @@ class TestOAIApi(unittest.TestCase):
         self.assertEqual(api.endpoint, 'http://test.endpoint')
         self.assertEqual(api.max_tokens, 100)
 
+    def test_from_config_transport(self):
+        api = OAIApi.from_config(endpoint='http://test.endpoint/', api_key='test_api_key', max_tokens=100,
+                                 pool_size=32, connect_timeout=1.5, read_timeout=20, max_retries=5, backoff_factor=0.1)
+
+        adapter = api.session.get_adapter('http://test.endpoint/')
+        self.assertEqual(adapter._pool_maxsize, 32)
+        # Retries are made per attempt through the balancer, not inside the session
+        self.assertEqual(adapter.max_retries.total, 0)
+        self.assertEqual((api.max_retries, api.backoff_factor), (5, 0.1))
+        self.assertEqual(api.timeout, (1.5, 20))
+        self.assertEqual(api.uri, 'http://test.endpoint/v1/completions')
+
+    @patch('requests.Session.post')
+    def test_make_request_reuses_session(self, mock_post):
+        mock_response = mock_post.return_value
+        mock_response.status_code = 200
+        mock_response.content = json.dumps({'choices': [{'text': 'Test response'}]}).encode()
+
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, read_timeout=30)
+        session = api.session
+        api.make_request('Test prompt')
+        api.make_request('Test prompt')
+
+        self.assertIs(api.session, session)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_post.call_args.kwargs['timeout'], (api.timeout[0], 30))
+
+    @patch('requests.Session.post')
+    def test_make_completions(self, mock_post):
+        mock_response = mock_post.return_value
+        mock_response.status_code = 200
+        mock_response.content = json.dumps({
+            'choices': [
+                {'index': 1, 'text': 'Second'},
+                {'index': 0, 'text': 'First'}
+            ]
+        }).encode()
+
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
+        result = api.make_completions(['Prompt one'], n=2)
+
+        self.assertEqual(result, ['First', 'Second'])
+        payload = json.loads(mock_post.call_args.kwargs['data'])
+        self.assertEqual(payload['n'], 2)
+        self.assertEqual(payload['prompt'], ['Prompt one'])
+
+    def test_stream_request(self):
+        with StubCompletionServer(text='Hello there friend') as stub:
+            with OAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                stream = api.stream_request('Test prompt')
+                chunks = list(stream)
+
+        self.assertEqual(chunks, ['Hello', ' there', ' friend'])
+        self.assertTrue(stub.requests[0]['stream'])
+        self.assertEqual(stream.tokens, 3)
+        self.assertEqual(stream.text, 'Hello there friend')
+        self.assertIsNotNone(stream.time_to_first_token)
+        self.assertLessEqual(stream.time_to_first_token, stream.elapsed)
+        self.assertGreater(stream.tokens_per_second, 0)
+
+    def test_stream_request_unsuccessful(self):
+        with StubCompletionServer(statuses=[400]) as stub:
+            with OAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                with self.assertRaises(OAIApiException):
+                    api.stream_request('Test prompt')
+
+    def test_stream_request_truncated(self):
+        with StubCompletionServer(text='Hello there', truncate=True) as stub:
+            with OAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                stream = api.stream_request('Test prompt')
+                with self.assertRaises(OAIApiException):
+                    list(stream)
+                stats = api.balancer.stats()[0]
+
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['outstanding'], 0)
+
+    def test_parse_event(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
+        self.assertEqual(api.parse_event(b'data: {"choices": [{"text": "Hi"}]}'), 'Hi')
+        self.assertIs(api.parse_event(b'data: [DONE]'), STREAM_DONE)
+        self.assertIsNone(api.parse_event(b': keep-alive'))
+        self.assertIsNone(api.parse_event(b''))
+
+    @patch('requests.Session.post')
+    def test_make_request_cached(self, mock_post):
+        mock_response = mock_post.return_value
+        mock_response.status_code = 200
+        mock_response.content = json.dumps({'choices': [{'text': 'Test response'}]}).encode()
+
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, cache=MemoryCache())
+        self.assertEqual(api.make_request('Test prompt'), 'Test response')
+        self.assertEqual(api.make_request('Test prompt'), 'Test response')
+        api.make_request('Other prompt')
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(api.cache.stats()['hits'], 1)
+
+        # Bypassing the cache neither reads nor replaces the entry
+        mock_response.content = json.dumps({'choices': [{'text': 'Fresh response'}]}).encode()
+        self.assertEqual(api.make_request('Test prompt', cache=False), 'Fresh response')
+        self.assertEqual(api.make_request('Test prompt'), 'Test response')
+        self.assertEqual(mock_post.call_count, 3)
+
+    def test_from_config_cache(self):
+        api = OAIApi.from_config(endpoint='http://test.endpoint', api_key='test_api_key', max_tokens=100,
+                                 cache_backend='memory', cache_variants=4)
+        self.assertIsInstance(api.cache, MemoryCache)
+        self.assertEqual(api.cache.variants, 4)
+        self.assertIsNone(OAIApi.from_config(endpoint='http://test.endpoint', api_key='test_api_key', max_tokens=100).cache)
+
+    def test_cache_prompt(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, cache_prompt=True)
+        self.assertTrue(json.loads(api.build_payload('Test prompt'))['cache_prompt'])
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
+        self.assertNotIn('cache_prompt', json.loads(api.build_payload('Test prompt')))
+
+    def test_stop(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100)
+        self.assertEqual(json.loads(api.build_payload('Test prompt'))['stop'], ["\n", '"'])
+        self.assertEqual(json.loads(api.build_payload('Test prompt', stop=['!']))['stop'], ['!'])
+        api = OAIApi.from_config(endpoint='http://test.endpoint', api_key='test_api_key', max_tokens=100, stop=['.'])
+        self.assertEqual(json.loads(api.build_payload('Test prompt'))['stop'], ['.'])
+
+    def test_json_codecs(self):
+        payloads = set()
+        for codec in CODECS:
+            try:
+                get_codec(codec)
+            except ValueError:
+                # Not installed
+                continue
+            api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, json_codec=codec,
+                         cache_prompt=True)
+            payload = api.build_payload('Caf\u00e9 "prompt"', n=2)
+            self.assertEqual(json.loads(payload), {'prompt': 'Caf\u00e9 "prompt"', 'stop': ["\n", '"'],
+                                                   'max_tokens': 100, 'n': 2, 'cache_prompt': True})
+            payloads.add(payload)
+            body = json.dumps({'choices': [{'text': 'b', 'index': 1, 'finish_reason': 'length'},
+                                           {'text': 'a', 'index': 0, 'finish_reason': 'stop'}]}).encode()
+            choices = api.parse_choices(200, body)
+            self.assertEqual(choices, ['a', 'b'])
+            self.assertEqual([choice.finish_reason for choice in choices], ['stop', 'length'])
+            with self.assertRaisesRegex(OAIApiException, 'Bad Request'):
+                api.parse_choices(400, b'Bad Request')
+            with self.assertRaises(OAIApiException):
+                api.parse_choices(200, body[:len(body) // 2])
+        # Byte-identical whichever codec built them, so cache keys survive a codec change
+        self.assertEqual(len(payloads), 1)
+
+    def test_retry_delay(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, backoff_factor=0.5,
+                     max_backoff=10)
+        self.assertEqual(api.retry_delay(2), 2.0)
+        self.assertEqual(api.retry_delay(10), 10)
+        self.assertEqual(api.retry_delay(0, '3'), 3.0)
+        # Out of range or unusable Retry-After values never reach time.sleep as they are
+        self.assertEqual(api.retry_delay(0, '-5'), 0.0)
+        self.assertEqual(api.retry_delay(0, '86400'), 10)
+        self.assertEqual(api.retry_delay(0, 'inf'), 0.5)
+        self.assertEqual(api.retry_delay(0, 'nan'), 0.5)
+        self.assertEqual(api.retry_delay(0, 'Wed, 21 Oct 2015 07:28:00 GMT'), 0.5)
+
+    def test_keep_alive_disabled(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://test.endpoint', max_tokens=100, keep_alive=False)
+        self.assertEqual(api.session.headers['Connection'], 'close')
+
+    def test_multiple_endpoints(self):
+        with StubCompletionServer(statuses=[500] * 10) as bad, StubCompletionServer() as good:
+            api = OAIApi(api_key='test_api_key', endpoint=[bad.endpoint, good.endpoint], max_tokens=100,
+                         max_retries=0, max_failures=1)
+            results = []
+            for i in range(4):
+                try:
+                    results.append(api.make_request(f'prompt {i}'))
+                except OAIApiException:
+                    results.append(None)
+            api.close()
+
+        # The failing endpoint is ejected after its first failure
+        self.assertEqual(len(bad.requests), 1)
+        self.assertEqual(results.count(None), 1)
+        stats = {backend['endpoint']: backend for backend in api.balancer.stats()}
+        self.assertTrue(stats[bad.endpoint]['ejected'])
+        self.assertEqual(stats[good.endpoint]['requests'], 3)
+
+    def test_retry_ejects_failing_endpoint(self):
+        with StubCompletionServer(statuses=[503] * 10) as bad, StubCompletionServer() as good:
+            api = OAIApi(api_key='test_api_key', endpoint=[bad.endpoint, good.endpoint], max_tokens=100,
+                         max_retries=1, backoff_factor=0, max_failures=2, balance_strategy='weighted_round_robin')
+            results = [api.make_request(f'prompt {i}') for i in range(4)]
+            api.close()
+
+        # Each 503 counts against the failing endpoint, which is ejected after two, and retries move on
+        self.assertEqual(results, [f'prompt {i}' for i in range(4)])
+        self.assertEqual(len(bad.requests), 2)
+        stats = {backend['endpoint']: backend for backend in api.balancer.stats()}
+        self.assertEqual(stats[bad.endpoint]['errors'], 2)
+        self.assertTrue(stats[bad.endpoint]['ejected'])
+        self.assertEqual(stats[good.endpoint]['requests'], 4)
+        self.assertEqual(stats[good.endpoint]['errors'], 0)
+
+    def test_rate_limits(self):
+        with StubCompletionServer(statuses=[429], text='Test response') as stub:
+            api = OAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100, backoff_factor=0,
+                         concurrency_limit=8, adaptive_concurrency=True, tokens_per_minute=600000)
+            result = api.make_request('Test prompt')
+            limits = api.balancer.stats()[0]['limits']
+            api.close()
+
+        self.assertEqual(result, 'Test response')
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(limits['inflight'], 0)
+        # The 429 halved the adaptive limit from 4, and the retry's success added a half
+        self.assertEqual(limits['concurrency_limit'], 2)
+
+    def test_reconfigure(self):
+        api = OAIApi(api_key='test_api_key', endpoint='http://a.endpoint', max_tokens=100)
+        session = api.session
+        balancer = api.balancer
+
+        api.reconfigure(endpoint='http://a.endpoint', api_key='test_api_key', max_tokens=50, cache_prompt=True)
+        self.assertIs(api.balancer, balancer)
+        self.assertEqual(json.loads(api.build_payload('Test prompt'))['max_tokens'], 50)
+        self.assertTrue(json.loads(api.build_payload('Test prompt'))['cache_prompt'])
+
+        api.reconfigure(endpoint=['http://a.endpoint', 'http://b.endpoint'], api_key='new_key', max_tokens=50)
+        self.assertIs(api.session, session)
+        self.assertEqual([backend['endpoint'] for backend in api.balancer.stats()],
+                         ['http://a.endpoint', 'http://b.endpoint'])
+        self.assertEqual(api.uris['http://b.endpoint'], 'http://b.endpoint/v1/completions')
+        self.assertEqual(api.headers['Authorization'], 'Bearer new_key')
+
+class TestAsyncOAIApi(unittest.IsolatedAsyncioTestCase):
+
+    async def test_make_request_successful(self):
+        with StubCompletionServer(text='Test response') as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                result = await api.make_request('Test prompt')
+
+        self.assertEqual(result, 'Test response')
+        self.assertEqual(stub.requests[0]['prompt'], 'Test prompt')
+        self.assertEqual(stub.requests[0]['max_tokens'], 100)
+
+    async def test_make_request_retries(self):
+        with StubCompletionServer(statuses=[503, 429], text='Test response') as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100,
+                                   backoff_factor=0) as api:
+                result = await api.make_request('Test prompt')
+
+        self.assertEqual(result, 'Test response')
+        self.assertEqual(len(stub.requests), 3)
+
+    async def test_make_request_unsuccessful(self):
+        with StubCompletionServer(statuses=[400]) as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                with self.assertRaises(OAIApiException):
+                    await api.make_request('Test prompt')
+
+    async def test_truncated_response(self):
+        with StubCompletionServer(truncate=True) as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100,
+                                   max_retries=0) as api:
+                with self.assertRaises(OAIApiException):
+                    await api.make_request('Test prompt')
+                stats = api.balancer.stats()[0]
+
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['outstanding'], 0)
+
+    async def test_concurrency_bound(self):
+        with StubCompletionServer() as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100,
+                                   max_concurrency=4) as api:
+                results = await asyncio.gather(*[api.make_request(f'prompt {i}') for i in range(20)])
+
+        self.assertEqual(results, [f'prompt {i}' for i in range(20)])
+        self.assertLessEqual(stub.connections, 4)
+
+    async def test_share_requests(self):
+        with StubCompletionServer() as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100,
+                                   share_requests=True) as api:
+                shared = await asyncio.gather(*[api.make_request('trending') for _ in range(10)])
+                self.assertEqual(len(stub.requests), 1)
+                distinct = await asyncio.gather(*[api.make_request('trending', share=False) for _ in range(3)])
+
+        self.assertEqual(shared, ['trending'] * 10)
+        self.assertEqual(distinct, ['trending'] * 3)
+        self.assertEqual(len(stub.requests), 4)
+
+    async def test_rate_limits(self):
+        with StubCompletionServer(statuses=[429]) as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100, backoff_factor=0,
+                                   concurrency_limit=8, adaptive_concurrency=True, tokens_per_minute=600000) as api:
+                result = await api.make_request('Test prompt')
+                limits = api.balancer.stats()[0]['limits']
+
+        self.assertEqual(result, 'Test prompt')
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(limits['inflight'], 0)
+        # The 429 halved the adaptive limit from 4, and the retry's success added a half
+        self.assertEqual(limits['concurrency_limit'], 2)
+
+    async def test_make_completions(self):
+        with StubCompletionServer() as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                result = await api.make_completions(['a', 'b'], n=2)
+
+        self.assertEqual(result, ['a', 'a', 'b', 'b'])
+        self.assertEqual(len(stub.requests), 1)
+
+    async def test_stream_request(self):
+        with StubCompletionServer(text='Hello there friend') as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100,
+                                   max_concurrency=1) as api:
+                stream = await api.stream_request('Test prompt')
+                chunks = [text async for text in stream]
+                # The connection and the concurrency slot are released once the stream is consumed
+                result = await api.make_request('Second prompt')
+
+        self.assertEqual(chunks, ['Hello', ' there', ' friend'])
+        self.assertEqual(stream.tokens, 3)
+        self.assertIsNotNone(stream.time_to_first_token)
+        self.assertEqual(result, 'Hello there friend')
+        self.assertEqual(stub.connections, 1)
+
+    async def test_stream_request_truncated(self):
+        with StubCompletionServer(text='Hello there', truncate=True) as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                stream = await api.stream_request('Test prompt')
+                chunks = []
+                with self.assertRaises(OAIApiException):
+                    async for text in stream:
+                        chunks.append(text)
+                stats = api.balancer.stats()[0]
+
+        self.assertEqual(chunks, ['Hello', ' there'])
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['outstanding'], 0)
+
+    async def test_retry_moves_to_another_endpoint(self):
+        with StubCompletionServer(statuses=[503] * 10) as bad, StubCompletionServer() as good:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=[bad.endpoint, good.endpoint], max_tokens=100,
+                                   max_retries=1, backoff_factor=0, balance_strategy='weighted_round_robin') as api:
+                results = await asyncio.gather(*[api.make_request(f'prompt {i}') for i in range(4)])
+
+        self.assertEqual(results, [f'prompt {i}' for i in range(4)])
+        self.assertEqual(len(good.requests), 4)
+        self.assertEqual(sum(backend['outstanding'] for backend in api.balancer.stats()), 0)
+
+    def test_from_config(self):
+        api = AsyncOAIApi.from_config(endpoint='http://test.endpoint', api_key='test_api_key', max_tokens=100,
+                                      max_concurrency=200)
+        self.assertEqual(api.max_concurrency, 200)
+        self.assertEqual(api.path, '/v1/completions')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,65 @@
+# tests/test_balancer.py
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.balancer import LoadBalancer
+
+class TestLoadBalancer(unittest.TestCase):
+
+    def test_least_outstanding(self):
+        balancer = LoadBalancer(['http://a', 'http://b'])
+        first = balancer.acquire()
+        second = balancer.acquire()
+        self.assertNotEqual(first.endpoint, second.endpoint)
+        first.release(ok=True)
+        self.assertEqual(balancer.acquire().endpoint, first.endpoint)
+
+    def test_weighted_round_robin(self):
+        balancer = LoadBalancer(['http://a', {'url': 'http://b', 'weight': 3}], strategy='weighted_round_robin')
+        picks = []
+        for _ in range(8):
+            lease = balancer.acquire()
+            picks.append(lease.endpoint)
+            lease.release(ok=True)
+        self.assertEqual(picks.count('http://a'), 2)
+        self.assertEqual(picks.count('http://b'), 6)
+        # Smooth round-robin never sends the light backend two requests in a row
+        self.assertNotIn(('http://a', 'http://a'), list(zip(picks, picks[1:])))
+
+    @patch('bird.core.balancer.time.monotonic')
+    def test_eject_and_probe(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        balancer = LoadBalancer(['http://a', 'http://b'], strategy='weighted_round_robin',
+                                max_failures=2, eject_seconds=10)
+        bad = balancer.backends[0]
+        for _ in range(2):
+            balancer.release(bad, latency=0.1, ok=False)
+        self.assertTrue(balancer.stats()[0]['ejected'])
+        self.assertEqual({balancer.acquire().endpoint for _ in range(4)}, {'http://b'})
+
+        # Once the ejection expires the backend is probed, and a single failure ejects it again
+        mock_monotonic.return_value = 111.0
+        balancer.release(bad, latency=0.1, ok=False)
+        self.assertTrue(balancer.stats()[0]['ejected'])
+        mock_monotonic.return_value = 122.0
+        balancer.release(bad, latency=0.1, ok=True)
+        self.assertFalse(balancer.stats()[0]['ejected'])
+        self.assertEqual(balancer.stats()[0]['errors'], 3)
+
+    def test_all_ejected(self):
+        balancer = LoadBalancer(['http://a'], max_failures=1)
+        balancer.acquire().release(ok=False)
+        self.assertEqual(balancer.acquire().endpoint, 'http://a')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            LoadBalancer([])
+        with self.assertRaises(ValueError):
+            LoadBalancer(['http://a'], strategy='random')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# tests/test_benchmarks.py
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from benchmarks.fake_server import FakeCompletionServer
+from benchmarks.run import Benchmark, compare, main, percentile
+from benchmarks.startup import HEAVY_MODULES, check, parse_importtime
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([3.0, 1.0, 2.0], 50), 2.0)
+        self.assertAlmostEqual(percentile([1.0, 2.0], 95), 1.95)
+
+    def test_fake_server_errors(self):
+        with FakeCompletionServer(latency=0, error_rate=1.0) as server:
+            run = Benchmark(endpoint=server.endpoint, max_retries=0).run('api', concurrency=2, requests=4)
+        self.assertEqual(run['errors'], 4)
+        self.assertIsNone(run['latency']['p50'])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            status = main(['-s', 'api', '-s', 'stream', '-c', '1', '2', '-n', '6', '--latency', '0', '-o', output])
+            with open(output, 'r') as f:
+                report = json.load(f)
+
+        self.assertEqual(status, 0)
+        self.assertEqual([(run['scenario'], run['concurrency']) for run in report['results']],
+                         [('api', 1), ('api', 2), ('stream', 1), ('stream', 2)])
+        run = report['results'][-1]
+        self.assertEqual(run['requests'], 6)
+        self.assertEqual(run['errors'], 0)
+        self.assertGreater(run['rps'], 0)
+        self.assertIn('p99', run['latency'])
+        self.assertIsNotNone(run['time_to_first_token']['p50'])
+
+    def test_compare(self):
+        baseline = [{'scenario': 'api', 'concurrency': 8, 'rps': 100.0, 'latency': {'p95': 0.010}}]
+        self.assertEqual(compare(baseline, baseline, tolerance=0.1), [])
+        slower = [{'scenario': 'api', 'concurrency': 8, 'rps': 50.0, 'latency': {'p95': 0.020}}]
+        self.assertEqual(len(compare(slower, baseline, tolerance=0.1)), 2)
+
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   _io\n"
+                  "import time:       800 |       2400 | bird.core.util\n")
+        self.assertEqual(parse_importtime(stderr), {'_io': 120, 'bird.core.util': 2400})
+
+    def test_startup_check(self):
+        fast = {'command': 'list_birds', 'overhead': 0.015, 'heavy_imports': []}
+        self.assertEqual(check([fast], budget_ms=50), [])
+        slow = {'command': 'list_birds', 'overhead': 0.120, 'heavy_imports': ['requests']}
+        self.assertEqual(len(check([slow], budget_ms=50)), 2)
+
+    def test_cli_import_is_light(self):
+        code = "import sys, bird.__main__; print(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+        completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# tests/test_budget.py
+import math
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import Completion
+from bird.core.budget import TokenBudget, MIN_SAMPLES, MIN_TOKENS, HEADROOM
+from bird.core.prompter import Prompter
+from bird.model.bird import Bird
+from bird.model.prompt import Prompt
+
+def make_bird(maxTokens=None):
+    return Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                description='Some description', promptMeta=['sonnets'], physicalDetails='Details',
+                customStyle={}, maxTokens=maxTokens)
+
+class TestTokenBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.prompter = Prompter(prompts={
+            'Insult': Prompt('Insult', 'desc', ["an insult"], max_tokens=30, stop=['!']),
+            'Poem': Prompt('Poem', 'desc', ["a poem"], max_tokens=80, stop=['\n\n', '!']),
+            'Greeting': Prompt('Greeting', 'desc', ["a greeting"])
+        })
+
+    def test_static_limits(self):
+        budget = TokenBudget(prompter=self.prompter)
+        self.assertEqual(budget.limits(make_bird(), ['Greeting'], default=100), (100, None))
+        self.assertEqual(budget.limits(make_bird(), ['Insult', 'Witty'], default=100), (30, ['!']))
+        # The largest style budget wins, and the stops are merged
+        self.assertEqual(budget.limits(make_bird(), ['insult', 'Poem'], default=100), (80, ['!', '\n\n']))
+        # A bird caps its budget
+        self.assertEqual(budget.limits(make_bird(maxTokens=20), ['Poem'], default=100)[0], 20)
+
+    def test_adaptive_limits(self):
+        budget = TokenBudget(prompter=self.prompter, adaptive=True)
+        bird = make_bird()
+        for _ in range(MIN_SAMPLES - 1):
+            budget.observe(bird, ['Poem'], ['x' * 40], max_tokens=80, default=100)
+        self.assertEqual(budget.limits(bird, ['Poem'], default=100)[0], 80)
+
+        budget.observe(bird, ['Poem'], ['x' * 40], max_tokens=80, default=100)
+        learned = math.ceil(10 * HEADROOM)
+        self.assertEqual(budget.limits(bird, ['Poem'], default=100)[0], learned)
+        # Styles without enough observations keep the static budget
+        self.assertEqual(budget.limits(bird, ['Poem', 'Greeting'], default=100)[0], 80)
+
+        # Completions cut off at the budget count as needing the static one
+        for _ in range(MIN_SAMPLES):
+            budget.observe(bird, ['Poem'], ['x' * 4 * learned], max_tokens=learned, default=100)
+        self.assertEqual(budget.limits(bird, ['Poem'], default=100)[0], 80)
+
+    def test_adaptive_limits_finish_reason(self):
+        budget = TokenBudget(prompter=self.prompter, adaptive=True)
+        bird = make_bird()
+        # Short by the estimate, but reported as cut off, so the budget does not shrink
+        for _ in range(MIN_SAMPLES):
+            budget.observe(bird, ['Poem'], [Completion('x' * 40, 'length')], max_tokens=80, default=100)
+        self.assertEqual(budget.limits(bird, ['Poem'], default=100)[0], 80)
+
+        # Long by the estimate, but reported as finished, so it counts at its length
+        budget = TokenBudget(prompter=self.prompter, adaptive=True)
+        for _ in range(MIN_SAMPLES):
+            budget.observe(bird, ['Poem'], [Completion('x' * 40, 'stop')], max_tokens=10, default=100)
+        self.assertEqual(budget.limits(bird, ['Poem'], default=100)[0], math.ceil(10 * HEADROOM))
+
+    def test_adaptive_limits_per_style(self):
+        budget = TokenBudget(prompter=self.prompter, adaptive=True)
+        bird = make_bird()
+        for _ in range(MIN_SAMPLES):
+            budget.observe(bird, ['Greeting', 'Witty'], ['x' * 16], max_tokens=100, default=100)
+            budget.observe(bird, ['Poem', 'Witty'], ['x' * 240], max_tokens=80, default=100)
+
+        # The default style is on every phrase, so it is not learned and does not widen the budget
+        self.assertEqual(budget.limits(bird, ['Greeting', 'Witty'], default=100)[0], max(MIN_TOKENS, math.ceil(4 * HEADROOM)))
+        self.assertEqual(budget.limits(bird, ['Poem', 'Witty'], default=100)[0], math.ceil(60 * HEADROOM))
+        self.assertNotIn('witty', budget.stats())
+
+    def test_not_adaptive(self):
+        budget = TokenBudget.from_config(prompter=self.prompter, max_tokens=100)
+        for _ in range(MIN_SAMPLES):
+            budget.observe(make_bird(), ['Poem'], ['x'], max_tokens=80, default=100)
+        self.assertEqual(budget.stats(), {})
+        self.assertEqual(budget.limits(make_bird(), ['Poem'], default=100)[0], 80)
+
+if __name__ == '__main__':
+    unittest.main()
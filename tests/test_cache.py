@@ -0,0 +1,99 @@
+# tests/test_cache.py
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.cache import CompletionCache, MemoryCache, SQLiteCache
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_lookup_and_store(self):
+        cache = MemoryCache(max_size=10)
+        self.assertIsNone(cache.lookup('payload'))
+        cache.store('payload', ['Hello'])
+        self.assertEqual(cache.lookup('payload'), ['Hello'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_lru_eviction(self):
+        cache = MemoryCache(max_size=2)
+        cache.store('a', ['A'])
+        cache.store('b', ['B'])
+        cache.lookup('a')
+        cache.store('c', ['C'])
+        self.assertEqual(cache.lookup('a'), ['A'])
+        self.assertIsNone(cache.lookup('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = MemoryCache(ttl=10)
+        with patch('bird.core.cache.time.monotonic', return_value=100.0):
+            cache.store('payload', ['Hello'])
+        with patch('bird.core.cache.time.monotonic', return_value=105.0):
+            self.assertEqual(cache.lookup('payload'), ['Hello'])
+        with patch('bird.core.cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.lookup('payload'))
+
+    def test_variants(self):
+        cache = MemoryCache(variants=3)
+        for text in ['one', 'two']:
+            cache.store('payload', [text])
+            self.assertIsNone(cache.lookup('payload'))
+        cache.store('payload', ['three'])
+        cache.store('payload', ['four'])
+        served = {cache.lookup('payload')[0] for _ in range(50)}
+        self.assertEqual(served, {'one', 'two', 'three'})
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shared_between_instances(self):
+        writer = SQLiteCache(path=self.path)
+        reader = SQLiteCache(path=self.path)
+        writer.store('payload', ['Hello'])
+        self.assertEqual(reader.lookup('payload'), ['Hello'])
+        writer.close()
+        reader.close()
+
+    def test_eviction_and_variants(self):
+        cache = SQLiteCache(path=self.path, max_size=2, variants=2)
+        cache.store('a', ['A1'])
+        self.assertIsNone(cache.lookup('a'))
+        cache.store('a', ['A2'])
+        self.assertIn(cache.lookup('a'), [['A1'], ['A2']])
+        cache.store('b', ['B'])
+        cache.store('c', ['C'])
+        self.assertEqual(len(cache), 2)
+        cache.close()
+
+    def test_ttl(self):
+        cache = SQLiteCache(path=self.path, ttl=10, variants=1)
+        with patch('bird.core.cache.time.time', return_value=100.0):
+            cache.store('payload', ['Hello'])
+        with patch('bird.core.cache.time.time', return_value=111.0):
+            self.assertIsNone(cache.lookup('payload'))
+        cache.close()
+
+class TestCompletionCache(unittest.TestCase):
+
+    def test_from_config(self):
+        self.assertIsNone(CompletionCache.from_config())
+        cache = CompletionCache.from_config(cache_backend='memory', cache_size=5, cache_ttl=None, cache_variants=2)
+        self.assertIsInstance(cache, MemoryCache)
+        self.assertEqual(cache.max_size, 5)
+        self.assertEqual(cache.variants, 2)
+        with self.assertRaises(ValueError):
+            CompletionCache.from_config(cache_backend='redis')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# tests/test_codec.py
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.codec import Codec, get_codec
+
+class TestCodec(unittest.TestCase):
+
+    def test_stdlib_codec(self):
+        codec = get_codec('json')
+        self.assertEqual(codec.dumps({'prompt': 'Café', 'n': 2}), '{"prompt":"Café","n":2}'.encode('utf-8'))
+        self.assertEqual(codec.loads(b'{"choices": [{"text": "Hi"}]}'), {'choices': [{'text': 'Hi'}]})
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec(), Codec)
+        with self.assertRaises(ValueError):
+            get_codec('yaml')
+        # A codec whose library is missing is an error when named, and skipped when picking one
+        with patch.dict(sys.modules, {'orjson': None, 'msgspec': None}):
+            with self.assertRaises(ValueError):
+                get_codec('orjson')
+            self.assertEqual(get_codec().name, 'json')
+
+if __name__ == '__main__':
+    unittest.main()
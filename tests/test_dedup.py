@@ -0,0 +1,76 @@
+# tests/test_dedup.py
+import os
+import random
+import string
+import subprocess
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import Completion
+from bird.core.dedup import PhraseFilter, normalize, signature, similarity, EMPTY, TRUNCATED, NEAR_DUPLICATE
+
+class TestSignature(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize('  Thou art, a KNAVE!  '), 'thou art a knave')
+        self.assertEqual(normalize('"..."'), '')
+
+    def test_similarity(self):
+        insult = signature(normalize('Thou art a knave of the lowest degree, a fool in motley!'))
+        self.assertEqual(similarity(insult, insult), 1.0)
+        close = signature(normalize('Thou art a knave of the lowest degree, a fool in motley, sir!'))
+        self.assertGreaterEqual(similarity(insult, close), 0.7)
+        other = signature(normalize('Good morrow to thee, fair maiden of the dawn'))
+        self.assertLess(similarity(insult, other), 0.3)
+        # Phrases shorter than a shingle still get a signature
+        self.assertEqual(similarity(signature('hi'), signature('hi')), 1.0)
+
+    def test_signature_is_stable(self):
+        # The same in another process with a different string hash seed, so signatures can be shared
+        code = "from bird.core.dedup import signature; print(signature('thou art a knave').hex())"
+        other = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                               env={**os.environ, 'PYTHONHASHSEED': '1', 'PYTHONPATH': '.'}).stdout.strip()
+        self.assertEqual(other, signature('thou art a knave').hex())
+
+class TestPhraseFilter(unittest.TestCase):
+
+    def test_check(self):
+        phrase_filter = PhraseFilter()
+        key = phrase_filter.make_key('Reginald', ['Insult', 'Witty'])
+        self.assertIsNone(phrase_filter.check(key, 'Thou art a knave of the lowest degree, a fool in motley!'))
+        self.assertEqual(phrase_filter.check(key, 'thou art a KNAVE of the lowest degree; a fool in motley'),
+                         NEAR_DUPLICATE)
+        self.assertEqual(phrase_filter.check(key, ' ... '), EMPTY)
+        self.assertEqual(phrase_filter.check(key, Completion('Thou art a', 'length')), TRUNCATED)
+        # Only the server's finish_reason marks a phrase as cut off, however long it is
+        self.assertIsNone(phrase_filter.check(key, Completion('Fie upon thee ' * 8, 'stop')))
+        self.assertIsNone(phrase_filter.check(key, 'Good morrow to thee, fair maiden of the dawn'))
+        # Each bird and styles has its own index
+        other = phrase_filter.make_key('Reginald', ['Insult'])
+        self.assertIsNone(phrase_filter.check(other, 'Thou art a knave of the lowest degree, a fool in motley!'))
+
+        stats = phrase_filter.stats()
+        self.assertEqual((stats['checked'], stats['accepted'], stats['stored'], stats['keys']), (7, 4, 4, 2))
+        self.assertEqual(stats['rejected'], {EMPTY: 1, TRUNCATED: 1, NEAR_DUPLICATE: 1})
+        self.assertEqual(stats['acceptance_rate'], 4 / 7)
+
+    def test_many_phrases(self):
+        phrase_filter = PhraseFilter()
+        key = phrase_filter.make_key('Reginald', ['Insult'])
+        rng = random.Random(7)
+        words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(6)) for _ in range(500)]
+        phrases = [' '.join(rng.choice(words) for _ in range(10)) for _ in range(2000)]
+        self.assertEqual(len(phrase_filter.accept(key, phrases)), 2000)
+        # Rewording the end of a phrase still makes a near-duplicate
+        self.assertEqual(phrase_filter.accept(key, [phrase.rsplit(' ', 1)[0] + '!' for phrase in phrases[:20]]), [])
+
+    def test_from_config(self):
+        self.assertIsNone(PhraseFilter.from_config())
+        phrase_filter = PhraseFilter.from_config(phrase_filter=True, filter_threshold=0.9, filter_retries=1)
+        self.assertEqual((phrase_filter.threshold, phrase_filter.retries), (0.9, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# tests/test_engine.py
+import os
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.engine import ProcessEngine, worker_config
+from stub_server import StubCompletionServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestProcessEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubCompletionServer().__enter__()
+        self.config = {'endpoint': self.stub.endpoint, 'api_key': 'test_api_key', 'max_tokens': 100,
+                       'bird_data_path': os.path.join(ROOT, 'data', 'birds.json'),
+                       'prompt_data_path': os.path.join(ROOT, 'data', 'prompts.json')}
+
+    def tearDown(self):
+        self.stub.__exit__(None, None, None)
+
+    def run_engine(self, jobs, **options):
+        with ProcessEngine(self.config, **options) as engine:
+            return list(engine.run(jobs, ordered=True))
+
+    def test_chunks(self):
+        engine = ProcessEngine(self.config, chunk_size=2)
+        self.assertEqual([(start, len(chunk)) for start, chunk in engine.chunks(iter(range(5)))],
+                         [(0, 2), (2, 2), (4, 1)])
+
+    def test_worker_config(self):
+        config = {'endpoint': ['http://a.endpoint', {'url': 'http://b.endpoint', 'requests_per_second': 9,
+                                                     'concurrency_limit': 2}],
+                  'requests_per_second': 12, 'tokens_per_minute': 6000, 'concurrency_limit': 8,
+                  'adaptive_concurrency': True}
+        shared = worker_config(config, 4)
+        self.assertEqual(shared['requests_per_second'], 3)
+        self.assertEqual(shared['tokens_per_minute'], 1500)
+        self.assertEqual(shared['concurrency_limit'], 2)
+        self.assertTrue(shared['adaptive_concurrency'])
+        self.assertEqual(shared['endpoint'], ['http://a.endpoint', {'url': 'http://b.endpoint',
+                                                                    'requests_per_second': 2.25,
+                                                                    'concurrency_limit': 1}])
+        # The run's own configuration is left alone
+        self.assertEqual(config['requests_per_second'], 12)
+        self.assertIs(worker_config(config, 1), config)
+
+    def test_run(self):
+        jobs = [{'name': 'Reginald', 'styles': ['Insult'], 'n': 2}, {'name': 'Nobody', 'styles': ['Insult']},
+                {'name': 'Joey', 'styles': 'Greeting'}]
+        results = self.run_engine(jobs, processes=2, workers=2, chunk_size=1)
+
+        self.assertEqual([result['job'] for result in results], [0, 0, 1, 2])
+        self.assertEqual(results[0]['styles'], ['Insult', 'Witty'])
+        self.assertIn('phrase', results[0])
+        self.assertIn('error', results[2])
+        self.assertEqual(results[3]['name'], 'Joey')
+
+    def test_seeded_runs_do_not_depend_on_processes(self):
+        self.config['sample_seed'] = 7
+        jobs = [{'name': 'Reginald', 'styles': ['Insult']} for _ in range(6)]
+        one = self.run_engine(jobs, processes=1, chunk_size=2)
+        two = self.run_engine(jobs, processes=2, chunk_size=2)
+        self.assertEqual(one, two)
+        self.assertGreater(len({result['phrase'] for result in one}), 1)
+
+    def test_filter_stats(self):
+        self.config['phrase_filter'] = True
+        jobs = [{'name': 'Reginald', 'styles': ['Insult'], 'n': 2} for _ in range(4)]
+        with ProcessEngine(self.config, processes=2, chunk_size=1) as engine:
+            self.assertIsNone(engine.filter_stats())
+            results = list(engine.run(jobs, ordered=True))
+            stats = engine.filter_stats()
+
+        # Every phrase was checked by some process's filter, and the counts are summed over processes
+        phrases = [result for result in results if 'phrase' in result]
+        self.assertGreaterEqual(stats['checked'], 8)
+        self.assertEqual(stats['accepted'], len(phrases))
+        self.assertEqual(stats['checked'], stats['accepted'] + sum(stats['rejected'].values()))
+
+if __name__ == '__main__':
+    unittest.main()
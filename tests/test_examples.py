@@ -0,0 +1,73 @@
+# tests/test_examples.py
+import os
+import tempfile
+import time
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.examples import ExampleStore
+
+class TestExampleStore(unittest.TestCase):
+
+    def test_select_best_in_insertion_order(self):
+        store = ExampleStore(count=2)
+        store.add('Reginald', ['Insult', 'Witty'], 'weak', score=0.1)
+        store.add('Reginald', ['Insult', 'Witty'], 'good', score=0.8)
+        store.add('Reginald', ['Insult', 'Witty'], 'best', score=0.9)
+
+        # The two best examples, listed in the order they were added
+        self.assertEqual([e.phrase for e in store.select('Reginald', ['Insult', 'Witty'])], ['good', 'best'])
+
+    def test_select_prefers_first_style(self):
+        store = ExampleStore(count=2)
+        store.add('Reginald', ['Compliment', 'Witty'], 'nice', score=5.0)
+        store.add('Reginald', ['Insult', 'Witty'], 'rude', score=1.0)
+        store.add('Joey', ['Insult', 'Witty'], 'other bird', score=9.0)
+
+        self.assertEqual([e.phrase for e in store.select('Reginald', ['Insult', 'Witty'])], ['nice', 'rude'])
+        self.assertEqual([e.phrase for e in store.select('Reginald', ['Insult'])], ['rude'])
+        self.assertEqual(store.select('Nobody', ['Insult']), [])
+
+    def test_token_budget(self):
+        store = ExampleStore(count=3, token_budget=12)
+        store.add('Reginald', ['Insult'], 'x' * 100, score=9.0)
+        store.add('Reginald', ['Insult'], 'short', score=1.0)
+
+        selected = store.select('Reginald', ['Insult'])
+        self.assertEqual([e.phrase for e in selected], ['short'])
+        self.assertLessEqual(sum(e.tokens for e in selected), 12)
+
+    def test_duplicates(self):
+        store = ExampleStore()
+        self.assertIsNotNone(store.add('Reginald', ['Insult'], 'same'))
+        self.assertIsNone(store.add('Reginald', ['Insult', 'Witty'], 'same'))
+        self.assertEqual(len(store), 1)
+
+    def test_save_and_load(self):
+        store = ExampleStore()
+        store.add('Reginald', ['Insult', 'Witty'], 'hello', score=2.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'examples.jsonl')
+            store.save(path)
+            with open(path, 'a') as f:
+                f.write('{"job": 1, "error": "failed"}\n')
+            loaded = ExampleStore.from_config(example_data_path=path)
+
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual(loaded.select('Reginald', ['Witty'])[0].score, 2.0)
+        self.assertIsNone(ExampleStore.from_config())
+
+    def test_select_speed(self):
+        store = ExampleStore(count=4)
+        for i in range(20000):
+            store.add(f'Bird {i % 10}', [f'Style {i % 7}', 'Witty'], f'phrase {i}', score=i % 97)
+        start = time.perf_counter()
+        for i in range(1000):
+            store.select(f'Bird {i % 10}', [f'Style {i % 7}', 'Witty'])
+        self.assertLess((time.perf_counter() - start) / 1000, 0.001)
+
+if __name__ == '__main__':
+    unittest.main()
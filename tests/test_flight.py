@@ -0,0 +1,98 @@
+# tests/test_flight.py
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.flight import AsyncSingleFlight, SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+
+    def wait_for_waiters(self, flight, key, count):
+        for _ in range(500):
+            call = flight.calls.get(key)
+            if call is not None and call.waiters >= count:
+                return
+            time.sleep(0.01)
+        self.fail('Callers never joined the call')
+
+    def test_concurrent_calls_share(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            return ['phrase']
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(flight.do, 'payload', fn) for _ in range(5)]
+            self.wait_for_waiters(flight, 'payload', 4)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+        self.assertTrue(all(value == ['phrase'] for value, _ in results))
+        self.assertEqual(len(flight), 0)
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait()
+            raise ValueError('boom')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(flight.do, 'payload', fn) for _ in range(2)]
+            self.wait_for_waiters(flight, 'payload', 1)
+            release.set()
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result()
+        # The failed call is forgotten, so the next caller tries again
+        self.assertEqual(flight.do('payload', lambda: 'ok'), ('ok', False))
+
+    def test_sequential_calls_do_not_share(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('payload', lambda: 1), (1, False))
+        self.assertEqual(flight.do('payload', lambda: 2), (2, False))
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_share(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ['phrase']
+
+        results = await asyncio.gather(*[flight.do('payload', fn) for _ in range(5)], flight.do('other', fn))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([shared for _, shared in results], [False, True, True, True, True, False])
+        self.assertEqual(len(flight), 0)
+
+    async def test_cancelled_caller_does_not_cancel_call(self):
+        flight = AsyncSingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.05)
+            return 'phrase'
+
+        leader = asyncio.ensure_future(flight.do('payload', fn))
+        follower = asyncio.ensure_future(flight.do('payload', fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        self.assertEqual(await follower, ('phrase', True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,30 @@
 # tests/test_generator.py
+import asyncio
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
 import sys
 
 # Monkeypatch our local copy of the bird module
 sys.path.append('.')
 
+from bird.core.budget import TokenBudget
+from bird.core.dedup import PhraseFilter
+from bird.core.examples import ExampleStore
 from bird.core.generator import PhraseWizard
-from bird.core.api import OAIApi
+from bird.core.api import OAIApi, AsyncOAIApi
+from bird.core.prompter import Prompter
+from bird.core.rookery import Rookery
+from bird.core.sampler import Sampler
 from bird.model.bird import Bird
+from bird.model.prompt import Prompt
+
+def make_resources():
+    bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                description='Some description', promptMeta=['sonnets'], physicalDetails='Details',
+                customStyle={'Burn': ['old English burns']})
+    rookery = Rookery(birds={'Reginald': bird})
+    prompter = Prompter(prompts={'Insult': Prompt('Insult', 'desc', ["an insult"])})
+    return rookery, prompter
 
 class TestPhraseWizard(unittest.TestCase):
     
@@ -40,6 +56,222 @@ class TestPhraseWizard(unittest.TestCase):
         self.assertEqual(result, "Generated text")
         mock_make_request.assert_called_once()
 
+    async def _agenerate(self, wizard, bird):
+        return await wizard.agenerate_phrase(bird=bird, prompts=["be witty"], styles=["Funny"])
+
+    def test_agenerate_phrase(self):
+        api_mock = Mock(spec=AsyncOAIApi)
+        api_mock.make_request = AsyncMock(return_value="Generated text")
+        wizard = PhraseWizard(api=api_mock)
+
+        bird_mock = Mock(spec=Bird)
+        bird_mock.name = "TestBird"
+        bird_mock.persona = "TestPersona"
+        bird_mock.description = "TestDescription"
+
+        result = asyncio.run(self._agenerate(wizard, bird_mock))
+
+        self.assertEqual(result, "Generated text")
+        prompt = api_mock.make_request.call_args.kwargs['prompt']
+        self.assertIn("Character: TestBird", prompt)
+        self.assertTrue(prompt.endswith('TestBird [Funny]: "'))
+
+    def test_templates(self):
+        api_mock = Mock(spec=OAIApi)
+        rookery, _ = make_resources()
+        wizard = PhraseWizard.factory(api=api_mock, rookery=rookery)
+        bird = rookery.get_bird('Reginald')
+
+        self.assertIs(wizard.get_template(bird), rookery.templates['Reginald'])
+        # A reloaded bird gets a freshly compiled template
+        reloaded = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Marlowe',
+                        description='Another description', promptMeta=['sonnets'], physicalDetails='Details',
+                        customStyle={})
+        prompt = wizard.build_prompt(bird=reloaded, prompts=["be witty"], styles=["Funny"])
+        self.assertIn("Persona: Marlowe", prompt)
+        self.assertIs(wizard.get_template(reloaded).bird, reloaded)
+
+    def test_build_prompt_with_examples(self):
+        examples = ExampleStore()
+        examples.add('Reginald', ['Funny', 'Witty'], 'A jest!')
+        wizard = PhraseWizard.factory(api=Mock(spec=OAIApi), examples=examples)
+        rookery, _ = make_resources()
+
+        prompt = wizard.build_prompt(bird=rookery.get_bird('Reginald'), prompts=["be witty"], styles=["Funny"])
+
+        self.assertIn('Reginald [Funny,Witty]: "A jest!"\nGenerate a phrase', prompt)
+
+    def test_generate_phrases(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_completions.return_value = ["one", "two", "three"]
+        wizard = PhraseWizard(api=api_mock)
+        rookery, _ = make_resources()
+
+        result = wizard.generate_phrases(bird=rookery.get_bird('Reginald'), prompts=["be witty"], styles=["Funny"], n=3)
+
+        self.assertEqual(result, ["one", "two", "three"])
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['n'], 3)
+
+    def test_token_budget(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.max_tokens = 100
+        api_mock.make_completions.return_value = ["one", "two"]
+        rookery, _ = make_resources()
+        prompter = Prompter(prompts={'Insult': Prompt('Insult', 'desc', ["an insult"], max_tokens=30, stop=['!'])})
+        wizard = PhraseWizard(api=api_mock, budget=TokenBudget(prompter=prompter))
+        bird = rookery.get_bird('Reginald')
+
+        wizard.generate_phrases(bird=bird, prompts=["be rude"], styles=["Insult", "Witty"], n=2)
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['max_tokens'], 30)
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['stop'], ['!'])
+
+        # Explicit limits win, and styles without settings leave the client's defaults
+        wizard.generate_phrases(bird=bird, prompts=["be rude"], styles=["Insult"], n=2, max_tokens=5, stop=['?'])
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['max_tokens'], 5)
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['stop'], ['?'])
+        wizard.generate_phrases(bird=bird, prompts=["be witty"], styles=["Witty"], n=2)
+        self.assertEqual(api_mock.make_completions.call_args.kwargs['max_tokens'], 100)
+        self.assertIsNone(api_mock.make_completions.call_args.kwargs['stop'])
+
+    def test_generate_filtered(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.max_tokens = 100
+        api_mock.make_completions.side_effect = [
+            ["Thou art a knave!", "Thou art a knave.", ""],
+            ["Fie upon thee, thou rogue", "thou art a KNAVE"]
+        ]
+        api_mock.make_request.return_value = "Thou art a knave"
+        wizard = PhraseWizard(api=api_mock, phrase_filter=PhraseFilter(retries=2))
+        rookery, _ = make_resources()
+        bird = rookery.get_bird('Reginald')
+
+        result = wizard.generate_filtered(bird=bird, prompts=["be rude"], styles=["Insult"], n=3)
+
+        # Only the rejected phrases are requested again, until the retries run out
+        self.assertEqual(result, ["Thou art a knave!", "Fie upon thee, thou rogue"])
+        self.assertEqual([call.kwargs['n'] for call in api_mock.make_completions.call_args_list], [3, 2])
+        self.assertEqual(api_mock.make_request.call_count, 1)
+        self.assertEqual(wizard.phrase_filter.stats()['accepted'], 2)
+        # Resampling must not be served the rejected completions again
+        calls = api_mock.make_completions.call_args_list + api_mock.make_request.call_args_list
+        self.assertTrue(all(call.kwargs['cache'] is False and call.kwargs['share'] is False for call in calls))
+
+    def test_execute_job_provenance(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_completions.return_value = ["Thou knave", "Thou rogue"]
+        api_mock.last_endpoint.return_value = "http://backend-a/"
+        wizard = PhraseWizard(api=api_mock, provenance=True)
+        rookery, _ = make_resources()
+        result = {"name": "Reginald", "styles": ["Insult", "Witty"]}
+
+        results = wizard.execute_job(result=result, bird=rookery.get_bird('Reginald'), prompts=["be rude"], n=2)
+
+        self.assertEqual([r["phrase"] for r in results], ["Thou knave", "Thou rogue"])
+        for r in results:
+            self.assertEqual(r["prompts"], ["be rude"])
+            self.assertEqual(r["backend"], "http://backend-a/")
+            self.assertGreaterEqual(r["latency"], 0)
+
+    def test_generate_batch(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_completions.return_value = ["a1", "a2", "b1", "b2"]
+        wizard = PhraseWizard(api=api_mock)
+        rookery, _ = make_resources()
+        bird = rookery.get_bird('Reginald')
+
+        result = wizard.generate_batch([(bird, ["be witty"], ["Funny"]), (bird, ["be rude"], ["Insult"])], n=2)
+
+        self.assertEqual(result, [["a1", "a2"], ["b1", "b2"]])
+        prompts = api_mock.make_completions.call_args.kwargs['prompt']
+        self.assertEqual(len(prompts), 2)
+        self.assertIn("be rude", prompts[1])
+
+    def test_stream_phrase(self):
+        api_mock = Mock(spec=OAIApi)
+        api_mock.stream_request.return_value = iter(["Hello", " there"])
+        wizard = PhraseWizard(api=api_mock)
+        rookery, _ = make_resources()
+
+        result = wizard.stream_phrase(bird=rookery.get_bird('Reginald'), prompts=["be witty"], styles=["Funny"])
+
+        self.assertEqual("".join(result), "Hello there")
+        self.assertIn("be witty", api_mock.stream_request.call_args.kwargs['prompt'])
+
+    def test_compose(self):
+        rookery, prompter = make_resources()
+        wizard = PhraseWizard(api=Mock(spec=OAIApi))
+        prompts, styles = wizard.compose(bird=rookery.get_bird('Reginald'), styles=['Insult', 'Burn'], prompter=prompter)
+        self.assertEqual(prompts, ['an insult', 'old English burns', 'sonnets'])
+        self.assertEqual(styles, ['Insult', 'Burn', 'Witty'])
+
+    def test_generate_many_ordered(self):
+        rookery, prompter = make_resources()
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_request.return_value = "Generated text"
+        api_mock.make_completions.side_effect = lambda prompt, n, **kwargs: [f"phrase {i}" for i in range(n)]
+        wizard = PhraseWizard(api=api_mock)
+
+        jobs = [{'name': 'Reginald', 'styles': ['Insult'], 'n': 5}, {'name': 'Nobody', 'styles': 'Insult'},
+                {'name': 'Reginald', 'styles': 'Burn'}]
+        results = list(wizard.generate_many(jobs=iter(jobs), rookery=rookery, prompter=prompter, workers=2,
+                                            ordered=True, choices=3))
+
+        self.assertEqual([result['job'] for result in results], [0, 0, 0, 0, 0, 1, 2])
+        self.assertEqual([call.kwargs['n'] for call in api_mock.make_completions.call_args_list], [3, 2])
+        self.assertEqual(api_mock.make_request.call_count, 1)
+        self.assertEqual([result['phrase'] for result in results[:5]], ['phrase 0', 'phrase 1', 'phrase 2', 'phrase 0', 'phrase 1'])
+        self.assertIn('error', results[5])
+        self.assertEqual(results[6]['styles'], ['Burn', 'Witty'])
+
+    def test_generate_many_invalid_jobs(self):
+        rookery, prompter = make_resources()
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_request.return_value = "Generated text"
+        wizard = PhraseWizard(api=api_mock)
+
+        jobs = [{'name': 'Reginald', 'styles': ['Insult'], 'n': 'x'}, {'name': 'Reginald', 'styles': ['Nonsense']},
+                {'name': 'Reginald', 'styles': ['Insult'], 'n': '2'}]
+        results = list(wizard.generate_many(jobs=iter(jobs), rookery=rookery, prompter=prompter, ordered=True,
+                                            choices=1))
+
+        # Bad jobs are reported in the results, and the batch carries on
+        self.assertEqual([result['job'] for result in results], [0, 1, 2, 2])
+        self.assertEqual(results[0]['error'], "'n' must be an integer, not 'x'")
+        self.assertEqual(results[1]['error'], "Unknown styles for Reginald: Nonsense")
+        self.assertEqual(results[2]['phrase'], "Generated text")
+
+    def test_generate_many_completion_order(self):
+        rookery, prompter = make_resources()
+        api_mock = Mock(spec=OAIApi)
+        api_mock.make_request.return_value = "Generated text"
+        wizard = PhraseWizard(api=api_mock)
+
+        jobs = ({'name': 'Reginald', 'styles': ['Insult']} for _ in range(50))
+        results = list(wizard.generate_many(jobs=jobs, rookery=rookery, prompter=prompter, workers=4))
+
+        self.assertEqual(len(results), 50)
+        self.assertEqual(sorted(result['job'] for result in results), list(range(50)))
+
+    def test_generate_many_seeded(self):
+        bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare', description='',
+                    promptMeta=[f'meta {i}' for i in range(10)], physicalDetails='', customStyle={})
+        rookery = Rookery(birds={'Reginald': bird})
+        prompts = {'Insult': Prompt('Insult', 'desc', [f'insult {i}' for i in range(10)])}
+
+        def run(jobs, seed):
+            api_mock = Mock(spec=OAIApi)
+            api_mock.make_request.side_effect = lambda prompt, **kwargs: prompt
+            prompter = Prompter(prompts=prompts, sampler=Sampler(seed=seed))
+            results = PhraseWizard(api=api_mock).generate_many(jobs=jobs, rookery=rookery, prompter=prompter, workers=4)
+            return sorted((result['job'], result['phrase']) for result in results)
+
+        jobs = [{'name': 'Reginald', 'styles': ['Insult']} for _ in range(20)]
+        self.assertEqual(run(jobs, seed=7), run(jobs, seed=7))
+        self.assertNotEqual(run(jobs, seed=7), run(jobs, seed=8))
+        # A job's own seed fixes its prompts whatever the run's seed
+        seeded = [{'name': 'Reginald', 'styles': ['Insult'], 'seed': 'job'}]
+        self.assertEqual(run(seeded, seed=7), run(seeded, seed=8))
+
 
 if __name__ == '__main__':
     unittest.main()
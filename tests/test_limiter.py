@@ -0,0 +1,123 @@
+# tests/test_limiter.py
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.balancer import LoadBalancer
+from bird.core.limiter import ConcurrencyLimit, LimiterRegistry, TokenBucket, INITIAL_CONCURRENCY
+
+class TestTokenBucket(unittest.TestCase):
+
+    @patch('bird.core.limiter.time.monotonic')
+    def test_reserve(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        # Empty: the next token arrives in a tenth of a second, the one after in two
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.assertAlmostEqual(bucket.reserve(), 0.2)
+
+        # Refills at the rate, up to the capacity
+        mock_monotonic.return_value = 110.0
+        self.assertEqual(bucket.reserve(2), 0.0)
+        self.assertAlmostEqual(bucket.reserve(5), 0.5)
+
+class TestConcurrencyLimit(unittest.TestCase):
+
+    def test_fixed_limit(self):
+        limit = ConcurrencyLimit(max_limit=2)
+        limit.acquire()
+        limit.acquire()
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (limit.acquire(), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.05))
+        limit.release(latency=0.1)
+        self.assertTrue(acquired.wait(1))
+        waiter.join()
+        self.assertEqual(limit.inflight, 2)
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limit = ConcurrencyLimit(max_limit=8, adaptive=True)
+        self.assertEqual(limit.limit, INITIAL_CONCURRENCY)
+        for _ in range(40):
+            limit.acquire()
+            limit.release(latency=0.1)
+        self.assertEqual(limit.limit, 8)
+
+        limit.acquire()
+        limit.release(latency=0.1, overloaded=True)
+        self.assertEqual(limit.limit, 4)
+        # Overloads reported in the same round trip only back off once
+        limit.acquire()
+        limit.release(latency=None, overloaded=True)
+        self.assertEqual(limit.limit, 4)
+
+    def test_target_latency(self):
+        limit = ConcurrencyLimit(max_limit=8, adaptive=True, target_latency=0.5)
+        limit.acquire()
+        limit.release(latency=2.0)
+        self.assertEqual(limit.limit, INITIAL_CONCURRENCY / 2)
+
+    def test_configure_keeps_adaptive_limit(self):
+        limit = ConcurrencyLimit(max_limit=8, adaptive=True)
+        limit.acquire()
+        limit.release(latency=0.1, overloaded=True)
+        limit.configure(max_limit=16, adaptive=True)
+        self.assertEqual(limit.limit, INITIAL_CONCURRENCY / 2)
+        limit.configure(max_limit=16, adaptive=False)
+        self.assertEqual(limit.limit, 16)
+
+class TestAsyncConcurrencyLimit(unittest.IsolatedAsyncioTestCase):
+
+    async def test_waiters_and_cancellation(self):
+        limit = ConcurrencyLimit(max_limit=1)
+        await limit.aacquire()
+        cancelled = asyncio.ensure_future(limit.aacquire())
+        waiting = asyncio.ensure_future(limit.aacquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        limit.release(latency=0.1)
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual(limit.inflight, 1)
+        limit.release(latency=0.1)
+        self.assertEqual(limit.inflight, 0)
+
+class TestLimiterRegistry(unittest.TestCase):
+
+    def test_shared_per_endpoint(self):
+        registry = LimiterRegistry()
+        self.assertIsNone(registry.get('http://gpu-1', requests_per_second=None))
+        first = registry.get('http://gpu-1', requests_per_second=5)
+        second = registry.get('http://gpu-1', requests_per_second=10, concurrency_limit=2)
+        self.assertIs(first, second)
+        self.assertEqual(second.stats()['requests_per_second'], 10)
+        self.assertEqual(second.stats()['concurrency_limit'], 2)
+        self.assertIsNot(registry.get('http://gpu-2', requests_per_second=5), first)
+
+    def test_balancer_limits(self):
+        balancer = LoadBalancer(['http://limited-1', {'url': 'http://limited-2', 'adaptive_concurrency': True}],
+                                limits={'concurrency_limit': 8})
+        fixed, adaptive = balancer.backends
+        self.assertEqual(fixed.limiter.stats()['concurrency_limit'], 8)
+        self.assertEqual(adaptive.limiter.stats()['concurrency_limit'], INITIAL_CONCURRENCY)
+
+        lease = balancer.acquire()
+        while lease.backend is not adaptive:
+            lease.release(ok=True)
+            lease = balancer.acquire()
+        lease.throttle(tokens=100)
+        lease.release(ok=False, status=429)
+        self.assertEqual(adaptive.limiter.stats()['concurrency_limit'], INITIAL_CONCURRENCY // 2)
+        self.assertEqual(adaptive.limiter.stats()['inflight'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
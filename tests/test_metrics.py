@@ -0,0 +1,90 @@
+# tests/test_metrics.py
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import OAIApi, AsyncOAIApi, OAIApiException
+from bird.core.metrics import Metrics, NULL_TIMER, metrics
+from stub_server import StubCompletionServer
+
+class TestMetrics(unittest.TestCase):
+
+    def test_disabled(self):
+        registry = Metrics()
+        self.assertIs(registry.timer('prompt_build'), NULL_TIMER)
+        registry.observe('prompt_build', 0.5)
+        registry.increment('completion_errors', status=503)
+        self.assertEqual(registry.snapshot(), {'enabled': False, 'stages': {}, 'counters': []})
+
+    def test_snapshot(self):
+        registry = Metrics(enabled=True, buckets=(0.1, 1.0))
+        registry.observe('completion', 0.05)
+        registry.observe('completion', 0.5)
+        registry.observe('completion', 5.0)
+        with registry.timer('prompt_build'):
+            pass
+        registry.increment('completion_errors', status=503)
+        registry.increment('completion_errors', status=503)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['stages']['completion']['count'], 3)
+        self.assertAlmostEqual(snapshot['stages']['completion']['sum'], 5.55)
+        self.assertEqual(snapshot['stages']['completion']['buckets'], {'0.1': 1, '1.0': 2, '+Inf': 3})
+        self.assertEqual(snapshot['stages']['prompt_build']['count'], 1)
+        self.assertEqual(snapshot['counters'], [{'name': 'completion_errors', 'labels': {'status': '503'}, 'value': 2}])
+
+        registry.reset()
+        self.assertEqual(registry.snapshot()['stages'], {})
+
+    def test_prometheus(self):
+        registry = Metrics(enabled=True, buckets=(1.0,))
+        registry.observe('ttfb', 0.25)
+        registry.increment('completion_errors', status='connection')
+        registry.increment('cache_hits')
+        text = registry.prometheus()
+
+        self.assertIn('# TYPE bird_stage_seconds histogram', text)
+        self.assertIn('bird_stage_seconds_bucket{stage="ttfb",le="1.0"} 1', text)
+        self.assertIn('bird_stage_seconds_bucket{stage="ttfb",le="+Inf"} 1', text)
+        self.assertIn('bird_stage_seconds_count{stage="ttfb"} 1', text)
+        self.assertIn('bird_completion_errors_total{status="connection"} 1', text)
+        self.assertIn('bird_cache_hits_total 1', text)
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        metrics.reset()
+        metrics.configure(metrics=True)
+
+    def tearDown(self):
+        metrics.configure(metrics=False)
+        metrics.reset()
+
+    def test_api(self):
+        with StubCompletionServer(statuses=[400]) as stub:
+            with OAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                with self.assertRaises(OAIApiException):
+                    api.make_request('Test prompt')
+                api.make_request('Test prompt')
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['stages']['ttfb']['count'], 2)
+        self.assertEqual(snapshot['stages']['completion']['count'], 1)
+        self.assertEqual(snapshot['counters'], [{'name': 'completion_errors', 'labels': {'status': '400'}, 'value': 1}])
+
+    async def test_async_api(self):
+        with StubCompletionServer() as stub:
+            async with AsyncOAIApi(api_key='test_api_key', endpoint=stub.endpoint, max_tokens=100) as api:
+                await api.make_request('Test prompt')
+                await api.make_request('Test prompt')
+
+        stages = metrics.snapshot()['stages']
+        # The second request reuses the pooled connection
+        self.assertEqual(stages['connect']['count'], 1)
+        self.assertEqual(stages['ttfb']['count'], 2)
+        self.assertEqual(stages['json_decode']['count'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# tests/test_pool.py
+import os
+from collections import deque
+import tempfile
+import unittest
+from unittest.mock import Mock
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import OAIApi
+from bird.core.generator import PhraseWizard
+from bird.core.pool import PhrasePool
+from bird.core.prompter import Prompter
+from bird.core.rookery import Rookery
+from bird.model.bird import Bird
+from bird.model.prompt import Prompt
+
+def make_pool(**kwargs):
+    bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                description='Some description', promptMeta=['sonnets'], physicalDetails='Details', customStyle={})
+    rookery = Rookery(birds={'Reginald': bird})
+    prompter = Prompter(prompts={'Insult': Prompt('Insult', 'desc', ["an insult"])})
+    api_mock = Mock(spec=OAIApi)
+    counter = iter(range(1000000))
+    api_mock.make_request.side_effect = lambda prompt, **kwargs: f"phrase {next(counter)}"
+    api_mock.make_completions.side_effect = lambda prompt, n, **kwargs: [f"phrase {next(counter)}" for _ in range(n)]
+    wizard = PhraseWizard(api=api_mock)
+    return PhrasePool(wizard=wizard, rookery=rookery, prompter=prompter, **kwargs), api_mock
+
+class TestPhrasePool(unittest.TestCase):
+
+    def test_get_or_generate_no_repeats(self):
+        pool, _ = make_pool(size=5, low_water=0)
+        phrases = [pool.get_or_generate('Reginald', ['Insult']) for _ in range(5)]
+        self.assertEqual(len(set(phrases)), 5)
+        self.assertIsNone(pool.get('Reginald', ['Insult']))
+
+    def test_background_refill(self):
+        pool, api_mock = make_pool(size=4, low_water=2)
+        with pool:
+            self.assertIsNone(pool.get('Reginald', ['Insult']))
+        self.assertEqual(pool.stats(), {'pools': 1, 'phrases': 4})
+        pool.get('Reginald', ['Insult'])
+        pool.get('Reginald', ['Insult'])
+        pool.get('Reginald', ['Insult'])
+        with pool:
+            pass
+        self.assertEqual(pool.stats()['phrases'], 4)
+
+    def test_refill_unknown_bird(self):
+        pool, _ = make_pool()
+        with self.assertRaises(ValueError):
+            pool.refill(('Nobody', ('Insult',)))
+
+    def test_get_or_generate_failure(self):
+        pool, _ = make_pool()
+        with self.assertLogs('bird.core.pool', level='ERROR'):
+            self.assertIsNone(pool.get_or_generate('Nobody', ['Insult']))
+
+    def test_refill_skips_served_phrases(self):
+        pool, api_mock = make_pool(size=2, low_water=0, history=3)
+        api_mock.make_completions.side_effect = lambda prompt, n, **kwargs: ['a', 'b', 'c'][:n]
+        self.assertEqual([pool.get_or_generate('Reginald', ['Insult']) for _ in range(2)], ['a', 'b'])
+        # The same completions come back, but only the phrase not served yet is added
+        self.assertEqual(pool.refill(('Reginald', ('Insult',))), 0)
+        api_mock.make_completions.side_effect = lambda prompt, n, **kwargs: ['b', 'c'][:n]
+        self.assertEqual(pool.refill(('Reginald', ('Insult',))), 1)
+        self.assertEqual(pool.get('Reginald', ['Insult']), 'c')
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'pool.json')
+            pool, _ = make_pool(size=3, path=path)
+            pool.refill(('Reginald', ('Insult',)))
+            pool.stop()
+
+            restored, api_mock = make_pool(size=3, path=path)
+            self.assertEqual(restored.stats(), {'pools': 1, 'phrases': 3})
+            self.assertIsNotNone(restored.get('Reginald', ['Insult']))
+            api_mock.make_completions.assert_not_called()
+
+    def test_persistence_keeps_separators(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'pool.json')
+            pool, _ = make_pool(path=path)
+            pool.pools[('Reg|inald', ('In|sult', 'Burn'))] = deque(['a phrase'])
+            pool.save(path)
+
+            restored, _ = make_pool(path=path)
+            self.assertEqual(list(restored.pools), [('Reg|inald', ('In|sult', 'Burn'))])
+
+if __name__ == '__main__':
+    unittest.main()
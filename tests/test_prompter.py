@@ -8,6 +8,7 @@ import sys
 sys.path.append('.')
 
 from bird.core.prompter import Prompter
+from bird.model.bird import Bird
 from bird.model.prompt import Prompt
 
 class TestPrompter(unittest.TestCase):
@@ -28,6 +29,22 @@ class TestPrompter(unittest.TestCase):
         self.assertEqual(prompts['Compliment'].get_prompt(), "You look great")
         self.assertEqual(prompts['Insult'].get_prompt(), "You're terrible")
 
+    @patch('builtins.open', new_callable=mock_open, read_data='\n'.join([
+        json.dumps({"category": "Compliment", "description": "Compliments", "prompts": ["You look great"]}),
+        json.dumps({"category": "Insult", "description": "Insults", "prompts": ["You're terrible"]}),
+    ]))
+    def test_load_prompts_jsonl(self, mock_file):
+        prompts = Prompter.load_prompts('fake_path.jsonl')
+        self.assertEqual(list(prompts), ['Compliment', 'Insult'])
+        self.assertEqual(prompts['Insult'].description, "Insults")
+
+    @patch('builtins.open', new_callable=mock_open, read_data=json.dumps({
+        "Compliment": {"description": "Compliments", "prompts": [{"text": "You look great", "weight": -1}]}
+    }))
+    def test_load_prompts_invalid_weight(self, mock_file):
+        with self.assertRaises(ValueError):
+            Prompter.load_prompts('fake_path')
+
     @patch('bird.core.prompter.Prompter.load_prompts')
     def test_from_config(self, mock_load_prompts):
         mock_load_prompts.return_value = {'Compliment': Prompt('Compliment', 'desc', ['You look great'])}
@@ -43,6 +60,30 @@ class TestPrompter(unittest.TestCase):
         self.assertEqual(prompter.get_prompt('Compliment'), "You look great")
         self.assertEqual(prompter.get_prompt('Insult'), "You\'re terrible")
         self.assertIsNone(prompter.get_prompt('Unknown'))
+        self.assertEqual(prompter.get_prompt('insult'), "You\'re terrible")
+        self.assertIs(prompter.get_style('COMPLIMENT'), prompts['Compliment'])
+
+    def test_update(self):
+        compliment = Prompt('Compliment', 'desc', ['You look great'])
+        prompter = Prompter(prompts={'Compliment': compliment, 'Insult': Prompt('Insult', 'desc', ['Boo'])})
+        table = prompter.table
+        changed = prompter.update({'Compliment': Prompt('Compliment', 'desc', ['You look great']),
+                                   'Insult': Prompt('Insult', 'desc', ['Hiss']),
+                                   'Taunt': Prompt('Taunt', 'desc', ['Nyah'])})
+        self.assertEqual(sorted(changed), ['Insult', 'Taunt'])
+        self.assertEqual(prompter.get_prompt('insult'), 'Hiss')
+        self.assertEqual(prompter.get_prompt('TAUNT'), 'Nyah')
+        # The old snapshot is replaced whole, not modified
+        self.assertIsNot(prompter.table, table)
+        self.assertIsNone(table.get('taunt'))
+
+    def test_get_prompts(self):
+        bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                    description='Some description', promptMeta=['sonnets'], physicalDetails='Details',
+                    customStyle={'Burn': ['old English burns']})
+        prompter = Prompter(prompts={'Compliment': Prompt('Compliment', 'desc', ['You look great'])})
+        prompts = prompter.get_prompts(bird=bird, styles=['Compliment', 'Burn'])
+        self.assertEqual(prompts, ['You look great', 'old English burns', 'sonnets'])
 
 if __name__ == '__main__':
     unittest.main()
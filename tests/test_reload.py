@@ -0,0 +1,123 @@
+# tests/test_reload.py
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import OAIApi
+from bird.core.prompter import Prompter
+from bird.core.reload import Reloader
+from bird.core.rookery import Rookery
+from bird.core.util import load_config
+
+def make_bird(bird_id, name, species):
+    return {'bird_id': bird_id, 'name': name, 'species': species, 'persona': 'Poet', 'description': '',
+            'promptMeta': ['verse'], 'physicalDetails': '', 'customStyle': {}}
+
+class TestReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.dir, 'config.json')
+        self.bird_path = os.path.join(self.dir, 'birds.json')
+        self.prompt_path = os.path.join(self.dir, 'prompts.json')
+        self.config = {'endpoint': 'http://a.endpoint', 'api_key': 'test_api_key', 'max_tokens': 100,
+                       'bird_data_path': self.bird_path, 'prompt_data_path': self.prompt_path}
+        self.write(self.config_path, self.config)
+        self.write(self.bird_path, [make_bird(1, 'Reginald', 'Red Cardinal'), make_bird(2, 'Joey', 'Hawk')])
+        self.write(self.prompt_path, {'Insult': {'description': 'Insults', 'prompts': ['an insult']}})
+
+        config = load_config(self.config_path)
+        self.api = OAIApi.from_config(**config)
+        self.rookery = Rookery.from_config(**config)
+        self.prompter = Prompter.from_config(**config)
+        self.reloader = Reloader.from_config(api=self.api, rookery=self.rookery, prompter=self.prompter,
+                                             config_path=self.config_path, **config)
+
+    def tearDown(self):
+        self.reloader.stop()
+        self.api.close()
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data):
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        # Move the modification time forward, in case the file system's clock is coarse
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_unchanged(self):
+        self.assertEqual(self.reloader.check(), [])
+
+    def test_reload_birds(self):
+        reginald = self.rookery.get_bird('Reginald')
+        self.write(self.bird_path, [make_bird(1, 'Reginald', 'Red Cardinal'), make_bird(2, 'Joey', 'Blue Jay')])
+
+        self.assertEqual(self.reloader.check(), ['birds'])
+        self.assertIs(self.rookery.get_bird('Reginald'), reginald)
+        self.assertEqual(self.rookery.get_bird('Joey').species, 'Blue Jay')
+        self.assertEqual(self.reloader.check(), [])
+
+    def test_reload_prompts(self):
+        self.write(self.prompt_path, {'Taunt': {'description': 'Taunts', 'prompts': ['a taunt']}})
+        self.assertEqual(self.reloader.check(), ['prompts'])
+        self.assertIsNone(self.prompter.get_style('Insult'))
+        self.assertEqual(self.prompter.get_prompt('taunt'), 'a taunt')
+
+    def test_reload_config(self):
+        self.write(self.config_path, {**self.config, 'max_tokens': 50, 'endpoint': ['http://a.endpoint', 'http://b.endpoint']})
+        self.assertEqual(self.reloader.check(), ['config'])
+        self.assertEqual(self.api.max_tokens, 50)
+        self.assertEqual(len(self.api.balancer.backends), 2)
+
+    def test_config_moves_data(self):
+        other_path = os.path.join(self.dir, 'other_birds.json')
+        self.write(other_path, [make_bird(3, 'Pip', 'Robin')])
+        self.write(self.config_path, {**self.config, 'bird_data_path': other_path})
+
+        self.assertEqual(self.reloader.check(), ['config', 'birds'])
+        self.assertEqual(list(self.rookery.birds), ['Pip'])
+
+    def test_invalid_files_are_skipped(self):
+        with self.assertLogs('bird.core.reload', level='ERROR'):
+            self.write(self.bird_path, [{'name': 'Broken'}])
+            self.write(self.config_path, {**self.config, 'max_tokens': 'many'})
+            self.assertEqual(self.reloader.check(), [])
+        self.assertEqual(sorted(self.rookery.birds), ['Joey', 'Reginald'])
+        self.assertEqual(self.api.max_tokens, 100)
+
+        # Fixing the file reloads it on the next check
+        self.write(self.bird_path, [make_bird(3, 'Pip', 'Robin')])
+        self.assertEqual(self.reloader.check(), ['birds'])
+
+    def test_failed_apply_is_retried(self):
+        self.write(self.config_path, {**self.config, 'max_tokens': 50})
+        with self.assertLogs('bird.core.reload', level='ERROR'):
+            with patch.object(self.api, 'reconfigure', side_effect=RuntimeError('boom')):
+                self.assertEqual(self.reloader.check(), [])
+        self.assertEqual(self.reloader.config['max_tokens'], 100)
+
+        # The file is unchanged since, but was never applied
+        self.assertEqual(self.reloader.check(), ['config'])
+        self.assertEqual(self.api.max_tokens, 50)
+        self.assertEqual(self.reloader.check(), [])
+
+    def test_background_thread(self):
+        self.reloader.interval = 0.01
+        self.reloader.start()
+        self.write(self.prompt_path, {'Taunt': {'description': 'Taunts', 'prompts': ['a taunt']}})
+        for _ in range(500):
+            if self.prompter.get_style('Taunt') is not None:
+                break
+            self.reloader.stopped.wait(0.01)
+        self.reloader.stop()
+        self.assertIsNotNone(self.prompter.get_style('Taunt'))
+
+if __name__ == '__main__':
+    unittest.main()
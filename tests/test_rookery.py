@@ -28,6 +28,8 @@ class TestRookery(unittest.TestCase):
         birds = {'Reginald': mock_bird}
         rookery = Rookery(birds=birds)
         self.assertEqual(rookery.birds, birds)
+        # Templates are compiled as birds are first prompted
+        self.assertEqual(rookery.templates, {})
 
     @patch('builtins.open', new_callable=mock_open, read_data=json.dumps([{
         'bird_id': 1,
@@ -49,6 +51,20 @@ class TestRookery(unittest.TestCase):
         with self.assertRaises(ValueError):
             Rookery.load_birds('fake_path')
 
+    @patch('builtins.open', new_callable=mock_open, read_data=json.dumps([{
+        'bird_id': 1,
+        'name': 'Reginald',
+        'species': 'Red Cardinal',
+        'persona': 'Shakespeare',
+        'description': 'Some description',
+        'promptMeta': ['Meta info'],
+        'physicalDetails': 'Details',
+        'customStyle': {'Witty': [{'text': 'Pun', 'weight': 'heavy'}]}
+    }]))
+    def test_load_birds_invalid_weight(self, mock_file):
+        with self.assertRaises(ValueError):
+            Rookery.load_birds('fake_path')
+
     @patch('bird.core.rookery.Rookery.load_birds')  # Mock the static method load_birds
     def test_from_config(self, mock_load_birds):
         mock_load_birds.return_value = {'Reginald': mock_bird}
@@ -68,5 +84,55 @@ class TestRookery(unittest.TestCase):
         bird = rookery.get_bird('NotReginald')
         self.assertIsNone(bird)
 
+    def test_get_bird_case_insensitive(self):
+        rookery = Rookery(birds={'Reginald': mock_bird})
+        self.assertIs(rookery.get_bird('reginald'), mock_bird)
+        self.assertIs(rookery.get_bird_by_id(1), mock_bird)
+        self.assertIsNone(rookery.get_bird_by_id(2))
+
+    def test_find_birds(self):
+        joey = Bird(bird_id=2, name='Joey', species='Red-Tailed Hawk', persona='Rapper, Poet', description='',
+                    promptMeta=['Meta info'], physicalDetails='', customStyle={'Diss': ['a diss track']})
+        rookery = Rookery(birds={'Reginald': mock_bird, 'Joey': joey})
+
+        self.assertEqual(rookery.find_birds(species='red cardinal'), [mock_bird])
+        self.assertEqual(rookery.find_birds(persona='POET'), [joey])
+        self.assertEqual(rookery.find_birds(persona='shakespeare', custom_style='diss'), [])
+        self.assertEqual(rookery.find_birds(persona='poet', custom_style='Diss'), [joey])
+        self.assertEqual(rookery.find_birds(), [mock_bird, joey])
+
+    def test_update(self):
+        joey = Bird(bird_id=2, name='Joey', species='Red-Tailed Hawk', persona='Rapper', description='',
+                    promptMeta=['Meta info'], physicalDetails='', customStyle={})
+        rookery = Rookery(birds={'Reginald': mock_bird, 'Joey': joey})
+        rookery.templates['Reginald'] = 'reginald template'
+        rookery.templates['Joey'] = 'joey template'
+        self.assertEqual(rookery.find_birds(species='red-tailed hawk'), [joey])
+
+        # Reginald is reloaded unchanged, Joey changes species and Pip is new
+        reginald = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                        description='Some description', promptMeta=['Meta info'], physicalDetails='Details',
+                        customStyle={})
+        new_joey = Bird(bird_id=2, name='Joey', species='Blue Jay', persona='Rapper', description='',
+                        promptMeta=['Meta info'], physicalDetails='', customStyle={})
+        pip = Bird(bird_id=3, name='Pip', species='Robin', persona='Poet', description='', promptMeta=['Meta info'],
+                   physicalDetails='', customStyle={})
+        changed = rookery.update({'Reginald': reginald, 'Joey': new_joey, 'Pip': pip})
+
+        self.assertEqual(sorted(changed), ['Joey', 'Pip'])
+        self.assertIs(rookery.get_bird('Reginald'), mock_bird)
+        self.assertIs(rookery.get_bird('joey'), new_joey)
+        self.assertEqual(rookery.templates, {'Reginald': 'reginald template'})
+        self.assertEqual(rookery.find_birds(species='red-tailed hawk'), [])
+        self.assertEqual(rookery.find_birds(species='blue jay'), [new_joey])
+        self.assertIs(rookery.get_bird('pip'), pip)
+
+        self.assertEqual(rookery.update({'Reginald': reginald}), ['Joey', 'Pip'])
+        self.assertIsNone(rookery.get_bird('Joey'))
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            mock_bird.nickname = 'Reggie'
+
 if __name__ == '__main__':
     unittest.main()
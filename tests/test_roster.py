@@ -0,0 +1,108 @@
+# tests/test_roster.py
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.rookery import Rookery
+from bird.core.roster import LazyRoster
+from bird.model.bird import Bird
+
+def make_bird(bird_id, name, persona='Poet'):
+    return {'bird_id': bird_id, 'name': name, 'species': 'Red Cardinal', 'persona': persona,
+            'description': f'{name} description', 'promptMeta': ['sonnets'], 'physicalDetails': 'Details',
+            'customStyle': {}}
+
+class TestLazyRoster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'birds.jsonl')
+        birds = [make_bird(1, 'Reginald'), make_bird(2, 'Jay', persona='Lumberjack'), make_bird(3, 'Joey')]
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(json.dumps(bird) for bird in birds) + '\n\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup(self):
+        roster = LazyRoster(self.path, cache_size=2)
+        self.assertEqual(list(roster), ['Reginald', 'Jay', 'Joey'])
+        self.assertIn('Jay', roster)
+        self.assertNotIn('Nobody', roster)
+        jay = roster['Jay']
+        self.assertIsInstance(jay, Bird)
+        self.assertEqual(jay.persona, 'Lumberjack')
+        self.assertIs(roster['Jay'], jay)
+        self.assertIsNone(roster.get('Nobody'))
+        roster.close()
+
+    def test_lru(self):
+        roster = LazyRoster(self.path, cache_size=2)
+        for name in ['Reginald', 'Jay', 'Joey']:
+            roster[name]
+        self.assertEqual(list(roster.cache), ['Jay', 'Joey'])
+        roster.close()
+
+    def test_streaming_values(self):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(make_bird(4, 'Jay', persona='Redefined')) + '\n')
+        roster = LazyRoster(self.path)
+        self.assertEqual([(bird.name, bird.persona) for bird in roster.values()],
+                         [('Reginald', 'Poet'), ('Joey', 'Poet'), ('Jay', 'Redefined')])
+        self.assertEqual(len(roster.cache), 0)
+        roster.close()
+
+    def test_saved_index(self):
+        LazyRoster(self.path).close()
+        self.assertTrue(os.path.exists(self.path + '.index'))
+        with patch.object(LazyRoster, 'build_index') as mock_build:
+            roster = LazyRoster(self.path)
+        mock_build.assert_not_called()
+        self.assertEqual(roster['Joey'].bird_id, 3)
+        roster.close()
+
+        # Changing the file invalidates the saved index
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(make_bird(5, 'Robin')) + '\n')
+        os.utime(self.path, ns=(0, 0))
+        roster = LazyRoster(self.path)
+        self.assertEqual(roster['Robin'].bird_id, 5)
+        roster.close()
+
+    def test_invalid_line(self):
+        with open(self.path, 'a') as f:
+            f.write('not json\n')
+        with self.assertRaises(ValueError):
+            LazyRoster(self.path)
+
+    def test_rookery(self):
+        rookery = Rookery.from_config(bird_data_path=self.path, bird_cache_size=8)
+        self.assertIsInstance(rookery.birds, LazyRoster)
+        self.assertEqual(rookery.get_bird('joey').name, 'Joey')
+        self.assertEqual([bird.name for bird in rookery.find_birds(persona='poet')], ['Reginald', 'Joey'])
+        self.assertEqual([bird.name for bird in rookery.iter_birds()], ['Reginald', 'Jay', 'Joey'])
+        rookery.birds.close()
+
+    def test_rookery_update_closes_retired_roster(self):
+        rookery = Rookery.from_config(bird_data_path=self.path)
+        first = rookery.birds
+        rookery.update(LazyRoster(self.path))
+        # Kept open for readers that picked it up before the swap
+        self.assertFalse(first.file.closed)
+        second = rookery.birds
+        rookery.update(LazyRoster(self.path))
+        self.assertTrue(first.file.closed)
+        self.assertFalse(second.file.closed)
+        third = rookery.birds
+        rookery.update({})
+        self.assertTrue(second.file.closed)
+        third.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# tests/test_sampler.py
+import random
+import unittest
+from collections import Counter
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.prompter import Prompter
+from bird.core.sampler import Sampler, WeightedTable
+from bird.model.bird import Bird
+from bird.model.prompt import Prompt
+
+class TestWeightedTable(unittest.TestCase):
+
+    def test_weights(self):
+        table = WeightedTable(['a', {'text': 'b', 'weight': 3}, {'text': 'c', 'weight': 0}])
+        self.assertEqual(table.texts, ['a', 'b', 'c'])
+        self.assertEqual(table.cum_weights, [1.0, 4.0, 4.0])
+
+        counts = Counter(table.draw(random.Random(0), k=4000))
+        self.assertNotIn('c', counts)
+        self.assertAlmostEqual(counts['b'] / 4000, 0.75, delta=0.03)
+        self.assertEqual(sorted(table.shuffle(random.Random(0))), ['a', 'b'])
+
+    def test_invalid(self):
+        for entries in ([], [{'weight': 2}], [{'text': 'a', 'weight': -1}], [{'text': 'a', 'weight': 0}], [3]):
+            with self.assertRaises(ValueError):
+                WeightedTable(entries)
+
+class TestSampler(unittest.TestCase):
+
+    def test_seeded(self):
+        entries = [f'prompt {i}' for i in range(100)]
+        self.assertEqual(Sampler(seed=42).draw(entries, k=50), Sampler(seed=42).draw(entries, k=50))
+        self.assertNotEqual(Sampler(seed=42).draw(entries, k=50), Sampler(seed=43).draw(entries, k=50))
+
+    def test_table_is_cached(self):
+        entries = ['a', 'b']
+        sampler = Sampler(seed=0)
+        self.assertIs(sampler.table(entries), sampler.table(entries))
+        self.assertIsNot(sampler.table(entries), sampler.table(['a', 'b']))
+
+    def test_cycle(self):
+        entries = ['a', {'text': 'b', 'weight': 5}, 'c']
+        sampler = Sampler(seed=1, cycle=True)
+        texts = sampler.draw(entries, k=9)
+        for i in range(0, 9, 3):
+            self.assertEqual(sorted(texts[i:i + 3]), ['a', 'b', 'c'])
+        # The cycle carries over between calls
+        self.assertEqual(sorted(sampler.draw(entries, k=2) + [sampler.choice(entries)]), ['a', 'b', 'c'])
+
+    def test_draw_prompts(self):
+        bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare', description='',
+                    promptMeta=['sonnets', {'text': 'plays', 'weight': 0}], physicalDetails='',
+                    customStyle={'Burn': ['old English burns']})
+        prompter = Prompter(prompts={'Insult': Prompt('Insult', 'desc', ['an insult'])})
+        rows = Sampler(seed=0).draw_prompts(bird=bird, styles=['insult', 'Burn', 'Unknown'], prompter=prompter, k=3)
+        self.assertEqual(rows, [['an insult', 'old English burns', None, 'sonnets']] * 3)
+
+    def test_model_helpers(self):
+        bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare', description='',
+                    promptMeta=['sonnets', {'text': 'plays', 'weight': 0}], physicalDetails='',
+                    customStyle={'Burn': [{'text': 'old English burns', 'weight': 2}]})
+        # Weighted entries come back as their text
+        self.assertEqual(bird.get_prompt(), 'sonnets')
+        self.assertEqual(bird.get_custom_style('Burn', sampler=Sampler(seed=0)), 'old English burns')
+        self.assertIsNone(bird.get_custom_style('Unknown'))
+        self.assertEqual(Prompt('Insult', 'desc', [{'text': 'an insult'}]).get_prompt(), 'an insult')
+
+if __name__ == '__main__':
+    unittest.main()
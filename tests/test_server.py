@@ -0,0 +1,127 @@
+# tests/test_server.py
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import Mock
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.api import OAIApi, OAIApiException
+from bird.core.dedup import PhraseFilter
+from bird.core.metrics import metrics
+from bird.core.prompter import Prompter
+from bird.core.rookery import Rookery
+from bird.core.server import BirdServer
+from bird.model.bird import Bird
+from bird.model.prompt import Prompt
+
+class TestBirdServer(unittest.TestCase):
+
+    def setUp(self):
+        bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                    description='Some description', promptMeta=['sonnets'], physicalDetails='Details',
+                    customStyle={'Burn': ['old English burns']})
+        self.api = Mock(spec=OAIApi)
+        self.api.make_request.return_value = 'Generated text'
+        self.server = BirdServer(api=self.api, rookery=Rookery(birds={'Reginald': bird}),
+                                 prompter=Prompter(prompts={'Insult': Prompt('Insult', 'Insults', ['an insult'])}),
+                                 port=0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        host, port = self.server.address
+        self.base = f'http://{host}:{port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def get(self, path):
+        try:
+            with urllib.request.urlopen(self.base + path) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_birds(self):
+        status, body = self.get('/birds')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, [{'name': 'Reginald', 'species': 'Red Cardinal', 'persona': 'Shakespeare'}])
+
+    def test_styles(self):
+        status, body = self.get('/styles')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, [{'style': 'Insult', 'description': 'Insults'}])
+
+    def test_listings_follow_updates(self):
+        pip = Bird(bird_id=2, name='Pip', species='Robin', persona='Poet', description='', promptMeta=['verse'],
+                   physicalDetails='', customStyle={})
+        self.server.rookery.update({'Pip': pip})
+        self.server.prompter.update({'Taunt': Prompt('Taunt', 'Taunts', ['a taunt'])})
+        self.assertEqual(self.get('/birds')[1], [{'name': 'Pip', 'species': 'Robin', 'persona': 'Poet'}])
+        self.assertEqual(self.get('/styles')[1], [{'style': 'Taunt', 'description': 'Taunts'}])
+
+    def test_metrics(self):
+        metrics.configure(metrics=True)
+        try:
+            metrics.observe('completion', 0.5)
+            with urllib.request.urlopen(self.base + '/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                self.assertIn('bird_stage_seconds_count{stage="completion"} 1', response.read().decode())
+            status, body = self.get('/metrics.json')
+            self.assertEqual(body['stages']['completion']['count'], 1)
+        finally:
+            metrics.configure(metrics=False)
+            metrics.reset()
+
+    def test_backends(self):
+        self.api.balancer = Mock()
+        self.api.balancer.stats.return_value = [{'endpoint': 'http://a', 'requests': 2}]
+        status, body = self.get('/backends')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, [{'endpoint': 'http://a', 'requests': 2}])
+
+    def test_filter(self):
+        self.assertEqual(self.get('/filter'), (200, {'enabled': False}))
+        self.server.wizard.phrase_filter = PhraseFilter()
+        status, body = self.get('/filter')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['checked'], 0)
+        self.assertIsNone(body['acceptance_rate'])
+
+    def test_generate(self):
+        status, body = self.get('/generate?name=Reginald&style=Insult&style=Burn')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {'name': 'Reginald', 'styles': ['Insult', 'Burn', 'Witty'], 'phrase': 'Generated text'})
+
+    def test_generate_from_pool(self):
+        self.server.pool = Mock()
+        self.server.pool.get.return_value = 'Pooled text'
+        status, body = self.get('/generate?name=Reginald&style=Insult')
+        self.assertEqual(body['phrase'], 'Pooled text')
+        self.api.make_request.assert_not_called()
+
+        # Spellings and orders of the same bird and styles share one pool
+        status, body = self.get('/generate?name=REGINALD&style=insult&style=Burn&style=INSULT')
+        self.assertEqual(body['name'], 'Reginald')
+        self.assertEqual(body['styles'], ['Burn', 'Insult', 'Witty'])
+        self.assertEqual(self.server.pool.get.call_args_list[-1].kwargs, {'name': 'Reginald', 'styles': ['Burn', 'Insult']})
+
+    def test_generate_errors(self):
+        self.assertEqual(self.get('/generate?name=Reginald')[0], 400)
+        self.assertEqual(self.get('/generate?name=Nobody&style=Insult')[0], 404)
+        self.assertEqual(self.get('/generate?name=Reginald&style=Joke')[0], 400)
+        self.assertEqual(self.get('/nowhere')[0], 404)
+        self.api.make_request.side_effect = OAIApiException('down')
+        self.assertEqual(self.get('/generate?name=Reginald&style=Insult')[0], 502)
+
+    def test_shutdown_closes_api(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.api.close.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
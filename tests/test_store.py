@@ -0,0 +1,93 @@
+# tests/test_store.py
+import io
+import csv
+import json
+import os
+import tempfile
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.store import PhraseStore
+
+def make_result(name, styles, phrase, **details):
+    return {"name": name, "styles": styles, "phrase": phrase, **details}
+
+class TestPhraseStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "phrases.sqlite")
+        self.store = PhraseStore(path=self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_add_many(self):
+        stored = self.store.add_many([
+            make_result("Joey", ["Insult", "Witty"], "You absolute pigeon", prompts=["an insult"], latency=0.25,
+                        backend="http://a/"),
+            make_result("Joey", ["Insult", "Witty"], "Go peck a window"),
+            {"name": "Joey", "styles": ["Insult", "Witty"], "error": "API request failed"},
+            make_result("Reginald", ["Poem", "Witty"], "Shall I compare thee"),
+        ])
+
+        self.assertEqual(stored, 3)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.count("joey", ["insult", "witty"]), 2)
+        first = self.store.query(name="Joey", styles=["Insult", "Witty"])[0]
+        self.assertEqual(first["phrase"], "You absolute pigeon")
+        self.assertEqual(first["styles"], ["Insult", "Witty"])
+        self.assertEqual(first["prompts"], ["an insult"])
+        self.assertEqual((first["latency"], first["backend"]), (0.25, "http://a/"))
+        self.assertEqual([p["phrase"] for p in self.store.query(limit=1)], ["You absolute pigeon"])
+
+    def test_random_phrase(self):
+        phrases = [f"phrase {i}" for i in range(50)]
+        self.store.add_many(make_result("Joey", ["Insult", "Witty"], phrase) for phrase in phrases[:25])
+        self.store.add_many([make_result("Reginald", ["Insult", "Witty"], "not Joey")])
+        self.store.add_many(make_result("Joey", ["Insult", "Witty"], phrase) for phrase in phrases[25:])
+
+        seen = {self.store.random_phrase("JOEY", ["Insult", "Witty"])["phrase"] for _ in range(500)}
+        self.assertLessEqual(seen, set(phrases))
+        self.assertGreater(len(seen), 40)
+        self.assertIsNone(self.store.random_phrase("Joey", ["Poem", "Witty"]))
+
+    def test_persists(self):
+        self.store.add("Joey", ["Insult", "Witty"], "Still here")
+        self.store.close()
+        self.store = PhraseStore(path=self.path)
+        self.store.add("Joey", ["Insult", "Witty"], "Me too")
+        self.assertEqual([p["phrase"] for p in self.store.query("Joey", ["Insult", "Witty"])], ["Still here", "Me too"])
+        self.assertEqual(self.store.count("Joey", ["Insult", "Witty"]), 2)
+
+    def test_export(self):
+        self.store.add_many(make_result("Joey", ["Insult", "Witty"], f"phrase {i}", prompts=["an insult"])
+                            for i in range(2500))
+        self.store.add("Reginald", ["Poem", "Witty"], 'Said "hello", then left')
+
+        sink = io.StringIO()
+        self.assertEqual(self.store.export(sink, format="jsonl", name="Joey"), 2500)
+        lines = [json.loads(line) for line in sink.getvalue().splitlines()]
+        self.assertEqual([line["phrase"] for line in lines], [f"phrase {i}" for i in range(2500)])
+
+        sink = io.StringIO()
+        self.assertEqual(self.store.export(sink, format="csv", styles=["Poem", "Witty"]), 1)
+        rows = list(csv.DictReader(io.StringIO(sink.getvalue())))
+        self.assertEqual(rows[0]["phrase"], 'Said "hello", then left')
+        self.assertEqual(rows[0]["styles"], "Poem|Witty")
+
+        with self.assertRaises(ValueError):
+            self.store.export(io.StringIO(), format="xml")
+
+    def test_from_config(self):
+        self.assertIsNone(PhraseStore.from_config())
+        store = PhraseStore.from_config(phrase_store_path=os.path.join(self.tmp.name, "other.sqlite"))
+        self.assertIsInstance(store, PhraseStore)
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
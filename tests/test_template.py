@@ -0,0 +1,44 @@
+# tests/test_template.py
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.template import PromptTemplate
+from bird.model.bird import Bird
+from bird.model.example import Example
+
+class TestPromptTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.bird = Bird(bird_id=1, name='Reginald', species='Red Cardinal', persona='Shakespeare',
+                         description='Some description', promptMeta=['sonnets'], physicalDetails='Details',
+                         customStyle={})
+
+    def test_render(self):
+        template = PromptTemplate.compile(self.bird)
+        prompt = template.render(prompts=['an insult', 'sonnets'], styles=['Insult', 'Witty'])
+        self.assertEqual(prompt, 'Character: Reginald\n'
+                                 'Persona: Shakespeare\n'
+                                 'Description: Some description\n'
+                                 'Generate a phrase for this character.  It should be an insult, sonnets.\n'
+                                 'Reginald [Insult,Witty]: "')
+
+    def test_render_examples(self):
+        template = PromptTemplate.compile(self.bird)
+        examples = [Example(example_id=0, name='Reginald', styles=['Insult'], phrase='Thou knave!')]
+        prompt = template.render(prompts=['an insult'], styles=['Insult'], examples=examples)
+        self.assertTrue(prompt.startswith(template.header + 'Reginald [Insult]: "Thou knave!"\n'
+                                          + template.instruction))
+
+    def test_prefix_is_shared(self):
+        template = PromptTemplate.compile(self.bird)
+        first = template.render(prompts=['an insult'], styles=['Insult'])
+        second = template.render(prompts=['a compliment'], styles=['Compliment', 'Witty'])
+        self.assertTrue(first.startswith(template.prefix))
+        self.assertTrue(second.startswith(template.prefix))
+        self.assertIn('Description: Some description', template.prefix)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# tests/test_transport.py
+import asyncio
+import unittest
+import sys
+
+# Monkeypatch our local copy of the bird module
+sys.path.append('.')
+
+from bird.core.transport import AsyncConnectionPool, TransportException
+from stub_server import StubCompletionServer
+
+class TestAsyncConnectionPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_request_reuses_connection(self):
+        with StubCompletionServer(text='Test response') as stub:
+            pool = AsyncConnectionPool(stub.endpoint)
+            for _ in range(3):
+                response = await pool.request('POST', '/v1/completions', {}, b'{"prompt": "hi"}')
+                self.assertEqual(response.status, 200)
+                self.assertIn('Test response', response.text)
+            await pool.close()
+
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual(len(stub.requests), 3)
+
+    async def test_concurrent_requests(self):
+        with StubCompletionServer() as stub:
+            pool = AsyncConnectionPool(stub.endpoint, pool_size=4)
+            responses = await asyncio.gather(*[
+                pool.request('POST', '/v1/completions', {}, f'{{"prompt": "{i}"}}'.encode()) for i in range(8)
+            ])
+            await pool.close()
+
+        self.assertTrue(all(response.status == 200 for response in responses))
+        self.assertLessEqual(len(pool.idle), 4)
+
+    async def test_truncated_body(self):
+        with StubCompletionServer(truncate=True) as stub:
+            pool = AsyncConnectionPool(stub.endpoint)
+            with self.assertRaises(TransportException):
+                await pool.request('POST', '/v1/completions', {}, b'{"prompt": "hi"}')
+            await pool.close()
+        self.assertEqual(len(pool.idle), 0)
+
+    async def test_connection_refused(self):
+        pool = AsyncConnectionPool('http://127.0.0.1:1', connect_timeout=1)
+        with self.assertRaises(TransportException):
+            await pool.request('POST', '/v1/completions', {}, b'{}')
+
+    def test_encode_request(self):
+        pool = AsyncConnectionPool('http://gpu-1:8081', keep_alive=False)
+        headers = {'Authorization': 'Bearer key'}
+        request = pool.encode_request('POST', '/v1/completions', headers, b'{"prompt":"hi"}')
+        self.assertEqual(request, b'POST /v1/completions HTTP/1.1\r\nHost: gpu-1:8081\r\nConnection: close\r\n'
+                                  b'Authorization: Bearer key\r\nContent-Length: 15\r\n\r\n{"prompt":"hi"}')
+        # The head is reused until the headers are replaced
+        self.assertIs(pool.heads[('POST', '/v1/completions')][0], headers)
+        request = pool.encode_request('POST', '/v1/completions', {'Authorization': 'Bearer new'}, b'{}')
+        self.assertIn(b'Bearer new', request)
+
+    def test_unsupported_scheme(self):
+        with self.assertRaises(ValueError):
+            AsyncConnectionPool('ftp://example.com')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -59,5 +59,115 @@ class TestUtil(unittest.TestCase):
         with self.assertRaises(ValueError):
             validate_config(invalid_config)
 
+    def test_validate_config_invalid_transport(self):
+        invalid_config = {
+            "endpoint": "http://localhost:8081/",
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "read_timeout": "30"  # Should be a number, not a string
+        }
+        with self.assertRaises(ValueError):
+            validate_config(invalid_config)
+
+    def test_validate_config_endpoints(self):
+        config = {
+            "endpoint": ["http://gpu-1:8081/", {"url": "http://gpu-2:8081/", "weight": 2}],
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "balance_strategy": "weighted_round_robin"
+        }
+        validate_config(config)
+        config["endpoint"] = [{"weight": 2}]  # Missing the url
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
+    def test_validate_config_limits(self):
+        config = {
+            "endpoint": ["http://gpu-1:8081/", {"url": "http://gpu-2:8081/", "concurrency_limit": 4}],
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "requests_per_second": 5,
+            "tokens_per_minute": 90000,
+            "adaptive_concurrency": True
+        }
+        validate_config(config)
+        config["endpoint"][1]["concurrency_limit"] = 0
+        with self.assertRaises(ValueError):
+            validate_config(config)
+        config["endpoint"][1]["concurrency_limit"] = 4
+        config["requests_per_second"] = "5/s"
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
+    def test_validate_config_token_budget(self):
+        config = {
+            "endpoint": "http://localhost:8081/",
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "stop": ["\n"],
+            "adaptive_max_tokens": True,
+            "max_tokens_percentile": 90
+        }
+        validate_config(config)
+        config["stop"] = "\n"
+        with self.assertRaises(ValueError):
+            validate_config(config)
+        config["stop"] = ["\n"]
+        config["max_tokens_percentile"] = 150
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
+    def test_validate_config_phrase_filter(self):
+        config = {
+            "endpoint": "http://localhost:8081/",
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "phrase_filter": True,
+            "filter_threshold": 0.8,
+            "filter_retries": 2
+        }
+        validate_config(config)
+        config["filter_threshold"] = 0
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
+    def test_validate_config_phrase_store(self):
+        config = {
+            "endpoint": "http://localhost:8081/",
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "phrase_store_path": "data/phrases.sqlite"
+        }
+        validate_config(config)
+        config["phrase_store_path"] = True
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
+    def test_validate_config_reload_interval(self):
+        config = {
+            "endpoint": "http://localhost:8081/",
+            "api_key": "1234567890",
+            "max_tokens": 100,
+            "bird_data_path": "data/birds.json",
+            "prompt_data_path": "data/prompts.json",
+            "reload_interval": None
+        }
+        validate_config(config)
+        config["reload_interval"] = "5s"
+        with self.assertRaises(ValueError):
+            validate_config(config)
+
 if __name__ == '__main__':
     unittest.main()